@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令面板基准：两种面板（buttons：CmdContainer，list：虚拟化 CommandPanel）的启动耗时、内存与增量刷新耗时。
+
+  python3 benchmarks/bench_cmd_panel.py [--sizes 100,400,1600,10000] [--panels list,buttons]
+
+需要 PyQt5；无显示环境时自动使用 offscreen 平台。命令库为临时目录里的 JSON 库，不触碰 commands.json。
+startup：新建面板、同步并显示一帧；RSS 为此前后进程常驻内存之差（/proc/self/statm）。
+move / add：单次拖动或添加后只同步受影响的分组。list 面板为扁平模型 + QListView，启动、内存与 move / add 都基本不随命令总数增长。
+"""
+
+import argparse, gc, os, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QEvent  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from uart_core import JsonCommandLibrary, translate, save_groups  # noqa: E402
+from linux_free_uart import CmdContainer, CommandPanel  # noqa: E402
+
+PANELS = {"buttons": CmdContainer, "list": CommandPanel}
+
+GROUPS = 4
+
+
+class PanelHost:
+    """命令面板（CmdContainer / CommandPanel）需要的 SerialTool 接口子集"""
+
+    def __init__(self, library):
+        self.library = library
+
+    def _tr(self, key, **kwargs):
+        return translate(key, "en", **kwargs)
+
+    def _send_cmd(self, cmd):
+        pass
+
+    def _edit_dialog(self, cmd, group_id):
+        pass
+
+    def _create_new_group(self):
+        pass
+
+    def set_group_collapsed(self, group_id, collapsed):
+        self.library.update_group(group_id, collapsed=collapsed)
+
+    def edit_group(self, group_id):
+        pass
+
+    def move_command(self, cmd, from_group_id, to_group_id, before=None):
+        pass
+
+
+def make_library(directory, n):
+    groups = [{"id": f"g{i}", "name": f"Group {i}", "color": "#4A90E2", "collapsed": False,
+               "commands": [f"AT+CMD{j}" for j in range(i, n, GROUPS)]} for i in range(GROUPS)]
+    path = Path(directory) / f"commands_{n}.json"
+    save_groups(groups, path)
+    return JsonCommandLibrary(path)
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def timed(app, fn, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        app.sendPostedEvents(None, QEvent.DeferredDelete)  # 包括 deleteLater 的销毁开销
+        app.processEvents()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="100,400,1600,10000", help="comma-separated command counts")
+    ap.add_argument("--panels", default=",".join(PANELS), help="comma-separated panels to run")
+    ap.add_argument("--repeat", type=int, default=5, help="runs per case (best is reported)")
+    args = ap.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    print(f"{'panel':>7}  {'commands':>8}  {'startup':>10}  {'RSS':>9}  {'move (sync)':>12}  {'add (sync)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, kind in ((int(x), p) for x in args.sizes.split(",") for p in args.panels.split(",")):
+            panel_cls = PANELS[kind]
+            library = make_library(tmp, n)
+            host = PanelHost(library)
+
+            app.processEvents()
+            gc.collect()  # 上一个面板的残留回收不计入本次启动
+            rss0 = rss_mb()
+            t0 = time.perf_counter()
+            panel = panel_cls(host)
+            panel.resize(320, 600)
+            panel.sync()
+            panel.show()
+            app.processEvents()
+            t_start = (time.perf_counter() - t0) * 1000
+            rss = rss_mb() - rss0
+
+            def move(i):
+                # g0 首条命令移到 g1 末尾：只有两个分组需要比对
+                src, dst = ("g0", "g1") if i % 2 == 0 else ("g1", "g0")
+                cmd = library.commands(src)[0]
+                library.move_command(cmd, dst)
+                panel.sync((src, dst))
+
+            def add(i):
+                library.add_command("g2", f"AT+NEW{n}_{i}")
+                panel.sync(("g2",))
+
+            t_move = timed(app, move, args.repeat)
+            t_add = timed(app, add, args.repeat)
+            print(f"{kind:>7}  {n:>8}  {t_start:>7.1f} ms  {rss:>6.1f} MB  {t_move:>9.2f} ms  {t_add:>8.2f} ms")
+            panel.close()
+            panel.deleteLater()
+            app.sendPostedEvents(None, QEvent.DeferredDelete)  # processEvents 不执行 deleteLater，否则会算进下一个面板
+            app.processEvents()
+            library.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+脚本解析基准：生成数 MB 的脚本，测量 parse_script 的吞吐（MB/s），检查耗时是否与输入大小成正比。
+
+  python3 benchmarks/bench_parse.py [--mb 8]
+
+第一组：总大小翻倍（普通行 + base64 固件块混合），MB/s 应基本不变。
+第二组：总大小固定，单行 SEND 长度从 1 KiB 增加到 1 MiB（EXPECT/TIMEOUT 位于行尾），MB/s 同样应基本不变。
+第三组：同上，但长数据位于 EXPECT "ACK" 之后（旧解析器在此逐字符切片，128 KiB 的单行需要十几秒）。
+"""
+
+import argparse, base64, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from uart_core import parse_script, count_steps  # noqa: E402
+
+HEADER = "SET DEV = uart0\nSET ADDR=0x08000000\n"
+BODY = (
+    "SEND AT+CFG=$DEV,${ADDR} EXPECT /OK\\r?\\n/ TIMEOUT 500\n"
+    "SEND AT+PING EXPECT \"PONG\"\n"
+    "DELAY 1\n"
+    "# comment line\n"
+)
+
+
+def chunk_line(rng, line_bytes, trailing=False):
+    """一行 base64 固件块：SEND FW <payload> EXPECT ACK TIMEOUT 2000（trailing 时数据在 EXPECT 之后）"""
+    n = line_bytes * 3 // 4
+    payload = base64.b64encode(rng.getrandbits(8 * n).to_bytes(n, "little")).decode()
+    if trailing:
+        return f'SEND FW EXPECT "ACK" {payload}\n'
+    return f"SEND FW {payload} EXPECT ACK TIMEOUT 2000\n"
+
+
+def make_script(total_bytes, line_bytes, trailing=False, seed=1):
+    rng = random.Random(seed)
+    chunk = chunk_line(rng, line_bytes, trailing)  # 同一行重复即可，解析器不缓存行
+    parts = [HEADER, "LOOP 2 {\n"]
+    size = sum(map(len, parts))
+    while size < total_bytes:
+        parts.append(BODY)
+        parts.append(chunk)
+        size += len(BODY) + len(chunk)
+    parts.append("}\n")
+    return "".join(parts)
+
+
+def bench(text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        tree = parse_script(text)
+        best = min(best, time.perf_counter() - t0)
+    return tree, best
+
+
+def row(label, text, repeat):
+    tree, dt = bench(text, repeat)
+    mb = len(text) / (1024 * 1024)
+    print(f"{label:<24} {mb:>8.2f} MB  {count_steps(tree):>9} steps  {dt * 1000:>9.1f} ms  {mb / dt:>8.1f} MB/s")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--mb", type=int, default=8, help="largest generated script size in MB")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per case (best is reported)")
+    args = ap.parse_args(argv)
+
+    print("== size sweep (4 KiB firmware lines) ==")
+    mb = 1
+    while mb <= args.mb:
+        row(f"{mb} MB", make_script(mb * 1024 * 1024, 4096), args.repeat)
+        mb *= 2
+
+    print(f"== line length sweep ({args.mb} MB total) ==")
+    for line_bytes in (1024, 16 * 1024, 256 * 1024, 1024 * 1024):
+        row(f"{line_bytes // 1024} KiB lines", make_script(args.mb * 1024 * 1024, line_bytes), args.repeat)
+
+    print(f"== data after EXPECT ({args.mb} MB total) ==")
+    for line_bytes in (1024, 16 * 1024, 256 * 1024, 1024 * 1024):
+        row(f"{line_bytes // 1024} KiB tails", make_script(args.mb * 1024 * 1024, line_bytes, True), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pty 基准套件：设备为 uart_core.VirtualDevice（at 模式，pty 主端），从端经 pyserial 打开（与 CLI 相同的代码路径）。
+
+  python3 benchmarks/bench_pty.py [--quick] [--json results.json] [--baseline old.json]
+
+场景：
+  parse    parse_script + flatten_cmds：MB/s、步/秒
+  rx       设备全速输出（AT+DUMP），经 SerialLink -> PortLog（接收数据到日志文件）：bytes/s
+  steps    SEND/EXPECT 循环，设备零延迟：thread / async 引擎的步/秒
+  expect   设备带延迟、分块应答：EXPECT 匹配延迟 p50/p90/p99/max
+           （设备写出应答最后一个字节 -> 引擎开始下一步，即工具自身的开销）
+最后报告进程峰值 RSS（resource.getrusage）。--json 保存结果，--baseline 与旧结果逐项对比。
+需要 pyserial。
+"""
+
+import argparse, asyncio, json, os, platform, resource, sys, tempfile, threading, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from uart_core import (  # noqa: E402
+    APP_VERSION, parse_script, flatten_cmds, compile_script, count_steps,
+    SerialLink, ScriptEngine, PortLog, open_virtual_serial, percentile,
+)
+
+
+# ---------- 统计 ----------
+def latency_stats(samples_s):
+    ms = sorted(x * 1000.0 for x in samples_s)
+    return {"n": len(ms), "p50_ms": percentile(ms, 50), "p90_ms": percentile(ms, 90),
+            "p99_ms": percentile(ms, 99), "max_ms": ms[-1] if ms else None}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # Linux 单位为 KiB
+
+
+# ---------- 场景 ----------
+SCRIPT_BODY = (
+    "SEND AT+CFG=$DEV,${ADDR} EXPECT /OK\\r?\\n/ TIMEOUT 500\n"
+    "SEND AT+PING EXPECT \"PONG\"\n"
+    "DELAY 1\n"
+    "# comment line\n"
+)
+
+
+def bench_parse(size_bytes):
+    parts = ["SET DEV = uart0\nSET ADDR=0x08000000\nLOOP 2 {\n"]
+    size = len(parts[0])
+    while size < size_bytes:
+        parts.append(SCRIPT_BODY)
+        size += len(SCRIPT_BODY)
+    parts.append("}\n")
+    text = "".join(parts)
+    t0 = time.perf_counter()
+    tree = parse_script(text)
+    t_parse = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    flat = flatten_cmds(tree, limit=10 ** 9)
+    t_flat = time.perf_counter() - t0
+    mb = len(text) / (1024 * 1024)
+    return {"mb": round(mb, 3), "parse_mb_per_s": mb / t_parse, "flatten_steps": len(flat),
+            "flatten_steps_per_s": len(flat) / t_flat}
+
+
+def bench_rx(nbytes, tmpdir):
+    """设备全速输出（AT+DUMP） -> SerialLink 读线程 -> PortLog 写文件"""
+    ser = open_virtual_serial("at", baud=921600)
+    link = SerialLink(ser)
+    log = PortLog("bench", path=os.path.join(tmpdir, "rx.log"), prefix=True)
+    got = [0]
+    done = threading.Event()
+
+    def on_rx(data):
+        log.rx(data)
+        got[0] += len(data)
+        if got[0] >= nbytes:
+            done.set()
+
+    link.subscribe(on_rx)
+    link.start()
+    try:
+        t0 = time.perf_counter()
+        link.write(f"AT+DUMP={nbytes}\r\n".encode())
+        done.wait(60)
+        dt = time.perf_counter() - t0
+    finally:
+        link.stop()
+        ser.close()  # 设备线程随之结束
+        log.close()
+    return {"bytes": got[0], "bytes_per_s": got[0] / dt}
+
+
+def _run_thread_engine(program, ser, on_log):
+    link = SerialLink(ser)
+    link.start()
+    try:
+        return ScriptEngine(program, link, on_log=on_log).run()
+    finally:
+        link.stop()
+
+
+def _run_async_engine(program, ser, on_log):
+    from uart_async import AsyncSerialLink, AsyncScriptEngine
+
+    async def main():
+        link = AsyncSerialLink(ser)
+        link.start()
+        try:
+            return await AsyncScriptEngine(program, link, on_log=on_log).run()
+        finally:
+            link.stop()
+
+    return asyncio.run(main())
+
+
+ENGINES = {"thread": _run_thread_engine, "async": _run_async_engine}
+
+
+def run_script(engine, text, **device):
+    """在虚拟设备上运行脚本；返回 (步数, 耗时, 每个 EXPECT 的匹配延迟列表)"""
+    reply_times = []  # 每个应答最后一个字节写出的时间
+    ser = open_virtual_serial("at", baud=921600, on_reply=lambda: reply_times.append(time.perf_counter()),
+                              **device)
+    send_times = []
+    program = compile_script(parse_script(text))
+
+    def on_log(line):
+        if " SEND " in line:
+            send_times.append(time.perf_counter())
+
+    try:
+        t0 = time.perf_counter()
+        ok, msg = ENGINES[engine](program, ser, on_log)
+        t_end = time.perf_counter()
+    finally:
+        ser.close()
+    if not ok:
+        raise RuntimeError(f"{engine} engine failed: {msg}")
+    # 第 i 个应答写完 -> 引擎开始第 i+1 步（最后一步以 run() 返回为准）
+    resumed = send_times[1:] + [t_end]
+    latencies = [r - w for w, r in zip(reply_times, resumed)]
+    return count_steps(program), t_end - t0, latencies
+
+
+def bench_steps(engine, steps):
+    n, dt, _ = run_script(engine, f"LOOP {steps} {{\n  SEND AT EXPECT OK TIMEOUT 2000\n}}\n")
+    return {"steps": n, "steps_per_s": n / dt}
+
+
+def bench_expect(engine, steps, latency_ms, chunk, chunk_gap_ms):
+    text = f"LOOP {steps} {{\n  SEND AT+PING EXPECT /OK\\r\\n/ TIMEOUT 5000\n}}\n"
+    _, _, lat = run_script(engine, text, latency_ms=latency_ms, chunk=chunk, chunk_gap_ms=chunk_gap_ms,
+                           responses={"AT+PING": "+PING: " + "x" * 200 + "\r\nOK"})
+    return latency_stats(lat)
+
+
+# ---------- 报告 ----------
+def flatten_results(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten_results(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(results, baseline):
+    old = flatten_results(baseline.get("results", {}))
+    new = flatten_results(results)
+    print(f"\n== vs. baseline {baseline.get('version', '?')} ({baseline.get('timestamp', '?')}) ==")
+    for key in sorted(new):
+        if key in old and old[key]:
+            change = (new[key] - old[key]) / old[key] * 100.0
+            print(f"{key:<36} {old[key]:>14.2f} -> {new[key]:>14.2f}  {change:+7.1f}%")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--quick", action="store_true", help="smaller sizes (smoke test)")
+    ap.add_argument("--json", metavar="FILE", help="write results as JSON")
+    ap.add_argument("--baseline", metavar="FILE", help="compare with a previous --json result")
+    ap.add_argument("--latency-ms", type=float, default=2.0, help="device reply latency for the expect scenario")
+    ap.add_argument("--chunk", type=int, default=16, help="device reply chunk size for the expect scenario")
+    ap.add_argument("--chunk-gap-ms", type=float, default=0.2, help="pause between reply chunks")
+    args = ap.parse_args(argv)
+
+    scale = 0.1 if args.quick else 1.0
+    steps = max(50, int(5000 * scale))
+    expect_steps = max(20, int(500 * scale))
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        r = results["parse"] = bench_parse(int(4 * 1024 * 1024 * scale))
+        print(f"parse      {r['parse_mb_per_s']:>10.1f} MB/s      flatten {r['flatten_steps_per_s']:>12,.0f} steps/s")
+
+        r = results["rx"] = bench_rx(int(64 * 1024 * 1024 * scale), tmp)
+        print(f"rx -> log  {r['bytes_per_s'] / 1e6:>10.1f} MB/s      ({r['bytes']} bytes)")
+
+        results["steps"] = {}
+        results["expect"] = {}
+        for engine in ENGINES:
+            r = results["steps"][engine] = bench_steps(engine, steps)
+            print(f"steps      {r['steps_per_s']:>10,.0f} steps/s   [{engine}]")
+        for engine in ENGINES:
+            r = results["expect"][engine] = bench_expect(engine, expect_steps, args.latency_ms,
+                                                         args.chunk, args.chunk_gap_ms)
+            print(f"expect     p50 {r['p50_ms']:.3f} ms  p90 {r['p90_ms']:.3f} ms  "
+                  f"p99 {r['p99_ms']:.3f} ms  max {r['max_ms']:.3f} ms   [{engine}]")
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"peak RSS   {results['peak_rss_mb']:>10.1f} MB")
+
+    doc = {
+        "version": APP_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"quick": args.quick, "steps": steps, "expect_steps": expect_steps,
+                   "latency_ms": args.latency_ms, "chunk": args.chunk, "chunk_gap_ms": args.chunk_gap_ms},
+        "results": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(doc, indent=2), encoding="utf-8")
+    if args.baseline:
+        compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+脚本 IR 基准：对比“每步解释”与“预编译步骤”的单步准备开销（步/秒）。
+
+  python3 benchmarks/bench_script_ir.py [--steps 200000]
+
+旧路径：每个 SEND 逐字符 expand_vars，每个 EXPECT 重新判断 /.../ 并 re.compile。
+新路径：compile_script 一次，运行时只取预编码 payload（或按槽位拼接 bytes）并构造 ExpectMatcher。
+两条路径都包含 UTF-8 编码，不涉及串口 I/O。
+"""
+
+import argparse, re, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from uart_core import (  # noqa: E402
+    parse_script, compile_script, iter_steps, count_steps,
+    expand_vars, ExpectMatcher, LINE_ENDING,
+)
+
+SCRIPT = """
+SET DEV = uart0
+SET BAUD = 921600
+LOOP {loops} {{
+    SEND AT+CFG=$DEV,${{BAUD}},8N1 EXPECT /OK\\r?\\n/ TIMEOUT 500
+    SEND AT+PING=\\$literal EXPECT "PONG"
+    SEND AT+STATUS
+    SEND HEX 55 AA 01 EXPECT HEX AA 55
+    DELAY 0
+}}
+"""
+
+
+def run_legacy(tree):
+    variables = {}
+    n = 0
+    for step in iter_steps(tree):
+        op = step[0]
+        if op == "SET":
+            variables[step[1]] = step[2]
+        elif op == "SEND":
+            (expand_vars(step[1], variables) + "\r\n").encode()
+            expect = step[2]
+            if expect:
+                if len(expect) >= 2 and expect[0] == "/" and expect[-1] == "/":
+                    re.compile(expect[1:-1])
+                expect.encode("utf-8")
+        n += 1
+    return n
+
+
+def run_compiled(program):
+    variables = {}
+    n = 0
+    for step in iter_steps(program):
+        op = step.op
+        if op == "SET":
+            variables[step.name] = step.data
+        elif op == "SEND":
+            if step.payload is None:
+                step.template.render_bytes(variables) + LINE_ENDING
+            if step.expect_spec is not None:
+                ExpectMatcher(step.expect_spec)
+        n += 1
+    return n
+
+
+def bench(fn, arg):
+    t0 = time.perf_counter()
+    n = fn(arg)
+    dt = time.perf_counter() - t0
+    return n, dt
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--steps", type=int, default=200000, help="approximate number of executed steps")
+    args = ap.parse_args(argv)
+
+    loops = max(1, args.steps // 5)
+    tree = parse_script(SCRIPT.format(loops=loops))
+    t0 = time.perf_counter()
+    program = compile_script(tree)
+    compile_ms = (time.perf_counter() - t0) * 1000
+    total = count_steps(program)
+
+    n_old, dt_old = bench(run_legacy, tree)
+    n_new, dt_new = bench(run_compiled, program)
+    assert n_old == n_new == total
+
+    print(f"steps:          {total}")
+    print(f"compile:        {compile_ms:.3f} ms")
+    print(f"interpreted:    {n_old / dt_old:>12,.0f} steps/s  ({dt_old:.3f} s)")
+    print(f"compiled:       {n_new / dt_new:>12,.0f} steps/s  ({dt_new:.3f} s)")
+    print(f"speedup:        {dt_old / dt_new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
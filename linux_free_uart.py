@@ -9,156 +9,112 @@ linux_free_uart - Linux 串口调试工具（支持命令分组 & 拖拽排序 &
 - 支持：右侧命令用鼠标拖动上下移动，并自动保存到 commands.json
 - 脚本 DSL：SEND / DELAY / WAIT / LOOP / SET / 变量展开
 - 新增：SEND 可选 EXPECT/TIMEOUT，串口返回匹配后再继续，否则超时报错
+- 无界面运行：python linux_free_uart.py run <脚本> --port <串口> [--baud N]（见 uart_core）
+- 启动分析：python linux_free_uart.py --profile-startup 打印各启动阶段耗时后退出
 - 授权：MIT License（开源）；作者 moonlitcodex
 """
 
-import json, sys, time, re, uuid
+import sys, time
+
+_STARTUP_T0 = time.perf_counter()  # --profile-startup 的计时起点（解释器启动之后）
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # 命令行子命令在导入 PyQt5 之前分发，CI 主机无需 X/Qt
+    from uart_core import CLI_COMMANDS, cli_main
+    if sys.argv[1] in CLI_COMMANDS:
+        sys.exit(cli_main(sys.argv[1:]))
+
+import bisect, json, codecs
+from collections import deque
 from pathlib import Path
-import serial, serial.tools.list_ports
+import serial
+_STARTUP_IMPORTS = [("import stdlib + pyserial", time.perf_counter())]
 
-from PyQt5.QtCore import QTimer, Qt, QMimeData, QEvent, QThread, pyqtSignal
+from PyQt5.QtCore import (
+    QTimer, QObject, Qt, QMimeData, QEvent, QThread, pyqtSignal,
+    QAbstractListModel, QModelIndex, QPersistentModelIndex, QRect, QSize
+)
 from PyQt5.QtGui import (
-    QDrag, QColor, QIcon, QPixmap, QPainter, QLinearGradient, QFont, QPen
+    QDrag, QColor, QIcon, QPixmap, QPainter, QLinearGradient, QFont, QPen,
+    QTextCursor
 )
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QLabel, QPushButton, QTextEdit, QLineEdit,
+    QApplication, QWidget, QLabel, QPushButton, QPlainTextEdit, QLineEdit,
     QVBoxLayout, QHBoxLayout, QComboBox, QScrollArea, QMessageBox,
     QInputDialog, QFileDialog, QSizePolicy, QColorDialog, QDialog,
-    QFormLayout, QDialogButtonBox, QFrame, QRadioButton
+    QFormLayout, QDialogButtonBox, QFrame, QRadioButton, QSpinBox, QCheckBox,
+    QListView, QAbstractItemView, QStyledItemDelegate, QStyle, QStyleOptionButton
 )
+_STARTUP_IMPORTS.append(("import PyQt5", time.perf_counter()))
+
+from uart_core import (
+    APP_NAME, APP_VERSION, APP_AUTHOR, APP_LICENSE, APP_EMAIL,
+    LANGUAGES, translate, open_command_library,
+    SerialLink, CAPTURE_COMPRESSIONS, CaptureWriter, export_capture, PortMonitor,
+    VIRTUAL_MODES, VirtualDevice, virtual_port_names, parse_virtual_port,
+    EXPECT_MAX_LOOKBACK, LINE_ENDING, describe_bytes,
+    ScriptEngine, describe_analysis, ScriptCache, RunMetrics, describe_metrics,
+)
+_STARTUP_IMPORTS.append(("import uart_core", time.perf_counter()))
 
-# ---------- 基础信息 ----------
-APP_NAME = "linux_free_uart"
-APP_VERSION = "1.0.0"
-APP_AUTHOR = "moonlitcodex"
-APP_LICENSE = "MIT License"
-APP_EMAIL = "moonlitcodex@qq.com"
-
-# ---------- 语言与翻译 ----------
-LANGUAGES = {
-    "en": "English",
-    "zh": "简体中文",
-}
 
-TRANSLATIONS = {
-    "title_main": {
-        "en": f"{APP_NAME} - Serial Assistant",
-        "zh": f"{APP_NAME} - 串口调试助手",
-    },
-    "label_port": {"en": "Port:", "zh": "串口:"},
-    "btn_refresh": {"en": "Refresh", "zh": "刷新"},
-    "label_baud": {"en": "Baud:", "zh": "波特率:"},
-    "btn_open": {"en": "Open", "zh": "打开串口"},
-    "btn_close": {"en": "Close", "zh": "关闭串口"},
-    "btn_send": {"en": "Send", "zh": "发送"},
-    "btn_save_button": {"en": "Save as Button", "zh": "保存为按钮"},
-    "label_command_buttons": {"en": "Command Buttons", "zh": "命令按钮"},
-    "btn_clear_log": {"en": "Clear Log", "zh": "清空日志"},
-    "btn_export_log": {"en": "Export Log", "zh": "导出日志"},
-    "btn_run_script": {"en": "Run Script", "zh": "运行脚本"},
-    "btn_stop_script": {"en": "Stop Script", "zh": "停止脚本"},
-    "btn_about": {"en": "About", "zh": "关于"},
-    "btn_settings": {"en": "Settings", "zh": "设置"},
-    "btn_new_group": {"en": "+ New Group", "zh": "+ 新建分组"},
-    "placeholder_empty_group": {"en": "Drag commands here", "zh": "拖拽命令到此处"},
-    "placeholder_no_device": {"en": "<No Device>", "zh": "<无设备>"},
-    "msg_no_port_title": {"en": "Notice", "zh": "提示"},
-    "msg_no_port": {"en": "No serial device detected.", "zh": "未检测到串口设备！"},
-    "msg_opened": {"en": "[Opened: {port} @ {baud}]", "zh": "[串口已打开: {port} @ {baud}]"},
-    "msg_closed": {"en": "[Serial closed]", "zh": "[串口已关闭]"},
-    "msg_open_first": {"en": "[Please open serial port first]", "zh": "[请先打开串口]"},
-    "msg_send_error": {"en": "[Send error] {err}", "zh": "[发送错误] {err}"},
-    "msg_recv_error": {"en": "[Receive error] {err}", "zh": "[接收错误] {err}"},
-    "msg_run_script_title": {"en": "Notice", "zh": "提示"},
-    "msg_run_script_need_open": {"en": "Please open the serial port before running script.", "zh": "请先打开串口，再运行脚本。"},
-    "msg_script_running": {"en": "Script is running. Stop it or wait to finish.", "zh": "脚本正在运行中。请先停止或等待完成。"},
-    "msg_script_load_error_title": {"en": "Script Error", "zh": "脚本错误"},
-    "msg_script_loaded": {"en": "[Script] Loaded {steps} steps; start executing.", "zh": "[脚本] 加载成功，共 {steps} 步；开始执行。"},
-    "msg_script_stopping": {"en": "[Script] Stopping…", "zh": "[脚本] 停止中…"},
-    "msg_script_result": {"en": "[Script] {msg}", "zh": "[脚本] {msg}"},
-    "msg_export_no_log": {"en": "No log to export.", "zh": "没有日志可导出！"},
-    "msg_export_title": {"en": "Export Log", "zh": "导出日志"},
-    "msg_export_success": {"en": "Log saved to: {path}", "zh": "日志已保存到: {path}"},
-    "msg_export_fail": {"en": "Save failed: {err}", "zh": "保存失败: {err}"},
-    "msg_save_success_title": {"en": "Success", "zh": "成功"},
-    "msg_question_title": {"en": "Question", "zh": "提示"},
-    "msg_replace_or_copy": {
-        "en": "Replace this button?\nOld: {old}\nNew: {new}\nYes = replace; No = duplicate.",
-        "zh": "要把\n『{old}』\n替换为\n『{new}』吗？\n选\"否\"将保留旧命令并新增新按钮。"
-    },
-    "msg_cmd_exists": {"en": "Command already exists!", "zh": "命令已存在！"},
-    "msg_cmd_exists_warn_title": {"en": "Warning", "zh": "提示"},
-    "msg_group_delete_warn": {"en": "At least one group must remain.", "zh": "至少需要保留一个分组！"},
-    "msg_group_delete_confirm": {
-        "en": "Delete group \"{name}\"? Commands will move to the first group.",
-        "zh": "确定要删除分组\"{name}\"吗？\n分组内的命令将移至第一个分组。"
-    },
-    "about_title": {"en": "About", "zh": "关于"},
-    "about_body": {
-        "en": (
-            "{name}\n"
-            "Linux serial assistant\n"
-            "Version: {version}\n"
-            "Author: {author}\n"
-            "Email: {email}\n"
-            "Copyright: (c) 2024 {author}\n"
-            "License: {license} (open source)\n"
-            "MIT License: free to use, modify, and distribute with attribution."
-        ),
-        "zh": (
-            "{name}\n"
-            "Linux 串口调试助手\n"
-            "版本: {version}\n"
-            "作者: {author}\n"
-            "邮箱: {email}\n"
-            "版权: (c) 2024 {author}\n"
-            "许可证: {license}（开源）\n"
-            "遵循 MIT License 发布，可自由使用、修改和分发，保留作者署名。"
-        ),
-    },
-    "label_lang": {"en": "Language", "zh": "语言"},
-    "dlg_edit_group_title": {"en": "Edit Group", "zh": "编辑分组"},
-    "dlg_group_name": {"en": "Group Name:", "zh": "分组名称:"},
-    "dlg_choose_color": {"en": "Select color:", "zh": "选择颜色:"},
-    "dlg_custom_color": {"en": "Custom Color...", "zh": "自定义颜色..."},
-    "dlg_delete_group": {"en": "Delete Group", "zh": "删除分组"},
-    "dlg_current_color": {"en": "Current color: {color}", "zh": "当前颜色: {color}"},
-    "dlg_new_group_title": {"en": "New Group", "zh": "新建分组"},
-    "dlg_new_group_prompt": {"en": "Please enter group name:", "zh": "请输入分组名称:"},
-    "dlg_edit_cmd_title": {"en": "Edit/Copy/Delete Command", "zh": "编辑/复制/删除命令"},
-    "dlg_edit_cmd_text": {
-        "en": "Edit then press OK.\nEmpty -> delete;\nYes -> replace; No -> duplicate.",
-        "zh": "修改内容后点\"确定\"\n留空 → 删除；\n修改后选择\"是\" → 替换；\n修改后选择\"否\" → 复制为新："
-    },
-    "dlg_open_script_title": {"en": "Select Script File", "zh": "选择脚本文件"},
-    "dlg_choose_group_title": {"en": "Choose Group", "zh": "选择分组"},
-    "dlg_choose_group_prompt": {"en": "Add command to which group?", "zh": "请选择要添加到的分组:"},
-    "dlg_settings_title": {"en": "Settings", "zh": "设置"},
-    "label_theme": {"en": "Theme", "zh": "主题"},
-    "theme_light": {"en": "Light", "zh": "亮色"},
-    "theme_dark": {"en": "Dark", "zh": "暗色"},
-    "msg_open_fail_title": {"en": "Open Failed", "zh": "打开失败"},
-    "msg_export_no_path": {"en": "No path selected.", "zh": "未选择路径。"},
-    "msg_script_need_open_title": {"en": "Info", "zh": "提示"},
-    "msg_script_prefix": {"en": "[Script]", "zh": "[脚本]"},
-    "msg_script_wait_timeout": {
-        "en": "EXPECT timed out: EXPECT={expect}, TIMEOUT={timeout}ms",
-        "zh": "等待期望返回超时：EXPECT={expect}，TIMEOUT={timeout}ms"
-    },
-    "msg_script_stop": {"en": "Script stopped", "zh": "脚本已停止"},
-    "msg_script_done": {"en": "Script completed", "zh": "脚本执行完成"},
-    "msg_script_exception": {"en": "Script exception: {err}", "zh": "脚本执行异常：{err}"},
-    "msg_bad_regex": {"en": "EXPECT regex invalid: {err}, fallback to substring match", "zh": "EXPECT 正则无效：{err}，按普通文本处理"},
-    "msg_script_read_fail": {"en": "Serial read failed: {err}", "zh": "读取串口失败：{err}"},
-    "msg_script_unknown_step": {"en": "Unknown step: {op}", "zh": "未知步骤：{op}"},
-    "msg_no_log_title": {"en": "Notice", "zh": "提示"},
-}
+# ---------- 启动计时 ----------
+class StartupProfile:
+    """
+    --profile-startup：记录启动各阶段的耗时。
+    mark() 为主线程上顺序发生的阶段（耗时 = 距上一个阶段），span() 为后台任务的起止时间；
+    wait_for 中的事件都 done() 之后打印分解表并退出程序。未启用时所有方法都不做事。
+    """
 
+    def __init__(self, enabled, t0=_STARTUP_T0, marks=(), wait_for=("first frame", "port scan")):
+        self.enabled = enabled
+        self._t0 = self._last = t0
+        self._rows = []  # (名称, 开始, 结束, 是否后台)
+        self._waiting = set(wait_for)
+        for name, t in marks:
+            self.mark(name, t)
+
+    def mark(self, name, now=None):
+        if not self.enabled:
+            return
+        now = time.perf_counter() if now is None else now
+        self._rows.append((name, self._last, now, False))
+        self._last = now
 
-def translate(key, lang, **kwargs):
-    """Return translated text; fallback to English and key itself."""
-    text = TRANSLATIONS.get(key, {}).get(lang) or TRANSLATIONS.get(key, {}).get("en") or key
-    return text.format(**kwargs)
+    def span(self, name, start, end):
+        if self.enabled:
+            self._rows.append((name, start, end, True))
+
+    def done(self, event):
+        if not self.enabled or event not in self._waiting:
+            return
+        self._waiting.discard(event)
+        if not self._waiting:
+            self.report()
+            QApplication.quit()
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        print(f"{'phase':<30} {'duration':>10} {'at':>10}", file=out)
+        for name, start, end, background in self._rows:
+            label = f"  [bg] {name}" if background else name
+            print(f"{label:<30} {(end - start) * 1000:>7.1f} ms {(end - self._t0) * 1000:>7.1f} ms", file=out)
+        print(f"{'total (until all done)':<30} {'':>10} {(time.perf_counter() - self._t0) * 1000:>7.1f} ms",
+              file=out)
+        out.flush()
+
+
+def load_app_icon(path: Path) -> QIcon:
+    """读取已缓存的 PNG 图标；不存在、比本文件旧或无法读取时重新绘制并保存"""
+    try:
+        fresh = path.stat().st_mtime >= Path(__file__).stat().st_mtime
+    except OSError:
+        fresh = False
+    if fresh:
+        pix = QPixmap(str(path))
+        if not pix.isNull():
+            return QIcon(pix)
+    return build_app_icon(path)
 
 
 def build_app_icon(save_path: Path = None) -> QIcon:
@@ -212,9 +168,27 @@ def build_app_icon(save_path: Path = None) -> QIcon:
 
     return QIcon(pix)
 
+
 # ---------- 配置 ----------
-CONFIG_FILE = Path(__file__).with_name("commands.json")
-DEFAULT_CMDS = ["AT", "AT+GMR", "AT+RST", "AT+HELP"]
+# 运行期设置（设置对话框可修改）
+DEFAULT_SETTINGS = {
+    "log_max_lines": 20000,              # 日志最多保留行数
+    "log_max_bytes": 8 * 1024 * 1024,    # 日志最多保留字节数（UTF-8）
+    "log_flush_ms": 33,                  # 日志合并刷新间隔（约 30 帧/秒）
+    "capture_enabled": False,            # 原始收发数据连续落盘
+    "capture_dir": str(Path.home() / f"{APP_NAME}_capture"),
+    "capture_max_bytes": 64 * 1024 * 1024,
+    "capture_rotate_s": 0,               # 按时间轮转（秒），0 表示只按大小
+    "capture_compression": "none",       # none / gzip / zstd
+    "expect_lookback": 64 * 1024,        # 正则 EXPECT 滑动窗口（字节）
+    "script_engine": "thread",           # thread：每个脚本一个 QThread；async：共用一个 asyncio 事件循环线程
+    "command_panel": "list",             # list：虚拟化列表（只绘制可见行）；buttons：每条命令一行按钮控件
+    "auto_reopen": True,                 # 设备拔出后重新出现时自动重新打开串口
+    "virtual_stream_rate": 1024 * 1024,  # 虚拟设备 virtual:stream 的输出速率（字节/秒）
+}
+
+SCRIPT_ENGINES = ("thread", "async")
+COMMAND_PANELS = ("list", "buttons")
 
 # 预设颜色（Material Design 柔和色系）
 PRESET_COLORS = [
@@ -229,77 +203,163 @@ PRESET_COLORS = [
 ]
 
 
-def migrate_v1_to_v2(data):
-    """将 v1 格式（数组或 {commands: []}）迁移到 v2 格式"""
-    if isinstance(data, list):
-        return {
-            "version": 2,
-            "groups": [{
-                "id": "default",
-                "name": "默认分组",
-                "color": "#F5F5F5",
-                "collapsed": False,
-                "commands": data
-            }]
-        }
-    elif isinstance(data, dict) and "commands" in data and "groups" not in data:
-        return {
-            "version": 2,
-            "groups": [{
-                "id": "default",
-                "name": "默认分组",
-                "color": "#F5F5F5",
-                "collapsed": False,
-                "commands": data["commands"]
-            }]
-        }
-    return data
-
-
-def load_groups():
-    """加载分组配置，自动处理格式迁移"""
-    if CONFIG_FILE.exists():
-        try:
-            data = json.loads(CONFIG_FILE.read_text(encoding="utf-8"))
-            
-            if not isinstance(data, dict) or "version" not in data or data.get("version") != 2:
-                print("[INFO] 检测到旧格式，自动迁移到 v2...")
-                data = migrate_v1_to_v2(data)
-                
-                backup = CONFIG_FILE.with_suffix(".json.v1.backup")
-                if not backup.exists():
-                    import shutil
-                    shutil.copy2(CONFIG_FILE, backup)
-                    print(f"[INFO] 旧配置已备份到: {backup}")
-                
-                save_groups(data["groups"])
-            
-            return data.get("groups", [])
-        except Exception as e:
-            print(f"[WARN] load_groups 失败: {e}")
-    
-    return [{
-        "id": "default",
-        "name": "默认分组",
-        "color": "#F5F5F5",
-        "collapsed": False,
-        "commands": DEFAULT_CMDS.copy()
-    }]
+# ---------- 日志缓冲 & 视图 ----------
+class LogRing:
+    """
+    日志的行数 / 字节上限记账：只按行记录 UTF-8 字节数（文本本身只保存在 LogView 的文档中，不另存一份），
+    超过行数或字节上限时从头部淘汰最旧的行，并返回淘汰的行数。
+    每次追加的开销只与新增文本长度有关，与已保留的日志量无关。
+    """
 
+    def __init__(self, max_lines, max_bytes):
+        self.max_lines = max(1, int(max_lines))
+        self.max_bytes = max(1, int(max_bytes))
+        self._lines = deque()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    @property
+    def byte_size(self):
+        return self._bytes
+
+    def append(self, text: str) -> int:
+        """追加一段文本（至少占一行），返回被淘汰的行数"""
+        for line in text.split("\n"):
+            size = len(line.encode("utf-8", errors="ignore")) + 1
+            self._lines.append(size)
+            self._bytes += size
+        return self._trim()
+
+    def set_limits(self, max_lines, max_bytes) -> int:
+        self.max_lines = max(1, int(max_lines))
+        self.max_bytes = max(1, int(max_bytes))
+        return self._trim()
+
+    def _trim(self) -> int:
+        dropped = 0
+        lines = self._lines
+        # 至少保留最后一行，避免单行超限时整个缓冲被清空
+        while len(lines) > 1 and (len(lines) > self.max_lines or self._bytes > self.max_bytes):
+            self._bytes -= lines.popleft()
+            dropped += 1
+        return dropped
+
+    def clear(self):
+        self._lines.clear()
+        self._bytes = 0
+
+
+class LogView(QPlainTextEdit):
+    """
+    只读日志视图：QPlainTextEdit 只排版/绘制可见块，文档是日志的唯一副本，LogRing 只记账、决定淘汰多少行，
+    因此长时间运行时内存和单次追加开销都保持恒定。
+    """
 
-def save_groups(groups):
-    """保存分组配置（v2 格式）"""
-    try:
-        data = {
-            "version": 2,
-            "groups": groups
-        }
-        CONFIG_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception as exc:
-        print("[WARN] save_groups:", exc)
+    def __init__(self, max_lines, max_bytes, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.ring = LogRing(max_lines, max_bytes)
+        self.setMaximumBlockCount(self.ring.max_lines)
+
+    def append(self, text: str):
+        """与 QTextEdit.append 同名：追加一段纯文本（新起一行）"""
+        text = text.replace("\r\n", "\n")
+        self.ring.append(text)
+        self.appendPlainText(text)
+        self._trim_blocks()
+
+    def set_limits(self, max_lines, max_bytes):
+        self.ring.set_limits(max_lines, max_bytes)
+        self.setMaximumBlockCount(self.ring.max_lines)
+        self._trim_blocks()
+
+    def _trim_blocks(self):
+        # 字节上限触发的淘汰：删除文档头部多出的块，使视图与 ring 一致
+        extra = self.blockCount() - len(self.ring)
+        if extra > 0 and len(self.ring):
+            cursor = QTextCursor(self.document())
+            cursor.movePosition(QTextCursor.Start)
+            cursor.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor, extra)
+            cursor.removeSelectedText()
+
+    def clear(self):
+        self.ring.clear()
+        super().clear()
+
+    def plain_text(self) -> str:
+        return self.toPlainText()
+
+
+class LogCoalescer(QObject):
+    """
+    日志追加合并器：收集一个刷新周期内所有来源（接收、发送回显、脚本）的文本，
+    到期后拼接为一次插入，使重绘次数与数据块数量无关。
+    """
+
+    def __init__(self, sink, interval_ms, parent=None):
+        super().__init__(parent)
+        self._sink = sink
+        self._pending = []
+        self.appends = 0   # push 次数
+        self.flushes = 0   # 实际插入（重绘）次数
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(max(0, int(interval_ms)))
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def merged(self):
+        return self.appends - self.flushes
+
+    def set_interval(self, interval_ms):
+        self._timer.setInterval(max(0, int(interval_ms)))
+
+    def push(self, text: str):
+        self._pending.append(text)
+        self.appends += 1
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        self._timer.stop()
+        if not self._pending:
+            return
+        text = "\n".join(self._pending)
+        self._pending.clear()
+        self.flushes += 1
+        self._sink(text)
+
+    def reset(self):
+        """丢弃未刷新的内容并清零计数"""
+        self._timer.stop()
+        self._pending.clear()
+        self.appends = self.flushes = 0
 
 
 # ---------- 可拖拽命令行 ----------
+def _stable_indices(seq):
+    """最长递增子序列的下标集合：增量重排时这些行保持不动，只移动其余的行"""
+    tails, tail_at, prev = [], [], [-1] * len(seq)
+    for i, v in enumerate(seq):
+        j = bisect.bisect_left(tails, v)
+        if j == len(tails):
+            tails.append(v)
+            tail_at.append(i)
+        else:
+            tails[j] = v
+            tail_at[j] = i
+        prev[i] = tail_at[j - 1] if j else -1
+    keep = set()
+    i = tail_at[-1] if tail_at else -1
+    while i >= 0:
+        keep.add(i)
+        i = prev[i]
+    return keep
+
+
 class CmdRow(QWidget):
     """
     一行命令（发送按钮 + ✎编辑按钮），支持拖动启动 QDrag。
@@ -363,7 +423,6 @@ class GroupBox(QFrame):
     - 头部（标题、折叠按钮、设置按钮）
     - 命令列表区域
     """
-    sig_group_changed = pyqtSignal()  # 分组属性变更
 
     def __init__(self, group_id, name, color, collapsed, tool):
         super().__init__()
@@ -372,6 +431,7 @@ class GroupBox(QFrame):
         self.color = color
         self.collapsed = collapsed
         self.tool = tool
+        self._rows = {}  # 命令 -> CmdRow，增量更新时复用
         
         self.setAcceptDrops(True)
         self.setFrameShape(QFrame.StyledPanel)
@@ -412,6 +472,12 @@ class GroupBox(QFrame):
         self.cmd_layout.setContentsMargins(4, 4, 4, 4)
         self.cmd_layout.setSpacing(4)
         
+        self.empty_label = QLabel(tool._tr("placeholder_empty_group"))
+        self.empty_label.setAlignment(Qt.AlignCenter)
+        self.empty_label.setStyleSheet("color: #999; font-style: italic; padding: 20px;")
+        self.cmd_layout.addWidget(self.empty_label)
+        self.cmd_layout.addStretch(1)
+        
         main_layout.addWidget(self.cmd_area)
         
         self.cmd_area.setVisible(not collapsed)
@@ -439,42 +505,60 @@ class GroupBox(QFrame):
         self.collapsed = not self.collapsed
         self.cmd_area.setVisible(not self.collapsed)
         self.collapse_btn.setText("▼" if not self.collapsed else "▶")
-        self.sig_group_changed.emit()
+        self.tool.set_group_collapsed(self.group_id, self.collapsed)
     
     def _edit_group(self):
-        """编辑分组设置"""
-        dialog = GroupEditDialog(self.name, self.color, self.tool._tr, self)
-        if dialog.exec_() == QDialog.Accepted:
-            new_name, new_color = dialog.get_values()
-            if new_color == "__DELETE__":
-                # 删除分组
-                self.tool.delete_group(self.group_id)
-            elif new_name != self.name or new_color != self.color:
-                self.name = new_name
-                self.color = new_color
-                self.title_label.setText(new_name)
-                self._apply_style()
-                self.sig_group_changed.emit()
+        """编辑分组设置（改名 / 颜色经 sync 回到 set_props）"""
+        self.tool.edit_group(self.group_id)
+    
+    def set_props(self, name, color, collapsed):
+        """同步分组属性；只有颜色变化时才重新解析样式表"""
+        if name != self.name:
+            self.name = name
+            self.title_label.setText(name)
+        if color != self.color:
+            self.color = color
+            self._apply_style()
+        if collapsed != self.collapsed:
+            self.collapsed = collapsed
+            self.cmd_area.setVisible(not collapsed)
+            self.collapse_btn.setText("▼" if not collapsed else "▶")
     
-    def rebuild_commands(self, commands):
-        """重建命令列表"""
-        while self.cmd_layout.count():
-            item = self.cmd_layout.takeAt(0)
-            w = item.widget()
-            if w:
-                w.deleteLater()
+    def retranslate(self):
+        self.empty_label.setText(self.tool._tr("placeholder_empty_group"))
+    
+    def sync_commands(self, commands):
+        """
+        按命令列表增量更新：已有命令复用 CmdRow，只删除消失的行、新建新增的行，
+        并只移动不在“最长保序子序列”里的行（单次拖动只移动一行）。
+        """
+        rows = self._rows
+        layout = self.cmd_layout
+        wanted = {cmd: i for i, cmd in enumerate(commands)}
+        for cmd in [c for c in rows if c not in wanted]:
+            row = rows.pop(cmd)
+            layout.removeWidget(row)
+            row.deleteLater()
         
-        if commands:
-            for cmd in commands:
-                row = CmdRow(self, cmd, self.group_id, self.tool._send_cmd, self.tool._edit_dialog)
-                self.cmd_layout.addWidget(row)
-        else:
-            empty_label = QLabel(self.tool._tr("placeholder_empty_group"))
-            empty_label.setAlignment(Qt.AlignCenter)
-            empty_label.setStyleSheet("color: #999; font-style: italic; padding: 20px;")
-            self.cmd_layout.addWidget(empty_label)
+        # 现有行按布局顺序在新列表中的下标；递增子序列之外的行取出后重新插入
+        current = [layout.itemAt(i).widget() for i in range(len(rows))]
+        order = [wanted[r.cmd] for r in current]
+        keep = _stable_indices(order)
+        moved = set()
+        for i, row in enumerate(current):
+            if i not in keep:
+                layout.removeWidget(row)
+                moved.add(row.cmd)
+        for i, cmd in enumerate(commands):
+            row = rows.get(cmd)
+            if row is None:
+                row = rows[cmd] = CmdRow(self.cmd_area, cmd, self.group_id,
+                                         self.tool._send_cmd, self.tool._edit_dialog)
+            elif cmd not in moved:
+                continue
+            layout.insertWidget(i, row)
         
-        self.cmd_layout.addStretch(1)
+        self.empty_label.setVisible(not commands)
     
     def dragEnterEvent(self, e):
         if e.mimeData().hasFormat(CmdRow.MIME):
@@ -504,15 +588,16 @@ class GroupBox(QFrame):
         pos_y = e.pos().y()
         rows = self._get_cmd_rows()
         
-        insert_idx = len(rows)
-        for i, r in enumerate(rows):
+        # 以落点下方的命令为锚点（None 表示末尾）
+        before = None
+        for r in rows:
             g = r.geometry()
             center_y = g.top() + g.height() // 2
             if pos_y < center_y:
-                insert_idx = i
+                before = r.cmd
                 break
         
-        self.tool.move_command(cmd, source_group, self.group_id, insert_idx)
+        self.tool.move_command(cmd, source_group, self.group_id, before)
         e.acceptProposedAction()
     
     def _get_cmd_rows(self):
@@ -596,12 +681,14 @@ class GroupEditDialog(QDialog):
 
 
 class SettingsDialog(QDialog):
-    """全局设置（主题选择）"""
-    def __init__(self, current_theme, tr_fn, parent=None):
+    """全局设置（主题选择、日志缓冲上限）"""
+    def __init__(self, current_theme, tr_fn, parent=None, settings=None):
         super().__init__(parent)
         self.tr = tr_fn
         self.setWindowTitle(self.tr("dlg_settings_title"))
         self._theme = current_theme
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._settings.update(settings or {})
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel(self.tr("label_theme")))
@@ -617,6 +704,71 @@ class SettingsDialog(QDialog):
         theme_line.addWidget(self.radio_dark)
         layout.addLayout(theme_line)
 
+        layout.addWidget(QLabel(self.tr("label_log_limits")))
+        form = QFormLayout()
+        self.spin_log_lines = QSpinBox()
+        self.spin_log_lines.setRange(100, 10_000_000)
+        self.spin_log_lines.setSingleStep(1000)
+        self.spin_log_lines.setValue(self._settings["log_max_lines"])
+        self.spin_log_mb = QSpinBox()
+        self.spin_log_mb.setRange(1, 4096)
+        self.spin_log_mb.setValue(max(1, self._settings["log_max_bytes"] // (1024 * 1024)))
+        form.addRow(self.tr("label_log_max_lines"), self.spin_log_lines)
+        form.addRow(self.tr("label_log_max_mb"), self.spin_log_mb)
+        self.spin_log_flush = QSpinBox()
+        self.spin_log_flush.setRange(0, 1000)
+        self.spin_log_flush.setValue(self._settings["log_flush_ms"])
+        form.addRow(self.tr("label_log_flush_ms"), self.spin_log_flush)
+        layout.addLayout(form)
+
+        self.chk_auto_reopen = QCheckBox(self.tr("label_auto_reopen"))
+        self.chk_auto_reopen.setChecked(bool(self._settings["auto_reopen"]))
+        layout.addWidget(self.chk_auto_reopen)
+
+        self.chk_capture = QCheckBox(self.tr("label_capture"))
+        self.chk_capture.setChecked(bool(self._settings["capture_enabled"]))
+        layout.addWidget(self.chk_capture)
+        cap_form = QFormLayout()
+        dir_line = QHBoxLayout()
+        self.capture_dir_le = QLineEdit(self._settings["capture_dir"])
+        browse_btn = QPushButton(self.tr("btn_browse"))
+        browse_btn.clicked.connect(self._browse_capture_dir)
+        dir_line.addWidget(self.capture_dir_le, 1)
+        dir_line.addWidget(browse_btn)
+        cap_form.addRow(self.tr("label_capture_dir"), dir_line)
+        self.spin_capture_mb = QSpinBox()
+        self.spin_capture_mb.setRange(1, 65536)
+        self.spin_capture_mb.setValue(max(1, self._settings["capture_max_bytes"] // (1024 * 1024)))
+        cap_form.addRow(self.tr("label_capture_max_mb"), self.spin_capture_mb)
+        self.spin_capture_min = QSpinBox()
+        self.spin_capture_min.setRange(0, 7 * 24 * 60)
+        self.spin_capture_min.setValue(self._settings["capture_rotate_s"] // 60)
+        cap_form.addRow(self.tr("label_capture_rotate_min"), self.spin_capture_min)
+        self.capture_compress_cb = QComboBox()
+        self.capture_compress_cb.addItems(CAPTURE_COMPRESSIONS)
+        self.capture_compress_cb.setCurrentText(self._settings["capture_compression"])
+        cap_form.addRow(self.tr("label_capture_compress"), self.capture_compress_cb)
+        layout.addLayout(cap_form)
+
+        script_form = QFormLayout()
+        self.spin_lookback = QSpinBox()
+        self.spin_lookback.setRange(1, 64 * 1024)
+        self.spin_lookback.setValue(max(1, self._settings["expect_lookback"] // 1024))
+        script_form.addRow(self.tr("label_expect_lookback"), self.spin_lookback)
+        self.script_engine_cb = QComboBox()
+        self.script_engine_cb.addItems(SCRIPT_ENGINES)
+        self.script_engine_cb.setCurrentText(self._settings["script_engine"])
+        script_form.addRow(self.tr("label_script_engine"), self.script_engine_cb)
+        self.command_panel_cb = QComboBox()
+        self.command_panel_cb.addItems(COMMAND_PANELS)
+        self.command_panel_cb.setCurrentText(self._settings["command_panel"])
+        script_form.addRow(self.tr("label_command_panel"), self.command_panel_cb)
+        self.spin_virtual_rate = QSpinBox()
+        self.spin_virtual_rate.setRange(1, 100 * 1024)
+        self.spin_virtual_rate.setValue(max(1, self._settings["virtual_stream_rate"] // 1024))
+        script_form.addRow(self.tr("label_virtual_rate"), self.spin_virtual_rate)
+        layout.addLayout(script_form)
+
         btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, parent=self)
         btns.accepted.connect(self.accept)
         btns.rejected.connect(self.reject)
@@ -635,9 +787,31 @@ class SettingsDialog(QDialog):
             else:
                 self.radio_light.setChecked(False)
 
+    def _browse_capture_dir(self):
+        path = QFileDialog.getExistingDirectory(self, self.tr("label_capture_dir"), self.capture_dir_le.text())
+        if path:
+            self.capture_dir_le.setText(path)
+
     def get_theme(self):
         return self._theme
 
+    def get_settings(self):
+        settings = dict(self._settings)
+        settings["log_max_lines"] = self.spin_log_lines.value()
+        settings["log_max_bytes"] = self.spin_log_mb.value() * 1024 * 1024
+        settings["log_flush_ms"] = self.spin_log_flush.value()
+        settings["auto_reopen"] = self.chk_auto_reopen.isChecked()
+        settings["capture_enabled"] = self.chk_capture.isChecked()
+        settings["capture_dir"] = self.capture_dir_le.text().strip() or DEFAULT_SETTINGS["capture_dir"]
+        settings["capture_max_bytes"] = self.spin_capture_mb.value() * 1024 * 1024
+        settings["capture_rotate_s"] = self.spin_capture_min.value() * 60
+        settings["capture_compression"] = self.capture_compress_cb.currentText()
+        settings["expect_lookback"] = self.spin_lookback.value() * 1024
+        settings["script_engine"] = self.script_engine_cb.currentText()
+        settings["command_panel"] = self.command_panel_cb.currentText()
+        settings["virtual_stream_rate"] = self.spin_virtual_rate.value() * 1024
+        return settings
+
 
 # ---------- 命令容器：支持分组显示 ----------
 class CmdContainer(QWidget):
@@ -647,424 +821,627 @@ class CmdContainer(QWidget):
     def __init__(self, tool):
         super().__init__()
         self.tool = tool
+        self._boxes = {}  # 分组 ID -> GroupBox
 
         self.vbox = QVBoxLayout(self)
         self.vbox.setContentsMargins(6, 6, 6, 6)
         self.vbox.setSpacing(8)
-    
-    def rebuild(self):
-        """根据 self.tool.groups 重建所有分组"""
-        while self.vbox.count():
-            item = self.vbox.takeAt(0)
-            w = item.widget()
-            if w:
-                w.deleteLater()
-        
-        for group in self.tool.groups:
-            group_box = GroupBox(
-                group["id"],
-                group["name"],
-                group["color"],
-                group.get("collapsed", False),
-                self.tool
-            )
-            group_box.rebuild_commands(group.get("commands", []))
-            group_box.sig_group_changed.connect(self.tool._on_group_changed)
-            self.vbox.addWidget(group_box)
-        
-        # 添加"新建分组"按钮
-        add_group_btn = QPushButton(self.tool._tr("btn_new_group"))
-        add_group_btn.setStyleSheet("background-color: #e8f5e9; padding: 8px;")
-        add_group_btn.clicked.connect(self.tool._create_new_group)
-        self.vbox.addWidget(add_group_btn)
         
+        # "新建分组"按钮固定在所有分组之后
+        self.add_group_btn = QPushButton(tool._tr("btn_new_group"))
+        self.add_group_btn.setStyleSheet("background-color: #e8f5e9; padding: 8px;")
+        self.add_group_btn.clicked.connect(tool._create_new_group)
+        self.vbox.addWidget(self.add_group_btn)
         self.vbox.addStretch(1)
-
-# ---------- 脚本解析 & 执行 ----------
-class ScriptError(Exception):
-    pass
-
-
-def _strip_quotes(s: str) -> str:
-    s = s.strip()
-    if (s.startswith('"') and s.endswith('"')) or (s.startswith("'") and s.endswith("'")):
-        return s[1:-1]
-    return s
-
-
-def parse_script(text: str):
-    """
-    极简 DSL（大小写不敏感）：
-      - SEND <text> [EXPECT <substr|"/regex/"> [TIMEOUT <ms>]]
-      - DELAY <ms>
-      - WAIT <ms>        # 等价 DELAY
-      - LOOP <N> { ... }
-      - SET NAME = VALUE   或   NAME=VALUE
-      - 变量引用：$NAME / ${NAME}（仅在 SEND 中展开）
-      - # 注释；空行忽略
-    返回树：list[
-      ('SET', name, value) |
-      ('SEND', text, expect:str|None, timeout_ms:int|None) |
-      ('DELAY', ms) |
-      ('LOOP', n, block)
-    ]
-    """
-    lines = text.splitlines()
-
-    def _is_assign_line(raw: str):
-        l = raw.lstrip()
-        if l.upper().startswith("SET "):
-            body = l[4:]
-            if "=" in body:
-                name, value = body.split("=", 1)
-                return True, name.strip(), value.lstrip()
-            return False, None, None
-        up = l.upper()
-        if up.startswith(("SEND ", "DELAY ", "WAIT ", "LOOP ")):
-            return False, None, None
-        if "=" in l:
-            name, value = l.split("=", 1)
-            if name and name.strip() == name and " " not in name:
-                return True, name, value.lstrip()
-        return False, None, None
-
-    def _parse_send_remainder(rem: str):
+    
+    def group_box(self, group_id):
+        return self._boxes.get(group_id)
+    
+    def sync(self, group_ids=None):
         """
-        解析 SEND 余下部分，抽取 EXPECT/TIMEOUT。
-        规则：寻找关键字 EXPECT/TIMEOUT（大小写不敏感）；EXPECT 的模式可用引号或 /regex/。
+        按命令库 self.tool.library 增量更新：GroupBox 按分组 ID 复用，只同步属性差异；
+        命令行只比对 group_ids 中的分组（None 为全部），新建的分组总是完整填充。
         """
-        # 为了简单稳健，按空格拆分扫描关键字，但允许 EXPECT 值包含空格（使用引号或 /.../）
-        up = rem.upper()
-        expect = None
-        timeout = None
-
-        # 找 EXPECT 位置
-        pos_exp = up.find(" EXPECT ")
-        pos_to = up.find(" TIMEOUT ")
-
-        # 计算各段
-        end_cmd = len(rem)
-        if pos_exp != -1:
-            end_cmd = pos_exp
-        if pos_to != -1:
-            end_cmd = min(end_cmd, pos_to)
-        cmd_text = rem[:end_cmd].strip()
-
-        tail = rem[end_cmd:]
-        # 解析 tail 中的 EXPECT/TIMEOUT（顺序任意）
-        i = 0
-        while i < len(tail):
-            if tail[i:].upper().startswith(" EXPECT "):
-                i += len(" EXPECT ")
-                # 读取一个 token（引号字符串、/regex/、或到下一个关键字前的裸字符串）
-                j = i
-                if j < len(tail) and tail[j] in ("'", '"'):
-                    q = tail[j]; j += 1
-                    while j < len(tail) and tail[j] != q:
-                        j += 1
-                    token = tail[i:j+1] if j < len(tail) else tail[i:]
-                    i = j + 1
-                    expect = _strip_quotes(token)
-                elif j < len(tail) and tail[j] == "/":
-                    j += 1
-                    while j < len(tail) and tail[j] != "/":
-                        j += 1
-                    token = tail[i:j+1] if j < len(tail) else tail[i:]
-                    i = j + 1
-                    expect = token.strip()  # 保留 /.../ 以示正则
-                else:
-                    # 读到下一个关键字或末尾
-                    k = tail[i:].upper().find(" TIMEOUT ")
-                    token = tail[i:] if k == -1 else tail[i:i+k]
-                    expect = token.strip()
-                    i = len(tail) if k == -1 else i + k
-            elif tail[i:].upper().startswith(" TIMEOUT "):
-                i += len(" TIMEOUT ")
-                # 读到下一个空白或结尾
-                j = i
-                while j < len(tail) and tail[j].isdigit():
-                    j += 1
-                token = tail[i:j].strip()
-                if not token.isdigit():
-                    raise ScriptError("TIMEOUT 需要毫秒整数")
-                timeout = int(token)
-                i = j
+        library = self.tool.library
+        groups = library.groups(with_commands=False)
+        alive = {g["id"] for g in groups}
+        for gid in [gid for gid in self._boxes if gid not in alive]:
+            box = self._boxes.pop(gid)
+            self.vbox.removeWidget(box)
+            box.deleteLater()
+        
+        for i, group in enumerate(groups):
+            gid = group["id"]
+            collapsed = group.get("collapsed", False)
+            box = self._boxes.get(gid)
+            if box is None:
+                box = self._boxes[gid] = GroupBox(gid, group["name"], group["color"], collapsed, self.tool)
+                box.sync_commands(library.commands(gid))
             else:
-                i += 1
-
-        return cmd_text, expect, timeout
+                box.set_props(group["name"], group["color"], collapsed)
+                if group_ids is None or gid in group_ids:
+                    box.sync_commands(library.commands(gid))
+            if self.vbox.itemAt(i).widget() is not box:
+                self.vbox.removeWidget(box)
+                self.vbox.insertWidget(i, box)
+    
+    def retranslate(self):
+        self.add_group_btn.setText(self.tool._tr("btn_new_group"))
+        for box in self._boxes.values():
+            box.retranslate()
+
+# ---------- 虚拟化命令面板（model/view） ----------
+class _GroupNode:
+    """CommandModel 中的一个分组；commands 在视图第一次绘制其命令行时才从命令库读取"""
+    __slots__ = ("id", "name", "color", "collapsed", "count", "start", "commands")
+
+    def __init__(self, group, count):
+        self.id = group["id"]
+        self.name = group["name"]
+        self.color = group["color"]
+        self.collapsed = group.get("collapsed", False)
+        self.count = count  # 命令数；已加载时等于 len(commands)
+        self.start = 0      # 分组标题所在行
+        self.commands = None
+
+    def visible(self):
+        """占用的行数：标题 + 展开时的命令"""
+        return 1 if self.collapsed else 1 + self.count
+
+
+class CommandModel(QAbstractListModel):
+    """
+    扁平列表模型：每个分组占一行标题，展开时后面紧跟其命令行；折叠即删除这些行。
+    行号 -> (分组, 组内下标) 在各分组起始行上二分查找，分组只有几十个；
+    视图（QListView + uniformItemSizes）布局时只需要 rowCount，data 只为可见行调用。
+    拖放沿用 CmdRow 的 MIME 格式，落点换算为 (目标分组, before 锚点) 后交给 SerialTool.move_command。
+    """
+    GroupIdRole = Qt.UserRole + 1
+    ColorRole = Qt.UserRole + 2
+    IsGroupRole = Qt.UserRole + 3
+    CollapsedRole = Qt.UserRole + 4
+    EmptyRole = Qt.UserRole + 5  # 分组没有命令
 
-    def parse_block(idx):
-        cmds = []
-        while idx < len(lines):
-            raw = lines[idx]
-            s = raw.strip()
-            idx += 1
+    def __init__(self, tool, parent=None):
+        super().__init__(parent)
+        self.tool = tool
+        self._nodes = []
+        self._by_id = {}
+        self._starts = []  # 各分组标题行，与 _nodes 对应
+        self._rows = 0
+
+    # ----- 数据 -----
+    def reload(self):
+        self.beginResetModel()
+        library = self.tool.library
+        self._nodes = [_GroupNode(g, library.command_count(g["id"]))
+                       for g in library.groups(with_commands=False)]
+        self._by_id = {n.id: n for n in self._nodes}
+        self._relayout()
+        self.endResetModel()
+
+    def _relayout(self):
+        row, starts = 0, []
+        for node in self._nodes:
+            node.start = row
+            starts.append(row)
+            row += node.visible()
+        self._starts = starts
+        self._rows = row
+
+    def _load(self, node):
+        if node.commands is None:
+            node.commands = self.tool.library.commands(node.id)
+            node.count = len(node.commands)
+        return node.commands
+
+    def _locate(self, row):
+        """(分组, 组内下标)；分组标题的下标为 -1"""
+        node = self._nodes[bisect.bisect_right(self._starts, row) - 1]
+        return node, row - node.start - 1
+
+    def group_index(self, group_id):
+        node = self._by_id.get(group_id)
+        return self.index(node.start) if node is not None else QModelIndex()
+
+    def _header_changed(self, node):
+        idx = self.index(node.start)
+        self.dataChanged.emit(idx, idx)
+
+    def set_collapsed(self, group_id, collapsed):
+        """折叠 / 展开：删除 / 插入该分组的命令行"""
+        node = self._by_id.get(group_id)
+        if node is None or node.collapsed == collapsed:
+            return
+        first, last = node.start + 1, node.start + node.count
+        if node.count:
+            if collapsed:
+                self.beginRemoveRows(QModelIndex(), first, last)
+            else:
+                self.beginInsertRows(QModelIndex(), first, last)
+        node.collapsed = collapsed
+        self._relayout()
+        if node.count:
+            if collapsed:
+                self.endRemoveRows()
+            else:
+                self.endInsertRows()
+        self._header_changed(node)
 
-            if not s or s.startswith("#"):
-                continue
-            if s == "}":
-                return cmds, idx
-
-            is_assign, var_name, var_value = _is_assign_line(raw)
-            if is_assign:
-                if " #" in var_value:
-                    var_value = var_value.split(" #", 1)[0]
-                cmds.append(("SET", var_name, var_value.rstrip("\n")))
+    def sync(self, group_ids=None):
+        """语义同 CmdContainer.sync：分组按 ID 比对，命令只比对 group_ids 中的分组"""
+        if not self._nodes:
+            self.reload()
+            return
+        library = self.tool.library
+        groups = library.groups(with_commands=False)
+        alive = {g["id"] for g in groups}
+        root = QModelIndex()
+        for node in [n for n in self._nodes if n.id not in alive]:
+            self.beginRemoveRows(root, node.start, node.start + node.visible() - 1)
+            self._nodes.remove(node)
+            del self._by_id[node.id]
+            self._relayout()
+            self.endRemoveRows()
+
+        for i, group in enumerate(groups):
+            node = self._by_id.get(group["id"])
+            if node is None:
+                node = _GroupNode(group, library.command_count(group["id"]))
+                start = self._nodes[i].start if i < len(self._nodes) else self._rows
+                self.beginInsertRows(root, start, start + node.visible() - 1)
+                self._nodes.insert(i, node)
+                self._by_id[node.id] = node
+                self._relayout()
+                self.endInsertRows()
                 continue
+            if self._nodes[i] is not node:
+                self.reload()  # 分组顺序变化（目前没有这种操作）：整体重置即可
+                return
+            if (group["name"], group["color"]) != (node.name, node.color):
+                node.name, node.color = group["name"], group["color"]
+                self._header_changed(node)
+            if group_ids is None or node.id in group_ids:
+                if node.commands is None:
+                    self._sync_count(node, library.command_count(node.id))
+                else:
+                    self._sync_commands(node, library.commands(node.id))
+            self.set_collapsed(node.id, group.get("collapsed", False))
+
+    def _resize(self, node, first, last, insert, apply):
+        """组内下标 [first, last] 的命令行增删；折叠的分组没有这些行，只改数据"""
+        shown = not node.collapsed
+        if shown:
+            rows = (QModelIndex(), node.start + 1 + first, node.start + 1 + last)
+            (self.beginInsertRows if insert else self.beginRemoveRows)(*rows)
+        was_empty = node.count == 0
+        apply()
+        self._relayout()
+        if shown:
+            (self.endInsertRows if insert else self.endRemoveRows)()
+        if was_empty != (node.count == 0):
+            self._header_changed(node)
+
+    def _sync_count(self, node, count):
+        """未加载的分组：视图从未取过它的命令，只需在末尾补齐 / 去掉行数之差"""
+        def apply():
+            node.count = count
+        if count > node.count:
+            self._resize(node, node.count, count - 1, True, apply)
+        elif count < node.count:
+            self._resize(node, count, node.count - 1, False, apply)
+
+    def _sync_commands(self, node, new):
+        """去掉公共前缀 / 后缀后只对中间段发信号；单条命令的组内移动用 beginMoveRows"""
+        old = node.commands
+        if old == new:
+            return
+        n = min(len(old), len(new))
+        p = 0
+        while p < n and old[p] == new[p]:
+            p += 1
+        s = 0
+        while s < n - p and old[-1 - s] == new[-1 - s]:
+            s += 1
+        old_end, new_end = len(old) - s, len(new) - s  # 中间段 [p, end)
+        if old_end - p == new_end - p > 1 and not node.collapsed:
+            mid_old, mid_new = old[p:old_end], new[p:new_end]
+            base, root = node.start + 1, QModelIndex()
+            if mid_old[0] == mid_new[-1] and mid_old[1:] == mid_new[:-1]:
+                self.beginMoveRows(root, base + p, base + p, root, base + old_end)
+                node.commands = new
+                self.endMoveRows()
+                return
+            if mid_old[-1] == mid_new[0] and mid_old[:-1] == mid_new[1:]:
+                self.beginMoveRows(root, base + old_end - 1, base + old_end - 1, root, base + p)
+                node.commands = new
+                self.endMoveRows()
+                return
 
-            up = s.upper()
-
-            if up.startswith("SEND "):
-                rem = s[5:].strip()
-                cmd_text, expect, timeout = _parse_send_remainder(rem)
-                cmds.append(("SEND", cmd_text, expect, timeout))
-                continue
+        def remove():
+            node.commands = old[:p] + old[old_end:]
+            node.count = len(node.commands)
 
-            if up.startswith("DELAY "):
-                val = s[6:].strip()
-                if not val.isdigit():
-                    raise ScriptError(f"DELAY 需要毫秒整数（第 {idx} 行）")
-                cmds.append(("DELAY", int(val)))
-                continue
+        def insert():
+            node.commands = new
+            node.count = len(new)
+        if old_end > p:
+            self._resize(node, p, old_end - 1, False, remove)
+        if new_end > p:
+            self._resize(node, p, new_end - 1, True, insert)
 
-            if up.startswith("WAIT "):
-                val = s[5:].strip()
-                if not val.isdigit():
-                    raise ScriptError(f"WAIT 需要毫秒整数（第 {idx} 行）")
-                cmds.append(("DELAY", int(val)))
-                continue
+    # ----- QAbstractListModel -----
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
 
-            if up.startswith("LOOP "):
-                rest = s[5:].strip()
-                parts = rest.split(None, 1)
-                if not parts or not parts[0].isdigit():
-                    raise ScriptError(f"LOOP 后需要次数整数（第 {idx} 行）")
-                count = int(parts[0])
-                after = parts[1].strip() if len(parts) > 1 else ""
-                if after == "{":
-                    block, idx = parse_block(idx)
-                else:
-                    while idx < len(lines) and (lines[idx].strip() == "" or lines[idx].strip().startswith("#")):
-                        idx += 1
-                    if idx >= len(lines) or lines[idx].strip() != "{":
-                        raise ScriptError(f"LOOP 缺少 '{{'（第 {idx} 行附近）")
-                    idx += 1
-                    block, idx = parse_block(idx)
-                cmds.append(("LOOP", count, block))
-                continue
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node, i = self._locate(index.row())
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            if i >= 0:
+                return self._load(node)[i]
+            return node.name if role == Qt.DisplayRole else None
+        if role == self.GroupIdRole:
+            return node.id
+        if role == self.ColorRole:
+            return node.color
+        if role == self.IsGroupRole:
+            return i < 0
+        if role == self.CollapsedRole:
+            return node.collapsed
+        if role == self.EmptyRole:
+            return node.count == 0
+        return None
 
-            raise ScriptError(f"无法识别的指令：{s}（第 {idx} 行）")
-        return cmds, idx
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        if self._locate(index.row())[1] < 0:
+            return Qt.ItemIsEnabled | Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    # ----- 拖放 -----
+    def supportedDragActions(self):
+        return Qt.MoveAction
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [CmdRow.MIME]
+
+    def mimeData(self, indexes):
+        for index in indexes:
+            node, i = self._locate(index.row())
+            if i >= 0:
+                mime = QMimeData()
+                payload = json.dumps({"command": self._load(node)[i], "source_group": node.id})
+                mime.setData(CmdRow.MIME, payload.encode("utf-8"))
+                return mime
+        return None
 
-    cmds, _ = parse_block(0)
-    return cmds
+    def _drop_target(self, row, parent):
+        """落点 -> (分组, before 锚点)"""
+        if parent.isValid():
+            # 落在分组标题上：放到该组末尾
+            return self._locate(parent.row())[0], None
+        if row < 0 or row >= self._rows:
+            # 列表末尾之后：放到最后一个分组末尾
+            return self._nodes[-1], None
+        node, i = self._locate(row)
+        if i >= 0:
+            # 插在命令之前
+            return node, self._load(node)[i]
+        k = self._nodes.index(node)
+        if k == 0:
+            # 第一个分组标题之上：放到第一个分组开头
+            commands = self._load(node)
+            return node, commands[0] if commands else None
+        # 分组标题之上：放到上一个分组末尾
+        return self._nodes[k - 1], None
+
+    def dropMimeData(self, data, action, row, column, parent):
+        if action == Qt.IgnoreAction:
+            return True
+        if not data.hasFormat(CmdRow.MIME) or not self._nodes:
+            return False
+        try:
+            payload = json.loads(bytes(data.data(CmdRow.MIME)).decode("utf-8"))
+            cmd = payload["command"]
+            source_group = payload["source_group"]
+        except Exception:
+            return False
+        node, before = self._drop_target(row, parent)
+        if before == cmd:
+            return False
+        # move_command 会回调 sync() 更新本模型；视图随后的 removeRows 为默认实现（不做任何事）
+        self.tool.move_command(cmd, source_group, node.id, before)
+        return True
 
 
-def flatten_cmds(cmds, limit=200000):
+class CommandDelegate(QStyledItemDelegate):
     """
-    展开树为线性序列：
-      - ('SET', name, value)
-      - ('SEND', text, expect, timeout_ms)
-      - ('DELAY', ms)
+    绘制分组标题（颜色条 + 折叠箭头 + 名称 + ⚙）与命令行（发送按钮 + ✎），外观对应 GroupBox / CmdRow。
+    点击在鼠标释放时处理（按下与释放须在同一行），动作延后到事件循环执行，避免在视图事件中修改模型。
     """
-    out = []
-
-    def rec(lst):
-        nonlocal out
-        for c in lst:
-            op = c[0]
-            if op == "SEND":
-                out.append(("SEND", c[1], c[2], c[3]))
-            elif op == "DELAY":
-                out.append(("DELAY", c[1]))
-            elif op == "SET":
-                out.append(("SET", c[1], c[2]))
-            elif op == "LOOP":
-                times, block = c[1], c[2]
-                if times < 0:
-                    raise ScriptError("LOOP 次数不能为负数")
-                for _ in range(times):
-                    rec(block)
+    ROW_HEIGHT = 34
+    BUTTON_WIDTH = 30
+
+    sig_toggle = pyqtSignal(str)  # 折叠 / 展开分组（分组 ID）
+
+    def __init__(self, tool, parent=None):
+        super().__init__(parent)
+        self.tool = tool
+        self._pressed = None
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def _button_rects(self, rect):
+        """(主区域, 右侧小按钮)"""
+        r = rect.adjusted(4, 2, -4, -2)
+        side = QRect(r.right() - self.BUTTON_WIDTH + 1, r.top(), self.BUTTON_WIDTH, r.height())
+        return r.adjusted(0, 0, -(self.BUTTON_WIDTH + 6), 0), side
+
+    def paint(self, painter, option, index):
+        color = QColor(index.data(CommandModel.ColorRole))
+        main, side = self._button_rects(option.rect)
+        widget = option.widget
+        style = widget.style() if widget is not None else QApplication.style()
+        painter.save()
+        if index.data(CommandModel.IsGroupRole):
+            painter.fillRect(option.rect.adjusted(2, 2, -2, 0), color)
+            arrow = "▶" if index.data(CommandModel.CollapsedRole) else "▼"
+            font = QFont(option.font)
+            font.setBold(True)
+            painter.setFont(font)
+            painter.setPen(option.palette.windowText().color())
+            title = f"{arrow}  {index.data(Qt.DisplayRole)}"
+            painter.drawText(main.adjusted(4, 0, 0, 0), Qt.AlignVCenter | Qt.AlignLeft,
+                             painter.fontMetrics().elidedText(title, Qt.ElideRight, main.width() - 4))
+            painter.drawText(side, Qt.AlignCenter, "⚙")
+            if index.data(CommandModel.EmptyRole):
+                font.setBold(False)
+                font.setItalic(True)
+                painter.setFont(font)
+                painter.setPen(QColor("#999"))
+                painter.drawText(main, Qt.AlignVCenter | Qt.AlignRight, self.tool._tr("placeholder_empty_group"))
+        else:
+            painter.fillRect(option.rect, color.lighter(180))
+            hover = option.state & QStyle.State_MouseOver
+            for rect, text in ((main, index.data(Qt.DisplayRole)), (side, "✎")):
+                btn = QStyleOptionButton()
+                btn.rect = rect
+                btn.palette = option.palette
+                btn.fontMetrics = option.fontMetrics
+                btn.text = option.fontMetrics.elidedText(text, Qt.ElideRight, rect.width() - 12)
+                btn.state = QStyle.State_Enabled | QStyle.State_Raised
+                if hover:
+                    btn.state |= QStyle.State_MouseOver
+                style.drawControl(QStyle.CE_PushButton, btn, painter, widget)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        etype = event.type()
+        if etype == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            self._pressed = QPersistentModelIndex(index)
+            return False
+        if etype != QEvent.MouseButtonRelease or event.button() != Qt.LeftButton:
+            return False
+        if self._pressed is None or self._pressed != index:
+            return False
+        self._pressed = None
+        group_id = index.data(CommandModel.GroupIdRole)
+        on_side = self._button_rects(option.rect)[1].contains(event.pos())
+        if index.data(CommandModel.IsGroupRole):
+            if on_side:
+                QTimer.singleShot(0, lambda: self.tool.edit_group(group_id))
             else:
-                raise ScriptError(f"未知指令类型：{op}")
-            if len(out) > limit:
-                raise ScriptError(f"展开后的指令超过限制（>{limit}），请减少循环次数。")
+                self.sig_toggle.emit(group_id)
+            return True
+        cmd = index.data(Qt.DisplayRole)
+        if on_side:
+            QTimer.singleShot(0, lambda: self.tool._edit_dialog(cmd, group_id))
+        else:
+            self.tool._send_cmd(cmd)
+        return True
+
 
-    rec(cmds)
-    return out
+class CommandPanel(QWidget):
+    """
+    虚拟化命令面板：QListView + CommandModel + CommandDelegate，只为可见行绘制，不为命令创建控件。
+    行高统一（uniformItemSizes），分批布局，启动与移动耗时基本不随命令总数增长。
+    接口与 CmdContainer 相同（sync / retranslate），由设置 command_panel 选择。
+    """
+    LAYOUT_BATCH = 500
+
+    def __init__(self, tool):
+        super().__init__()
+        self.tool = tool
+        self.model = CommandModel(tool, self)
+
+        self.view = QListView(self)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(self.LAYOUT_BATCH)
+        self.view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.setDragDropMode(QAbstractItemView.InternalMove)
+        self.view.setDefaultDropAction(Qt.MoveAction)
+        self.view.setDropIndicatorShown(True)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setMouseTracking(True)
+        self.view.setMinimumWidth(220)
+        self.delegate = CommandDelegate(tool, self.view)
+        self.delegate.sig_toggle.connect(self._toggle_group)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setModel(self.model)
+
+        self.add_group_btn = QPushButton(tool._tr("btn_new_group"))
+        self.add_group_btn.setStyleSheet("background-color: #e8f5e9; padding: 8px;")
+        self.add_group_btn.clicked.connect(tool._create_new_group)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.view, 1)
+        layout.addWidget(self.add_group_btn)
+
+    def sync(self, group_ids=None):
+        self.model.sync(group_ids)
 
+    def retranslate(self):
+        self.add_group_btn.setText(self.tool._tr("btn_new_group"))
+        self.view.viewport().update()
+
+    def _toggle_group(self, group_id):
+        idx = self.model.group_index(group_id)
+        if not idx.isValid():
+            return
+        collapsed = not idx.data(CommandModel.CollapsedRole)
+        self.model.set_collapsed(group_id, collapsed)
+        self.tool.set_group_collapsed(group_id, collapsed)
 
+
+# ---------- 脚本执行（Qt 线程包装） ----------
 class ScriptRunner(QThread):
+    """在 QThread 中运行 ScriptEngine，把引擎回调转为 Qt 信号"""
     sig_log = pyqtSignal(str)
-    sig_send = pyqtSignal(str)   # 主线程串口发送
     sig_done = pyqtSignal(bool, str)
+    sig_progress = pyqtSignal(object, object)  # (已完成步数, 总步数)；可能超过 32 位
 
-    def __init__(self, steps, serial_obj: serial.Serial, tr_fn):
+    def __init__(self, program, link: SerialLink, tr_fn, max_lookback=EXPECT_MAX_LOOKBACK, metrics=None):
         super().__init__()
-        self._steps = steps
-        self._stop = False
-        self._vars = {}
-        self._ser = serial_obj  # 直接读取串口，用于 EXPECT 等待
-        self._tr = tr_fn
+        self.engine = ScriptEngine(
+            program, link, tr_fn, max_lookback,
+            on_log=self.sig_log.emit, on_progress=self.sig_progress.emit, metrics=metrics,
+        )
+        self.total_steps = self.engine.total_steps
 
     def stop(self):
-        self._stop = True
-
-    def _expand_vars(self, text: str) -> str:
-        """展开 $NAME / ${NAME}，支持 \$ 转义"""
-        out = []
-        i = 0
-        n = len(text)
-        while i < n:
-            ch = text[i]
-            if ch == "\\" and i + 1 < n and text[i+1] == "$":
-                out.append("$"); i += 2; continue
-            if ch == "$":
-                # ${NAME}
-                if i + 1 < n and text[i+1] == "{":
-                    j = i + 2
-                    while j < n and text[j] != "}":
-                        j += 1
-                    if j < n:
-                        name = text[i+2:j]
-                        out.append(self._vars.get(name, ""))
-                        i = j + 1
-                        continue
-                # $NAME
-                j = i + 1
-                while j < n and (text[j].isalnum() or text[j] == "_"):
-                    j += 1
-                name = text[i+1:j]
-                if name:
-                    out.append(self._vars.get(name, ""))
-                    i = j
-                    continue
-            out.append(ch); i += 1
-        return "".join(out)
-
-    def _wait_for_expect(self, expect: str, timeout_ms: int) -> bool:
-        """
-        在当前线程直接从串口读取，直到匹配 expect 或超时。
-        - 如果 expect 形如 /.../ 则按正则匹配；否则做子串查找
-        - 不改变 DTR/RTS，不写，只读 in_waiting
-        """
-        buf = ""
-        deadline = time.time() + timeout_ms / 1000.0
-        is_regex = False
-        pattern = None
+        self.engine.stop()
 
-        if expect and len(expect) >= 2 and expect[0] == "/" and expect[-1] == "/":
-            try:
-                pattern = re.compile(expect[1:-1])
-                is_regex = True
-            except re.error as e:
-                self.sig_log.emit(f"{self._tr('msg_script_prefix')} {self._tr('msg_bad_regex', err=e)}")
-                is_regex = False
-
-        while not self._stop:
-            # 超时？
-            now = time.time()
-            if now >= deadline:
-                return False
+    def run(self):
+        ok, msg = self.engine.run()
+        self.sig_done.emit(ok, msg)
 
-            try:
-                waiting = getattr(self._ser, "in_waiting", 0)
-                if waiting and waiting > 0:
-                    data = self._ser.read(waiting)
-                    try:
-                        text = data.decode("utf-8", errors="ignore")
-                    except Exception:
-                        text = data.decode(errors="ignore")
-                    if text:
-                        buf += text
-                        # 同时把新读到的内容抛到日志，方便观察（不影响 GUI 定时器被暂停的情况）
-                        self.sig_log.emit(text)
-                        if is_regex:
-                            if pattern.search(buf):
-                                return True
-                        else:
-                            if expect in buf:
-                                return True
-            except Exception as e:
-                self.sig_log.emit(f"{self._tr('msg_script_prefix')} {self._tr('msg_script_read_fail', err=e)}")
-                # 继续循环，直到超时
-            time.sleep(0.01)
-        return False
 
-    def run(self):
+class AsyncScriptRunner(QObject):
+    """
+    在共享的 asyncio 事件循环线程中运行 AsyncScriptEngine，接口与 ScriptRunner 相同。
+    所有异步脚本共用一个线程；uart_async（asyncio）在首次使用时才导入。
+    """
+    sig_log = pyqtSignal(str)
+    sig_done = pyqtSignal(bool, str)
+    sig_progress = pyqtSignal(object, object)
+
+    _loop_thread = None
+
+    def __init__(self, program, link: SerialLink, tr_fn, max_lookback=EXPECT_MAX_LOOKBACK, metrics=None):
+        super().__init__()
+        from uart_async import AsyncScriptEngine
+        self.engine = AsyncScriptEngine(
+            program, link, tr_fn, max_lookback,
+            on_log=self.sig_log.emit, on_progress=self.sig_progress.emit, metrics=metrics,
+        )
+        self.total_steps = self.engine.total_steps
+        self._future = None
+
+    @classmethod
+    def loop_thread(cls):
+        if cls._loop_thread is None:
+            from uart_async import AsyncLoopThread
+            cls._loop_thread = AsyncLoopThread()
+            cls._loop_thread.start()
+        return cls._loop_thread
+
+    def start(self):
+        self._future = self.loop_thread().submit(self.engine.run())
+        self._future.add_done_callback(self._finished)
+
+    def _finished(self, fut):
+        # 在事件循环线程中回调；跨线程 emit 由 Qt 排队到主线程
         try:
-            for step in self._steps:
-                if self._stop:
-                    self.sig_done.emit(False, self._tr("msg_script_stop"))
-                    return
-
-                op = step[0]
-                if op == "SET":
-                    name, value = step[1], step[2]
-                    self._vars[name] = value
-                    self.sig_log.emit(f"{self._tr('msg_script_prefix')} SET {name} = ({len(value)} bytes)")
-                    continue
-
-                if op == "SEND":
-                    raw = step[1]
-                    expect = step[2]  # 可能为 None
-                    timeout_ms = step[3] if step[3] is not None else 3000  # 默认 3s
-
-                    expanded = self._expand_vars(raw)
-                    log_line = f"{self._tr('msg_script_prefix')} SEND {raw}"
-                    if expanded != raw:
-                        log_line += f"  ->  {expanded}"
-                    if expect:
-                        log_line += f"  ; EXPECT={expect}  ; TIMEOUT={timeout_ms}ms"
-                    self.sig_log.emit(log_line)
-
-                    # 由主线程写串口（追加 CRLF）
-                    self.sig_send.emit(expanded)
-
-                    # 需要等待返回？
-                    if expect:
-                        ok = self._wait_for_expect(expect, timeout_ms)
-                        if not ok:
-                            self.sig_done.emit(False, self._tr("msg_script_wait_timeout", expect=expect, timeout=timeout_ms))
-                            return
-                    continue
-
-                if op == "DELAY":
-                    ms = max(0, int(step[1]))
-                    self.sig_log.emit(f"{self._tr('msg_script_prefix')} DELAY {ms} ms")
-                    end_t = time.time() + ms / 1000.0
-                    while not self._stop and time.time() < end_t:
-                        time.sleep(0.02)
-                    continue
-
-                self.sig_log.emit(f"{self._tr('msg_script_prefix')} {self._tr('msg_script_unknown_step', op=op)}")
-
-            self.sig_done.emit(True, self._tr("msg_script_done"))
-        except Exception as e:
-            self.sig_done.emit(False, self._tr("msg_script_exception", err=e))
+            ok, msg = fut.result()
+        except BaseException as e:
+            ok, msg = False, str(e)
+        self.sig_done.emit(ok, msg)
+
+    def isRunning(self):
+        return self._future is not None and not self._future.done()
+
+    def wait(self, msecs):
+        if self._future is not None:
+            try:
+                self._future.result(msecs / 1000.0)
+            except Exception:
+                pass
+
+    def stop(self):
+        self.engine.stop()
 
 
 # ---------- 主窗口 ----------
 class SerialTool(QWidget):
-    def __init__(self):
+    SAVE_DELAY_MS = 500  # commands.json 写入合并间隔
+    REOPEN_DELAY_MS = 300  # 设备节点出现后等待 udev 设置权限再打开
+    REOPEN_ATTEMPTS = 5
+
+    sig_rx = pyqtSignal(bytes)      # 读线程 -> 主线程
+    sig_rx_error = pyqtSignal(str)
+    sig_tx = pyqtSignal(bytes, str)  # 写线程 -> 主线程（数据, 错误信息）
+    sig_ports = pyqtSignal(list, list)  # 串口监视线程 -> 主线程（新增, 移除）
+
+    def __init__(self, profile=None):
         super().__init__()
+        self.profile = profile or StartupProfile(False)
         self.lang = "en"  # 默认英文
         self.theme = "light"
+        self.settings = dict(DEFAULT_SETTINGS)
         self.setWindowTitle(self._tr("title_main"))
         self.resize(900, 580)
 
         # 尽量使用非独占
         self.serial = serial.Serial(exclusive=False)
-        self.timer = QTimer(self); self.timer.timeout.connect(self._read_data)
-
-        self.groups = load_groups()
+        self.link = None  # SerialLink：打开串口后由后台线程读取
+        self.capture = None  # CaptureWriter：可选的原始数据落盘
+        self._rx_decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+        self.sig_rx.connect(self._on_rx_data)
+        self.sig_rx_error.connect(self._on_rx_error)
+        self.sig_tx.connect(self._on_tx_data)
+        self.sig_ports.connect(self._on_ports_changed)
+        self.port_monitor = PortMonitor(self.sig_ports.emit)  # 热插拔：增量更新串口列表
+        self._port_scan_started = None  # 首次扫描的开始时间（启动计时用）
+        self._lost_port = None  # (串口, 波特率)：意外断开、等待设备重新出现
+        self._virtual_device = None  # 当前打开的是内置虚拟设备时为 VirtualDevice
+        self._reopen_tries = 0
+
+        # 命令库：commands.sqlite3 存在时用 SQLite，否则 commands.json
+        self.library = open_command_library()
+        # 延迟合并保存：修改只标记，静默 SAVE_DELAY_MS 后再提交（JSON 在后台线程落盘）
+        self._save_timer = QTimer(self)
+        self._save_timer.setSingleShot(True)
+        self._save_timer.setInterval(self.SAVE_DELAY_MS)
+        self._save_timer.timeout.connect(self._save_groups_now)
         self.script_runner = None  # ScriptRunner 线程
+        self.script_metrics = None  # 最近一次脚本运行的 RunMetrics
+        self.script_cache = ScriptCache()  # 重跑同一脚本时跳过解析 / 编译
+        self.profile.mark("command library")
         self._build_ui()
+        self.profile.mark("build UI")
+        if self.library.fallback_error:
+            self._log(self._tr("msg_library_fallback", err=self.library.fallback_error))
 
     def _tr(self, key, **kwargs):
         return translate(key, self.lang, **kwargs)
 
+    def _schedule_save(self):
+        """标记分组配置已修改；连续修改只在最后一次之后写一次"""
+        self._save_timer.start()
+
+    def _save_groups_now(self):
+        self.library.save()
+
     # ===== UI =====
     def _build_ui(self):
         root = QHBoxLayout(self)
@@ -1075,8 +1452,8 @@ class SerialTool(QWidget):
         # 串口行
         port_line = QHBoxLayout()
         self.port_label = QLabel()
-        self.port_cb = QComboBox(); self._refresh_ports()
-        self.refresh_btn = QPushButton(); self.refresh_btn.clicked.connect(self._refresh_ports)
+        self.port_cb = QComboBox(); self._start_port_monitor()
+        self.refresh_btn = QPushButton(); self.refresh_btn.clicked.connect(self.port_monitor.rescan)
         self.baud_label = QLabel()
         self.baud_cb = QComboBox(); self.baud_cb.setEditable(True)
         self.baud_cb.addItems(["9600", "19200", "38400", "57600", "115200", "921600", "1000000"])
@@ -1096,15 +1473,19 @@ class SerialTool(QWidget):
         left.addLayout(send_line)
 
         # 日志
-        self.log = QTextEdit(readOnly=True); left.addWidget(self.log, 1)
+        self.log = LogView(self.settings["log_max_lines"], self.settings["log_max_bytes"])
+        left.addWidget(self.log, 1)
+        self.log_coalescer = LogCoalescer(self._flush_log, self.settings["log_flush_ms"], self)
 
         # 工具行
         tools = QHBoxLayout()
-        self.clear_btn = QPushButton(); self.clear_btn.clicked.connect(self.log.clear)
+        self.clear_btn = QPushButton(); self.clear_btn.clicked.connect(self._clear_log)
         self.export_btn = QPushButton(); self.export_btn.clicked.connect(self._export_log)
         self.btn_run_script = QPushButton(); self.btn_run_script.clicked.connect(self._run_script_dialog)
         self.btn_stop_script = QPushButton(); self.btn_stop_script.clicked.connect(self._stop_script)
         self.btn_stop_script.setEnabled(False)
+        self.btn_export_metrics = QPushButton(); self.btn_export_metrics.clicked.connect(self._export_metrics)
+        self.btn_export_metrics.setEnabled(False)
         self.about_btn = QPushButton(); self.about_btn.clicked.connect(self._show_about)
         self.settings_btn = QPushButton(); self.settings_btn.clicked.connect(self._open_settings)
         self.lang_label = QLabel()
@@ -1117,24 +1498,26 @@ class SerialTool(QWidget):
         tools.addWidget(self.export_btn)
         tools.addWidget(self.btn_run_script)
         tools.addWidget(self.btn_stop_script)
+        tools.addWidget(self.btn_export_metrics)
+        self.script_progress_label = QLabel()
+        tools.addWidget(self.script_progress_label)
         tools.addWidget(self.about_btn)
         tools.addWidget(self.settings_btn)
         tools.addWidget(self.lang_label)
         tools.addWidget(self.lang_cb)
         tools.addStretch(1)
+        self.log_stats_label = QLabel()
+        tools.addWidget(self.log_stats_label)
         left.addLayout(tools)
 
-        # -------- 右侧：命令按钮（保持原布局：标签 + ScrollArea）--------
-        right = QVBoxLayout(); root.addLayout(right, 2)
+        # -------- 右侧：命令按钮（标签 + 命令面板）--------
+        self._right_layout = right = QVBoxLayout(); root.addLayout(right, 2)
         self.right_title_label = QLabel()
         right.addWidget(self.right_title_label)
 
-        scroll = QScrollArea(); scroll.setWidgetResizable(True); scroll.setMinimumWidth(220)
-        self.cmd_container = CmdContainer(self)
-        scroll.setWidget(self.cmd_container)
-        right.addWidget(scroll)
-
-        self._rebuild_cmd_buttons()
+        self.cmd_panel = None
+        self._cmd_panel_widget = None
+        self._build_cmd_panel()
         self._apply_language()
         self._apply_theme()
 
@@ -1151,11 +1534,13 @@ class SerialTool(QWidget):
         self.export_btn.setText(self._tr("btn_export_log"))
         self.btn_run_script.setText(self._tr("btn_run_script"))
         self.btn_stop_script.setText(self._tr("btn_stop_script"))
+        self.btn_export_metrics.setText(self._tr("btn_export_metrics"))
         self.about_btn.setText(self._tr("btn_about"))
         self.settings_btn.setText(self._tr("btn_settings"))
         self.right_title_label.setText(self._tr("label_command_buttons"))
         self.lang_label.setText(self._tr("label_lang"))
-        self._rebuild_cmd_buttons()
+        self._update_log_stats()
+        self.cmd_panel.retranslate()
 
     def _update_open_btn_text(self):
         self.open_btn.setText(self._tr("btn_close") if self.serial.is_open else self._tr("btn_open"))
@@ -1176,7 +1561,7 @@ class SerialTool(QWidget):
             QWidget { background-color: #121212; color: #F0F0F0; }
             QPushButton { background-color: #1F1F1F; color: #F0F0F0; border: 1px solid #2A2A2A; padding: 6px 10px; border-radius: 4px; }
             QPushButton:hover { background-color: #2A2A2A; }
-            QLineEdit, QComboBox, QTextEdit { background-color: #1B1B1B; color: #F0F0F0; border: 1px solid #2A2A2A; }
+            QLineEdit, QComboBox, QTextEdit, QPlainTextEdit, QSpinBox { background-color: #1B1B1B; color: #F0F0F0; border: 1px solid #2A2A2A; }
             QScrollArea { background-color: #121212; }
             QDialog { background-color: #121212; }
             """
@@ -1185,8 +1570,15 @@ class SerialTool(QWidget):
         app.setStyleSheet(css)
 
     def _open_settings(self):
-        dlg = SettingsDialog(self.theme, self._tr, self)
+        dlg = SettingsDialog(self.theme, self._tr, self, settings=self.settings)
         if dlg.exec_() == QDialog.Accepted:
+            old_panel = self.settings["command_panel"]
+            self.settings = dlg.get_settings()
+            if self.settings["command_panel"] != old_panel:
+                self._build_cmd_panel()
+            self.log.set_limits(self.settings["log_max_lines"], self.settings["log_max_bytes"])
+            self.log_coalescer.set_interval(self.settings["log_flush_ms"])
+            self._apply_capture()
             new_theme = dlg.get_theme()
             if new_theme != self.theme:
                 self.theme = new_theme
@@ -1205,36 +1597,116 @@ class SerialTool(QWidget):
         QMessageBox.information(self, self._tr("about_title"), info)
 
     # ===== 串口辅助 =====
-    def _refresh_ports(self):
-        self.port_cb.clear()
-        ports = [p.device for p in serial.tools.list_ports.comports()]
-        if not ports:
-            ports = [self._tr("placeholder_no_device")]
-        self.port_cb.addItems(ports)
+    def _start_port_monitor(self):
+        """后台线程首次完整扫描，之后由 inotify 增量上报；刷新按钮只是请求一次完整重扫"""
+        self._port_scan_started = time.perf_counter()
+        self.port_cb.addItem(self._tr("placeholder_scanning"))
+        self.port_cb.addItems(virtual_port_names())  # 内置虚拟设备，排在真实串口之后
+        self.port_monitor.start()
+
+    def _on_ports_changed(self, added, removed):
+        """按差异增删下拉项（保持排序与当前选择），不清空重建"""
+        if self._port_scan_started is not None:
+            self.profile.span("port scan", self._port_scan_started, time.perf_counter())
+            self._port_scan_started = None
+            self.profile.done("port scan")
+        cb = self.port_cb
+        current = cb.currentText()
+        for text in [self._tr("placeholder_no_device"), self._tr("placeholder_scanning"), *removed]:
+            idx = cb.findText(text)
+            if idx >= 0:
+                cb.removeItem(idx)
+        for dev in added:
+            if cb.findText(dev) < 0:
+                items = [cb.itemText(i) for i in range(cb.count())]
+                cb.insertItem(bisect.bisect_left(items, dev), dev)
+        if cb.count() == len(VIRTUAL_MODES):  # 只剩虚拟设备
+            cb.insertItem(0, self._tr("placeholder_no_device"))
+        if cb.findText(current) >= 0:
+            cb.setCurrentText(current)
+        else:
+            cb.setCurrentIndex(0)  # 原选择是占位项或已拔出：回到第一个真实串口，不落到虚拟设备上
+
+        lost = self._lost_port
+        if lost and lost[0] in added and not self.serial.is_open:
+            self._reopen_tries = 0
+            QTimer.singleShot(self.REOPEN_DELAY_MS, self._reopen_lost_port)
+
+    def _reopen_lost_port(self):
+        """设备重新出现后自动重新打开；权限尚未就绪等失败时稍后重试，次数用完则等下一次插入"""
+        if self._lost_port is None or self.serial.is_open:
+            return
+        port, baud = self._lost_port
+        try:
+            self._open_port(port, baud)
+        except Exception as e:
+            self._release_serial()
+            self._reopen_tries += 1
+            if self._reopen_tries < self.REOPEN_ATTEMPTS:
+                QTimer.singleShot(self.REOPEN_DELAY_MS * self._reopen_tries, self._reopen_lost_port)
+            else:
+                self._log(self._tr("msg_port_reopen_fail", port=port, err=e))
+            return
+        self._lost_port = None
+        self.port_cb.setCurrentText(port)
+        self._log(self._tr("msg_port_reopened", port=port, baud=baud))
+
+    def _start_link(self):
+        self._rx_decoder.reset()
+        self.link = SerialLink(self.serial)
+        self.link.subscribe(self.sig_rx.emit)
+        self.link.subscribe(self._capture_data)
+        self.link.subscribe_tx(self._on_link_tx)
+        self.link.on_error = lambda exc: self.sig_rx_error.emit(str(exc))
+        self.link.start()
 
     def _release_serial(self):
+        if self.script_runner and self.script_runner.isRunning():
+            self.script_runner.stop()  # 脚本不能在已关闭的链路上继续等待
+        if self.link:
+            self.link.stop()
+            self.link = None
         if self.serial.is_open:
-            self.timer.stop()
             try:
                 self.serial.flush(); self.serial.reset_input_buffer(); self.serial.reset_output_buffer()
                 self.serial.dtr = False; self.serial.rts = False; self.serial.close()
             except Exception:
                 pass
         self.serial = serial.Serial(exclusive=False)
+        self._virtual_device = None
         self._update_open_btn_text()
 
+    def _open_port(self, port, baud):
+        """打开串口并启动读写链路；失败时抛出异常（调用方负责 _release_serial）。virtual:<mode> 打开内置虚拟设备"""
+        virtual = parse_virtual_port(port)
+        device = None
+        if virtual is not None:
+            mode, rate = virtual
+            device = VirtualDevice(mode, rate or self.settings["virtual_stream_rate"])
+            port = device.path
+        self.serial.port = port; self.serial.baudrate = baud; self.serial.timeout = 0.5
+        try:
+            self.serial.open()
+        except Exception:
+            if device is not None:
+                device.close()
+            raise
+        if device is not None:
+            device.start()  # 之后随串口关闭而结束
+        self._virtual_device = device
+        self._update_open_btn_text()
+        self._start_link()
+
     def _toggle_serial(self):
+        self._lost_port = None  # 手动打开 / 关闭后不再自动重连
         if self.serial.is_open:
-            self._release_serial(); self.log.append(self._tr("msg_closed")); return
+            self._release_serial(); self._log(self._tr("msg_closed")); return
         port = self.port_cb.currentText()
-        if self._tr("placeholder_no_device") == port:
+        if port in (self._tr("placeholder_no_device"), self._tr("placeholder_scanning")):
             QMessageBox.warning(self, self._tr("msg_no_port_title"), self._tr("msg_no_port")); return
         try:
-            self.serial.port = port; self.serial.baudrate = int(self.baud_cb.currentText()); self.serial.timeout = 0.5
-            self.serial.open()
-            self._update_open_btn_text()
-            self.log.append(self._tr("msg_opened", port=port, baud=self.serial.baudrate))
-            self.timer.start(100)
+            self._open_port(port, int(self.baud_cb.currentText()))
+            self._log(self._tr("msg_opened", port=port, baud=self.serial.baudrate))
         except Exception as e:
             QMessageBox.critical(self, self._tr("msg_open_fail_title"), str(e)); self._release_serial()
 
@@ -1255,53 +1727,89 @@ class SerialTool(QWidget):
             return
 
         try:
-            text = Path(path).read_text(encoding="utf-8")
-            tree = parse_script(text)
-            steps = flatten_cmds(tree)
+            script = self.script_cache.load(path)
         except Exception as e:
             QMessageBox.critical(self, self._tr("msg_script_load_error_title"), str(e))
             return
-
-        self.log.append(self._tr("msg_script_loaded", steps=len(steps)))
-        # 暂停 GUI 定时读取，避免消耗串口数据，交由脚本线程等待
-        self.timer.stop()
-
-        self.script_runner = ScriptRunner(steps, self.serial, self._tr)
-        self.script_runner.sig_log.connect(self.log.append)
-        self.script_runner.sig_send.connect(self._script_send)   # 在主线程发送
+        program, analysis = script.program, script.analysis
+
+        if script.source != "parsed":
+            self._log(self._tr("msg_script_cached", source=script.source))
+        for line in describe_analysis(analysis, self._tr):
+            self._log(line)
+        self._log(self._tr("msg_script_loaded", steps=analysis.steps))
+
+        # 读线程继续负责显示；脚本线程订阅同一读线程做 EXPECT 等待
+        runner_cls = AsyncScriptRunner if self.settings["script_engine"] == "async" else ScriptRunner
+        self.script_metrics = RunMetrics()  # 逐步计时：结束时输出汇总，可导出 CSV / JSON
+        self.script_runner = runner_cls(program, self.link, self._tr, max_lookback=self.settings["expect_lookback"],
+                                        metrics=self.script_metrics)
+        self.script_runner.sig_log.connect(self._log)
+        self.script_runner.sig_progress.connect(self._script_progress)
         self.script_runner.sig_done.connect(self._script_done)
         self.btn_run_script.setEnabled(False)
         self.btn_stop_script.setEnabled(True)
+        self.btn_export_metrics.setEnabled(False)
         self.script_runner.start()
 
     def _stop_script(self):
         if self.script_runner and self.script_runner.isRunning():
             self.script_runner.stop()
-            self.log.append(self._tr("msg_script_stopping"))
+            self._log(self._tr("msg_script_stopping"))
+
+    def _script_progress(self, done, total):
+        self.script_progress_label.setText(self._tr("label_script_progress", done=done, total=total))
 
     def _script_done(self, ok, msg):
-        self.log.append(self._tr("msg_script_result", msg=msg))
+        self._log(self._tr("msg_script_result", msg=msg))
+        if self.script_metrics is not None and self.script_metrics.steps:
+            for line in describe_metrics(self.script_metrics.summary(), self._tr):
+                self._log(line)
+            self.btn_export_metrics.setEnabled(True)
         self.btn_run_script.setEnabled(True)
         self.btn_stop_script.setEnabled(False)
         self.script_runner = None
-        # 恢复 GUI 定时器读取
-        if self.serial.is_open:
-            self.timer.start(100)
 
-    def _script_send(self, cmd):
-        # 脚本线程发来的发送请求 -> 主线程复用现有发送逻辑（自动 CRLF）
-        self._send_cmd(cmd)
+    def _export_metrics(self):
+        """导出上一次脚本运行的逐步计时：.json 为汇总 + 明细，.csv 为明细"""
+        metrics = self.script_metrics
+        if metrics is None or self.script_runner is not None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, self._tr("btn_export_metrics"), "script_timing.csv",
+                                              "CSV (*.csv);;JSON (*.json)")
+        if path:
+            try:
+                metrics.write(path)
+                QMessageBox.information(self, self._tr("msg_save_success_title"), self._tr("msg_export_success", path=path))
+            except Exception as e:
+                QMessageBox.critical(self, self._tr("btn_export_metrics"), self._tr("msg_export_fail", err=e))
 
     # ===== 命令按钮 =====
-    def _rebuild_cmd_buttons(self):
-        self.cmd_container.rebuild()
+    def _build_cmd_panel(self):
+        """按设置创建命令面板：list 为虚拟化列表（CommandPanel），buttons 为按钮控件（CmdContainer）"""
+        if self.settings["command_panel"] == "buttons":
+            self.cmd_panel = CmdContainer(self)
+            widget = QScrollArea(); widget.setWidgetResizable(True); widget.setMinimumWidth(220)
+            widget.setWidget(self.cmd_panel)
+        else:
+            self.cmd_panel = widget = CommandPanel(self)
+        old = self._cmd_panel_widget
+        if old is None:
+            self._right_layout.addWidget(widget)
+        else:
+            self._right_layout.replaceWidget(old, widget)
+            old.deleteLater()
+        self._cmd_panel_widget = widget
+        self._sync_cmd_buttons()
+
+    def _sync_cmd_buttons(self, group_ids=None):
+        """刷新命令面板：只比对 group_ids 中分组的命令（None 为全部），分组增删总会同步"""
+        self.cmd_panel.sync(group_ids)
 
     def _choose_group_id(self):
         """选择要添加到的分组，返回分组 ID 或 None"""
-        if not self.groups:
-            return None
-        if len(self.groups) == 1:
-            return self.groups[0]["id"]
+        if self.library.group_count() <= 1:
+            return self.library.first_group_id()
 
         dialog = QDialog(self)
         dialog.setWindowTitle(self._tr("dlg_choose_group_title"))
@@ -1309,7 +1817,7 @@ class SerialTool(QWidget):
         layout.addWidget(QLabel(self._tr("dlg_choose_group_prompt")))
 
         cb = QComboBox(dialog)
-        for g in self.groups:
+        for g in self.library.groups():
             cb.addItem(g["name"], g["id"])
         layout.addWidget(cb)
 
@@ -1327,32 +1835,16 @@ class SerialTool(QWidget):
         if not cmd:
             return
         # 检查命令是否已存在于任何分组
-        for group in self.groups:
-            if cmd in group.get("commands", []):
-                QMessageBox.information(self, self._tr("msg_cmd_exists_warn_title"), self._tr("msg_cmd_exists"))
-                return
+        if self.library.find_command(cmd) is not None:
+            QMessageBox.information(self, self._tr("msg_cmd_exists_warn_title"), self._tr("msg_cmd_exists"))
+            return
         target_group_id = self._choose_group_id()
         if not target_group_id:
             return
         # 添加到指定分组
-        target_group = None
-        for group in self.groups:
-            if group["id"] == target_group_id:
-                target_group = group
-                break
-        if target_group:
-            target_group["commands"].append(cmd)
-        else:
-            self.groups.append({
-                "id": str(uuid.uuid4())[:8],
-                "name": "默认分组",
-                "color": "#F5F5F5",
-                "collapsed": False,
-                "commands": [cmd]
-            })
-            target_group = self.groups[-1]
-        save_groups(self.groups)
-        self._rebuild_cmd_buttons()
+        self.library.add_command(target_group_id, cmd)
+        self._schedule_save()
+        self._sync_cmd_buttons((target_group_id,))
         self.send_le.clear()
 
     def _edit_dialog(self, cmd, group_id):
@@ -1366,68 +1858,144 @@ class SerialTool(QWidget):
             return
         new_cmd = new_text.strip()
 
-        # 找到命令所在的分组
-        group = None
-        for g in self.groups:
-            if g["id"] == group_id:
-                group = g
-                break
-        
-        if not group:
+        if self.library.find_command(cmd) != group_id:
             return
 
         if new_cmd == "":
             # 删除命令
-            if cmd in group["commands"]:
-                group["commands"].remove(cmd)
-                save_groups(self.groups)
-                self._rebuild_cmd_buttons()
+            if self.library.remove_command(cmd):
+                self._schedule_save()
+                self._sync_cmd_buttons((group_id,))
             return
 
         if new_cmd == cmd:
             return
 
         # 检查新命令是否已存在
-        for g in self.groups:
-            if new_cmd in g.get("commands", []):
-                QMessageBox.warning(self, self._tr("msg_cmd_exists_warn_title"), self._tr("msg_cmd_exists"))
-                return
+        if self.library.find_command(new_cmd) is not None:
+            QMessageBox.warning(self, self._tr("msg_cmd_exists_warn_title"), self._tr("msg_cmd_exists"))
+            return
 
         resp = QMessageBox.question(
             self, self._tr("msg_question_title"), self._tr("msg_replace_or_copy", old=cmd, new=new_cmd),
             QMessageBox.Yes | QMessageBox.No
         )
         if resp == QMessageBox.Yes:
-            idx = group["commands"].index(cmd)
-            group["commands"][idx] = new_cmd
+            self.library.replace_command(cmd, new_cmd)
         else:
-            group["commands"].append(new_cmd)
-        save_groups(self.groups)
-        self._rebuild_cmd_buttons()
+            self.library.add_command(group_id, new_cmd)
+        self._schedule_save()
+        self._sync_cmd_buttons((group_id,))
 
     def _send_cmd(self, cmd):
         if not cmd:
             return
-        if not self.serial.is_open:
-            self.log.append(self._tr("msg_open_first")); return
-        try:
-            self.serial.write((cmd + "\r\n").encode())
-            self.log.append(f">>> {cmd}")
-        except Exception as e:
-            self.log.append(self._tr("msg_send_error", err=e))
+        self._write_bytes(cmd.encode() + LINE_ENDING)
+
+    def _write_bytes(self, data):
+        # 与脚本共用链路的有序发送队列；回显在写出后由 _on_tx_data 完成
+        if not self.serial.is_open or self.link is None:
+            self._log(self._tr("msg_open_first")); return
+        self.link.write(data)
+
+    def _on_link_tx(self, data, error):
+        # 写线程回调：落盘后转到主线程回显
+        if error is None:
+            self._capture_data(data, tx=True)
+        self.sig_tx.emit(data, "" if error is None else str(error))
+
+    def _on_tx_data(self, data, err):
+        if err:
+            self._log(self._tr("msg_send_error", err=err))
+        else:
+            self._log(f">>> {describe_bytes(data)}")
+
+    def _on_rx_data(self, data):
+        # 增量解码：多字节 UTF-8 字符被拆到两个数据块时不会丢字
+        text = self._rx_decoder.decode(data)
+        if text:
+            self._log(text)
+
+    def _on_rx_error(self, err):
+        # 读线程已退出（如设备拔出），关闭串口以便重新打开
+        self._log(self._tr("msg_recv_error", err=err))
+        port, baud = self.serial.port, self.serial.baudrate
+        virtual = self._virtual_device is not None  # 虚拟设备的 pty 不会重新出现
+        self._release_serial()
+        self._log(self._tr("msg_closed"))
+        if self.settings["auto_reopen"] and port and not virtual:
+            self._lost_port = (port, baud)
+            self._log(self._tr("msg_port_lost", port=port))
 
-    def _read_data(self):
+    # ===== 日志 =====
+    def _log(self, text):
+        # 所有日志来源统一经合并器，按刷新周期批量插入
+        self.log_coalescer.push(text)
+
+    def _flush_log(self, text):
+        self.log.append(text)
+        self._update_log_stats()
+
+    def _update_log_stats(self):
+        c = self.log_coalescer
+        self.log_stats_label.setText(self._tr("label_log_stats", appends=c.appends, flushes=c.flushes, merged=c.merged))
+
+    def _clear_log(self):
+        self.log_coalescer.reset()
+        self.log.clear()
+        self._update_log_stats()
+
+    def _capture_data(self, data, tx=False):
+        # 读线程与写线程都会调用；CaptureWriter.write 线程安全
+        capture = self.capture
+        if capture is not None:
+            capture.write(data, tx)
+
+    def _apply_capture(self):
+        """按当前设置启动/重启/停止落盘"""
+        cfg = self.settings
+        wanted = None
+        if cfg["capture_enabled"]:
+            wanted = (Path(cfg["capture_dir"]), cfg["capture_max_bytes"], cfg["capture_rotate_s"], cfg["capture_compression"])
+        current = self.capture
+        if current is not None:
+            have = (current.directory, current.max_bytes, current.rotate_s, current.compression)
+            if have == wanted:
+                return
+            self.capture = None
+            current.stop()
+            self._log(self._tr("msg_capture_stopped"))
+        if wanted is None:
+            return
+        writer = CaptureWriter(wanted[0], max_bytes=wanted[1], rotate_s=wanted[2], compression=wanted[3])
         try:
-            if self.serial.is_open and self.serial.in_waiting:
-                data = self.serial.read(self.serial.in_waiting).decode(errors="ignore")
-                if data:
-                    self.log.append(data)
-        except Exception as e:
-            self.log.append(self._tr("msg_recv_error", err=e))
+            writer.start()
+        except OSError as e:
+            self._log(self._tr("msg_capture_fail", err=e))
+            return
+        self.capture = writer
+        self._log(self._tr("msg_capture_started", path=writer.current_path))
 
-    # ===== 日志 =====
     def _export_log(self):
-        txt = self.log.toPlainText().strip()
+        capture = self.capture
+        if capture is not None and capture.error is None:
+            # 落盘模式：从本次抓包的全部分段文件导出，无需序列化整个日志文档
+            path, _ = QFileDialog.getSaveFileName(self, self._tr("msg_export_title"), "serial_log.txt", "Text Files (*.txt)")
+            if path:
+                QApplication.setOverrideCursor(Qt.WaitCursor)
+                try:
+                    capture.flush()
+                    export_capture(capture.segments, path)
+                except Exception as e:
+                    QApplication.restoreOverrideCursor()
+                    QMessageBox.critical(self, self._tr("msg_export_title"), self._tr("msg_export_fail", err=e))
+                else:
+                    QApplication.restoreOverrideCursor()
+                    QMessageBox.information(self, self._tr("msg_save_success_title"), self._tr("msg_export_success", path=path))
+            return
+
+        self.log_coalescer.flush()
+        txt = self.log.plain_text().strip()
         if not txt:
             QMessageBox.information(self, self._tr("msg_no_log_title"), self._tr("msg_export_no_log")); return
         path, _ = QFileDialog.getSaveFileName(self, self._tr("msg_export_title"), "serial_log.txt", "Text Files (*.txt)")
@@ -1439,66 +2007,53 @@ class SerialTool(QWidget):
                 QMessageBox.critical(self, self._tr("msg_export_title"), self._tr("msg_export_fail", err=e))
 
     # ===== 分组管理 =====
-    def move_command(self, cmd, from_group_id, to_group_id, insert_idx):
-        """跨分组移动命令"""
-        # 从源分组移除
-        for group in self.groups:
-            if group["id"] == from_group_id:
-                if cmd in group["commands"]:
-                    group["commands"].remove(cmd)
-                break
-        
-        # 添加到目标分组
-        for group in self.groups:
-            if group["id"] == to_group_id:
-                group["commands"].insert(insert_idx, cmd)
-                break
-        
-        save_groups(self.groups)
-        self._rebuild_cmd_buttons()
+    def move_command(self, cmd, from_group_id, to_group_id, before=None):
+        """跨分组移动命令：放到目标分组中 before 之前（None 为末尾）"""
+        if self.library.find_command(cmd) != from_group_id:
+            return
+        if not self.library.move_command(cmd, to_group_id, before):
+            return
+        self._schedule_save()
+        self._sync_cmd_buttons((from_group_id, to_group_id))
     
-    def _on_group_changed(self):
-        """分组属性变更（折叠状态、颜色等）"""
-        # 更新groups数据
-        for i in range(self.cmd_container.vbox.count()):
-            w = self.cmd_container.vbox.itemAt(i).widget()
-            if isinstance(w, GroupBox):
-                for group in self.groups:
-                    if group["id"] == w.group_id:
-                        group["name"] = w.name
-                        group["color"] = w.color
-                        group["collapsed"] = w.collapsed
-                        break
-        save_groups(self.groups)
+    def set_group_collapsed(self, group_id, collapsed):
+        """面板折叠/展开分组后写回命令库（面板已自行更新显示）"""
+        self.library.update_group(group_id, collapsed=collapsed)
+        self._schedule_save()
+    
+    def edit_group(self, group_id):
+        """编辑分组名称和颜色，或删除分组"""
+        group = self.library.get_group(group_id)
+        if group is None:
+            return
+        dialog = GroupEditDialog(group["name"], group["color"], self._tr, self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        new_name, new_color = dialog.get_values()
+        if new_color == "__DELETE__":
+            self.delete_group(group_id)
+        elif new_name != group["name"] or new_color != group["color"]:
+            self.library.update_group(group_id, name=new_name, color=new_color)
+            self._schedule_save()
+            self._sync_cmd_buttons(())
     
     def _create_new_group(self):
         """创建新分组"""
         name, ok = QInputDialog.getText(self, self._tr("dlg_new_group_title"), self._tr("dlg_new_group_prompt"))
         if ok and name.strip():
-            new_group = {
-                "id": str(uuid.uuid4())[:8],
-                "name": name.strip(),
-                "color": PRESET_COLORS[len(self.groups) % len(PRESET_COLORS)][0],
-                "collapsed": False,
-                "commands": []
-            }
-            self.groups.append(new_group)
-            save_groups(self.groups)
-            self._rebuild_cmd_buttons()
+            color = PRESET_COLORS[self.library.group_count() % len(PRESET_COLORS)][0]
+            self.library.add_group(name.strip(), color)
+            self._schedule_save()
+            self._sync_cmd_buttons(())
     
     def delete_group(self, group_id):
         """删除分组"""
-        if len(self.groups) <= 1:
+        if self.library.group_count() <= 1:
             QMessageBox.warning(self, self._tr("msg_no_port_title"), self._tr("msg_group_delete_warn"))
             return
         
         # 找到要删除的分组
-        group_to_delete = None
-        for group in self.groups:
-            if group["id"] == group_id:
-                group_to_delete = group
-                break
-        
+        group_to_delete = self.library.get_group(group_id)
         if not group_to_delete:
             return
         
@@ -1511,12 +2066,11 @@ class SerialTool(QWidget):
         
         if resp == QMessageBox.Yes:
             # 将命令移至第一个其他分组
-            commands = group_to_delete.get("commands", [])
-            self.groups.remove(group_to_delete)
-            if commands and self.groups:
-                self.groups[0]["commands"].extend(commands)
-            save_groups(self.groups)
-            self._rebuild_cmd_buttons()
+            remaining = [g["id"] for g in self.library.groups(with_commands=False) if g["id"] != group_id]
+            merge_into = remaining[0] if remaining else None
+            self.library.delete_group(group_id, merge_into=merge_into)
+            self._schedule_save()
+            self._sync_cmd_buttons((merge_into,))
 
     # ===== 关闭 =====
     def closeEvent(self, ev):
@@ -1524,25 +2078,45 @@ class SerialTool(QWidget):
         if self.script_runner and self.script_runner.isRunning():
             self.script_runner.stop()
             self.script_runner.wait(200)
-        save_groups(self.groups)
+        if AsyncScriptRunner._loop_thread is not None:
+            AsyncScriptRunner._loop_thread.stop()
+        self.port_monitor.stop()
+        self._save_timer.stop()
+        self.library.close()  # 提交并等待最后一次写入完成
         self._release_serial()
+        if self.capture is not None:
+            self.capture.stop()
+            self.capture = None
         super().closeEvent(ev)
 
 
 # ---------- main ----------
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
+def main(argv):
+    profile = StartupProfile("--profile-startup" in argv, marks=_STARTUP_IMPORTS)
+    app = QApplication([a for a in argv if a != "--profile-startup"])
     app.setApplicationName(APP_NAME)
     try:
         app.setDesktopFileName(APP_NAME)
     except Exception:
         pass
+    profile.mark("QApplication")
 
-    icon_path = Path(__file__).with_name("linux_free_uart.png")
-    app_icon = build_app_icon(icon_path)
+    app_icon = load_app_icon(Path(__file__).with_name("linux_free_uart.png"))
     app.setWindowIcon(app_icon)
+    profile.mark("app icon")
 
-    w = SerialTool()
+    w = SerialTool(profile)
     w.setWindowIcon(app_icon)
     w.show()
-    sys.exit(app.exec_())
+    profile.mark("show")
+    if profile.enabled:
+        def first_frame():
+            profile.mark("first frame")
+            profile.done("first frame")
+        # 零延时定时器在首帧的显示 / 绘制事件之后才执行
+        QTimer.singleShot(0, first_frame)
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
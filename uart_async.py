@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+uart_async - asyncio 版串口链路与脚本引擎（可选；导入 asyncio 较慢，只在选用时加载）
+- AsyncSerialLink：loop.add_reader / add_writer 直接监听 tty fd，不创建线程
+- AsyncScriptEngine：SEND / EXPECT / DELAY 都是协程，多串口多脚本共用一个事件循环线程
+- AsyncLoopThread：后台事件循环线程，供 GUI（Qt 事件循环）等非 asyncio 宿主提交协程
+"""
+
+import asyncio, os, signal, threading, time
+from collections import deque
+from concurrent.futures import Future
+
+from uart_core import (
+    translate, EXPECT_MAX_LOOKBACK, ExpectMatcher, iter_steps, count_steps, prepare_send,
+)
+
+
+# ---------- 串口链路 ----------
+class AsyncSerialLink:
+    """
+    asyncio 串口链路，接口与 SerialLink 相同（subscribe / subscribe_tx / write / start / stop）。
+    - 读：fd 可读时非阻塞 os.read，数据块分发给订阅者
+    - 写：write() 返回 asyncio.Future；按提交顺序写出，fd 写满（EAGAIN）时挂 add_writer 等待
+    - 全部方法与回调都在事件循环线程中执行；需要有 fileno() 的 POSIX 串口
+    """
+    READ_SIZE = 1 << 16
+
+    def __init__(self, serial_obj, loop=None):
+        self.ser = serial_obj
+        self.on_error = None
+        self._loop = loop
+        self._fd = None
+        self._subscribers = ()
+        self._tx_subscribers = ()
+        self._tx = deque()  # [data, 未写出的 memoryview, future]
+        self._writing = False
+
+    def subscribe(self, fn):
+        self._subscribers = self._subscribers + (fn,)
+
+    def unsubscribe(self, fn):
+        self._subscribers = tuple(s for s in self._subscribers if s != fn)
+
+    def subscribe_tx(self, fn):
+        self._tx_subscribers = self._tx_subscribers + (fn,)
+
+    def unsubscribe_tx(self, fn):
+        self._tx_subscribers = tuple(s for s in self._tx_subscribers if s != fn)
+
+    def start(self):
+        if self._fd is not None:
+            return
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        fd = self.ser.fileno()
+        os.set_blocking(fd, False)
+        self._fd = fd
+        self._loop.add_reader(fd, self._on_readable)
+
+    def write(self, data: bytes) -> asyncio.Future:
+        """有序发送；Future 结果为写出的字节数，写失败时抛出原异常"""
+        loop = self._loop or asyncio.get_running_loop()
+        fut = loop.create_future()
+        if self._fd is None:
+            fut.set_exception(RuntimeError("AsyncSerialLink not started"))
+            return fut
+        self._tx.append([data, memoryview(data), fut])
+        if not self._writing:
+            self._flush()
+        return fut
+
+    def stop(self):
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        if self._writing:
+            self._loop.remove_writer(self._fd)
+            self._writing = False
+        while self._tx:
+            self._tx.popleft()[2].cancel()
+        self._fd = None
+
+    def _flush(self):
+        tx = self._tx
+        while tx:
+            item = tx[0]
+            data, view, fut = item
+            if fut.cancelled() and len(view) == len(data):
+                tx.popleft()  # 尚未写出任何字节的请求可以直接丢弃
+                continue
+            try:
+                n = os.write(self._fd, view)
+            except BlockingIOError:
+                n = 0
+            except Exception as exc:
+                tx.popleft()
+                if not fut.done():
+                    fut.set_exception(exc)
+                self._notify_tx(data, exc)
+                continue
+            if n < len(view):
+                item[1] = view[n:]
+                if not self._writing:
+                    self._writing = True
+                    self._loop.add_writer(self._fd, self._flush)
+                return
+            tx.popleft()
+            if not fut.done():
+                fut.set_result(len(data))
+            self._notify_tx(data, None)
+        if self._writing:
+            self._writing = False
+            self._loop.remove_writer(self._fd)
+
+    def _notify_tx(self, data, error):
+        for fn in self._tx_subscribers:
+            try:
+                fn(data, error)
+            except Exception as exc:
+                print("[WARN] AsyncSerialLink tx subscriber:", exc)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except Exception as exc:
+            self._fail(exc)
+            return
+        if not data:
+            self._fail(OSError("device reports readiness to read but returned no data"))
+            return
+        for fn in self._subscribers:
+            try:
+                fn(data)
+            except Exception as exc:
+                print("[WARN] AsyncSerialLink subscriber:", exc)
+
+    def _fail(self, exc):
+        self._loop.remove_reader(self._fd)
+        if self.on_error:
+            self.on_error(exc)
+
+
+# ---------- 接收缓冲 ----------
+class RxBuffer:
+    """StreamReader 风格的接收缓冲（只在事件循环线程中使用）：feed() 追加并唤醒，read() 无数据时挂起"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._waiter = None
+
+    def feed(self, data: bytes):
+        self._buf += data
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def clear(self):
+        self._buf.clear()
+
+    async def read(self) -> bytes:
+        while not self._buf:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+# ---------- 脚本引擎 ----------
+class AsyncScriptEngine:
+    """
+    ScriptEngine 的协程版本，日志、进度与返回值相同。
+    - link 可以是 AsyncSerialLink（同一事件循环），也可以是 SerialLink：
+      其 write() 返回的 concurrent Future 经 wrap_future 等待，读线程的数据经 call_soon_threadsafe 转入循环
+    - EXPECT 用 wait_for 限时等待 RxBuffer；DELAY 为 asyncio.sleep
+    - stop() 线程安全：取消正在运行的 run() 任务
+    - metrics（RunMetrics，可选）与 ScriptEngine 相同，按 time.monotonic 记录逐步耗时
+    """
+
+    PROGRESS_INTERVAL = 0.1  # 进度上报间隔（秒），同时作为长时间纯 SET 步骤时让出循环的间隔
+
+    def __init__(self, program, link, tr_fn=None, max_lookback=EXPECT_MAX_LOOKBACK,
+                 on_log=None, on_progress=None, metrics=None):
+        self._program = program
+        self.total_steps = count_steps(program)
+        self.steps_done = 0
+        self._stop = False
+        self._vars = {}
+        self._link = link
+        self._rx = RxBuffer()
+        self._gen = 0  # 每次 EXPECT 递增；来自读线程的旧数据按代次丢弃
+        self._armed = False
+        self._loop = None
+        self._task = None
+        self._loop_thread = None
+        self._max_lookback = max_lookback
+        self._tr = tr_fn or (lambda key, **kw: translate(key, "en", **kw))
+        self._on_log = on_log or (lambda text: None)
+        self._on_progress = on_progress or (lambda done, total: None)
+        self.metrics = metrics
+
+    def stop(self):
+        self._stop = True
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            loop.call_soon_threadsafe(task.cancel)
+
+    def feed(self, data: bytes):
+        """链路订阅回调：可能来自事件循环线程（AsyncSerialLink）或读线程（SerialLink）"""
+        if not self._armed:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._rx.feed(data)
+        else:
+            self._loop.call_soon_threadsafe(self._feed_gen, self._gen, data)
+
+    def _feed_gen(self, gen, data):
+        if self._armed and gen == self._gen:
+            self._rx.feed(data)
+
+    def _arm(self):
+        self._gen += 1
+        self._rx.clear()
+        self._armed = True
+
+    async def _expect(self, matcher: ExpectMatcher):
+        while True:
+            if matcher.feed(await self._rx.read()):
+                return
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._loop_thread = threading.get_ident()
+        if self._stop:
+            return False, self._tr("msg_script_stop")
+        self._link.subscribe(self.feed)
+        log = self._on_log
+        prefix = self._tr("msg_script_prefix")
+        loop_time = self._loop.time
+        metrics = self.metrics
+        clock = time.monotonic
+        done = 0
+        next_report = 0.0
+        if metrics is not None:
+            metrics.start()
+        try:
+            for step in iter_steps(self._program):
+                now = loop_time()
+                if now >= next_report:
+                    self._on_progress(done, self.total_steps)
+                    next_report = now + self.PROGRESS_INTERVAL
+                    await asyncio.sleep(0)
+                done += 1
+                self.steps_done = done
+
+                op = step.op
+                if op == "SET":
+                    self._vars[step.name] = step.data
+                    log(f"{prefix} SET {step.name} = ({len(step.data)} bytes)")
+                    continue
+
+                if op == "SEND":
+                    expect = step.expect
+                    payload, timeout_ms, log_line = prepare_send(step, self._vars, prefix)
+                    log(log_line)
+                    if expect:
+                        self._arm()  # 先开始收集，再发送
+                    t_start = clock()
+                    fut = self._link.write(payload)
+                    if isinstance(fut, Future):
+                        fut = asyncio.wrap_future(fut)
+                    await fut
+                    if expect:
+                        spec = step.expect_spec
+                        if spec.error is not None:
+                            log(f"{prefix} {self._tr('msg_bad_regex', err=spec.error)}")
+                        matcher = ExpectMatcher(spec, self._max_lookback)
+                        t_sent = clock()
+                        try:
+                            await asyncio.wait_for(self._expect(matcher), timeout_ms / 1000.0)
+                            ok = True
+                        except asyncio.TimeoutError:
+                            ok = False
+                        finally:
+                            self._armed = False
+                        if metrics is not None:
+                            metrics.add_send(done, step.text, t_start, t_sent, clock(), matcher.nbytes, timeout_ms, ok)
+                        if not ok:
+                            return False, self._tr("msg_script_wait_timeout", expect=expect, timeout=timeout_ms)
+                    elif metrics is not None:
+                        metrics.add_send(done, step.text, t_start, clock())
+                    continue
+
+                if op == "DELAY":
+                    log(f"{prefix} DELAY {step.ms} ms")
+                    t_start = clock()
+                    await asyncio.sleep(step.ms / 1000.0)
+                    if metrics is not None:
+                        metrics.add_delay(done, step.ms, t_start, clock())
+                    continue
+
+                log(f"{prefix} {self._tr('msg_script_unknown_step', op=op)}")
+
+            self._on_progress(done, self.total_steps)
+            return True, self._tr("msg_script_done")
+        except asyncio.CancelledError:
+            if not self._stop:
+                raise  # 不是 stop() 发起的取消，交给调用方
+            return False, self._tr("msg_script_stop")
+        except Exception as e:
+            return False, self._tr("msg_script_exception", err=e)
+        finally:
+            self._armed = False
+            self._task = None
+            self._link.unsubscribe(self.feed)
+            if metrics is not None:
+                metrics.finish()
+
+
+# ---------- 事件循环线程（桥接 Qt 等宿主） ----------
+class AsyncLoopThread:
+    """
+    后台线程运行一个 asyncio 事件循环；GUI 中所有异步脚本共用这一个线程。
+    submit() 线程安全，返回 concurrent.futures.Future，可用 add_done_callback 接回宿主。
+    """
+
+    def __init__(self, name="asyncio-loop"):
+        self.loop = None
+        self._name = name
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout=1.0):
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        if not self.loop.is_running():
+            self.loop.close()
+
+
+def run_many_async(jobs):
+    """所有 PortJob 在当前线程的一个事件循环中并发运行；Ctrl-C 停止全部，返回各自结果"""
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        def stop_all():
+            for job in jobs:
+                job.stop()
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, stop_all)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # 非主线程或平台不支持：由 asyncio.run 的默认处理取消任务
+        try:
+            return list(await asyncio.gather(*(job.run_async() for job in jobs)))
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+    return asyncio.run(main())
@@ -0,0 +1,3011 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+uart_core - linux_free_uart 的无界面核心（不依赖 PyQt5）
+- 基础信息、多语言文本、commands.json 读写
+- SerialLink：串口后台读/写线程；CaptureWriter：原始数据落盘
+- 脚本 DSL：解析 / 编译 / 执行（ScriptEngine），GUI 与命令行共用
+- 命令行：python linux_free_uart.py run script.uartscript --port /dev/ttyUSB0
+"""
+
+import json, sys, os, time, re, codecs, select, threading, queue, shutil, struct, math, heapq
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from pathlib import Path
+
+# ---------- 基础信息 ----------
+APP_NAME = "linux_free_uart"
+APP_VERSION = "1.0.0"
+APP_AUTHOR = "moonlitcodex"
+APP_LICENSE = "MIT License"
+APP_EMAIL = "moonlitcodex@qq.com"
+
+# ---------- 语言与翻译 ----------
+LANGUAGES = {
+    "en": "English",
+    "zh": "简体中文",
+}
+
+TRANSLATIONS = {
+    "title_main": {
+        "en": f"{APP_NAME} - Serial Assistant",
+        "zh": f"{APP_NAME} - 串口调试助手",
+    },
+    "label_port": {"en": "Port:", "zh": "串口:"},
+    "btn_refresh": {"en": "Refresh", "zh": "刷新"},
+    "label_baud": {"en": "Baud:", "zh": "波特率:"},
+    "btn_open": {"en": "Open", "zh": "打开串口"},
+    "btn_close": {"en": "Close", "zh": "关闭串口"},
+    "btn_send": {"en": "Send", "zh": "发送"},
+    "btn_save_button": {"en": "Save as Button", "zh": "保存为按钮"},
+    "label_command_buttons": {"en": "Command Buttons", "zh": "命令按钮"},
+    "btn_clear_log": {"en": "Clear Log", "zh": "清空日志"},
+    "btn_export_log": {"en": "Export Log", "zh": "导出日志"},
+    "btn_run_script": {"en": "Run Script", "zh": "运行脚本"},
+    "btn_stop_script": {"en": "Stop Script", "zh": "停止脚本"},
+    "btn_export_metrics": {"en": "Export Timing", "zh": "导出计时"},
+    "btn_about": {"en": "About", "zh": "关于"},
+    "btn_settings": {"en": "Settings", "zh": "设置"},
+    "btn_new_group": {"en": "+ New Group", "zh": "+ 新建分组"},
+    "placeholder_empty_group": {"en": "Drag commands here", "zh": "拖拽命令到此处"},
+    "placeholder_no_device": {"en": "<No Device>", "zh": "<无设备>"},
+    "placeholder_scanning": {"en": "<Scanning…>", "zh": "<正在扫描…>"},
+    "msg_no_port_title": {"en": "Notice", "zh": "提示"},
+    "msg_no_port": {"en": "No serial device detected.", "zh": "未检测到串口设备！"},
+    "msg_opened": {"en": "[Opened: {port} @ {baud}]", "zh": "[串口已打开: {port} @ {baud}]"},
+    "msg_closed": {"en": "[Serial closed]", "zh": "[串口已关闭]"},
+    "msg_port_lost": {"en": "[{port} disconnected; it will be reopened when the device comes back]",
+                      "zh": "[{port} 已断开，设备重新出现时将自动重新打开]"},
+    "msg_port_reopened": {"en": "[Reopened: {port} @ {baud}]", "zh": "[已自动重新打开: {port} @ {baud}]"},
+    "msg_port_reopen_fail": {"en": "[Could not reopen {port}: {err}]", "zh": "[自动重新打开 {port} 失败: {err}]"},
+    "msg_open_first": {"en": "[Please open serial port first]", "zh": "[请先打开串口]"},
+    "msg_send_error": {"en": "[Send error] {err}", "zh": "[发送错误] {err}"},
+    "msg_recv_error": {"en": "[Receive error] {err}", "zh": "[接收错误] {err}"},
+    "msg_run_script_title": {"en": "Notice", "zh": "提示"},
+    "msg_run_script_need_open": {"en": "Please open the serial port before running script.", "zh": "请先打开串口，再运行脚本。"},
+    "msg_script_running": {"en": "Script is running. Stop it or wait to finish.", "zh": "脚本正在运行中。请先停止或等待完成。"},
+    "msg_script_load_error_title": {"en": "Script Error", "zh": "脚本错误"},
+    "msg_script_loaded": {"en": "[Script] Loaded {steps} steps; start executing.", "zh": "[脚本] 加载成功，共 {steps} 步；开始执行。"},
+    "msg_script_cached": {"en": "[Script] Parsed script reused from {source} cache.", "zh": "[脚本] 复用已解析的脚本（{source} 缓存）。"},
+    "label_script_progress": {"en": "Step {done}/{total}", "zh": "步骤 {done}/{total}"},
+    "msg_script_stopping": {"en": "[Script] Stopping…", "zh": "[脚本] 停止中…"},
+    "msg_script_result": {"en": "[Script] {msg}", "zh": "[脚本] {msg}"},
+    "msg_export_no_log": {"en": "No log to export.", "zh": "没有日志可导出！"},
+    "msg_export_title": {"en": "Export Log", "zh": "导出日志"},
+    "msg_export_success": {"en": "Log saved to: {path}", "zh": "日志已保存到: {path}"},
+    "msg_export_fail": {"en": "Save failed: {err}", "zh": "保存失败: {err}"},
+    "msg_save_success_title": {"en": "Success", "zh": "成功"},
+    "msg_question_title": {"en": "Question", "zh": "提示"},
+    "msg_replace_or_copy": {
+        "en": "Replace this button?\nOld: {old}\nNew: {new}\nYes = replace; No = duplicate.",
+        "zh": "要把\n『{old}』\n替换为\n『{new}』吗？\n选\"否\"将保留旧命令并新增新按钮。"
+    },
+    "msg_cmd_exists": {"en": "Command already exists!", "zh": "命令已存在！"},
+    "msg_cmd_exists_warn_title": {"en": "Warning", "zh": "提示"},
+    "msg_group_delete_warn": {"en": "At least one group must remain.", "zh": "至少需要保留一个分组！"},
+    "msg_group_delete_confirm": {
+        "en": "Delete group \"{name}\"? Commands will move to the first group.",
+        "zh": "确定要删除分组\"{name}\"吗？\n分组内的命令将移至第一个分组。"
+    },
+    "about_title": {"en": "About", "zh": "关于"},
+    "about_body": {
+        "en": (
+            "{name}\n"
+            "Linux serial assistant\n"
+            "Version: {version}\n"
+            "Author: {author}\n"
+            "Email: {email}\n"
+            "Copyright: (c) 2024 {author}\n"
+            "License: {license} (open source)\n"
+            "MIT License: free to use, modify, and distribute with attribution."
+        ),
+        "zh": (
+            "{name}\n"
+            "Linux 串口调试助手\n"
+            "版本: {version}\n"
+            "作者: {author}\n"
+            "邮箱: {email}\n"
+            "版权: (c) 2024 {author}\n"
+            "许可证: {license}（开源）\n"
+            "遵循 MIT License 发布，可自由使用、修改和分发，保留作者署名。"
+        ),
+    },
+    "label_lang": {"en": "Language", "zh": "语言"},
+    "dlg_edit_group_title": {"en": "Edit Group", "zh": "编辑分组"},
+    "dlg_group_name": {"en": "Group Name:", "zh": "分组名称:"},
+    "dlg_choose_color": {"en": "Select color:", "zh": "选择颜色:"},
+    "dlg_custom_color": {"en": "Custom Color...", "zh": "自定义颜色..."},
+    "dlg_delete_group": {"en": "Delete Group", "zh": "删除分组"},
+    "dlg_current_color": {"en": "Current color: {color}", "zh": "当前颜色: {color}"},
+    "dlg_new_group_title": {"en": "New Group", "zh": "新建分组"},
+    "dlg_new_group_prompt": {"en": "Please enter group name:", "zh": "请输入分组名称:"},
+    "dlg_edit_cmd_title": {"en": "Edit/Copy/Delete Command", "zh": "编辑/复制/删除命令"},
+    "dlg_edit_cmd_text": {
+        "en": "Edit then press OK.\nEmpty -> delete;\nYes -> replace; No -> duplicate.",
+        "zh": "修改内容后点\"确定\"\n留空 → 删除；\n修改后选择\"是\" → 替换；\n修改后选择\"否\" → 复制为新："
+    },
+    "dlg_open_script_title": {"en": "Select Script File", "zh": "选择脚本文件"},
+    "dlg_choose_group_title": {"en": "Choose Group", "zh": "选择分组"},
+    "dlg_choose_group_prompt": {"en": "Add command to which group?", "zh": "请选择要添加到的分组:"},
+    "dlg_settings_title": {"en": "Settings", "zh": "设置"},
+    "label_theme": {"en": "Theme", "zh": "主题"},
+    "theme_light": {"en": "Light", "zh": "亮色"},
+    "theme_dark": {"en": "Dark", "zh": "暗色"},
+    "label_log_limits": {"en": "Log buffer", "zh": "日志缓冲"},
+    "label_log_max_lines": {"en": "Max lines:", "zh": "最大行数:"},
+    "label_log_max_mb": {"en": "Max size (MB):", "zh": "最大容量 (MB):"},
+    "label_log_flush_ms": {"en": "Refresh interval (ms):", "zh": "刷新间隔 (ms):"},
+    "label_capture": {"en": "Capture raw RX/TX to disk", "zh": "原始收发数据落盘"},
+    "label_auto_reopen": {"en": "Reopen the port when the device reconnects", "zh": "设备重新连接时自动重新打开串口"},
+    "label_virtual_rate": {"en": "Virtual device stream rate (KiB/s):", "zh": "虚拟设备 stream 输出速率 (KiB/s):"},
+    "label_capture_dir": {"en": "Directory:", "zh": "目录:"},
+    "btn_browse": {"en": "Browse…", "zh": "浏览…"},
+    "label_capture_max_mb": {"en": "Rotate at (MB):", "zh": "分段大小 (MB):"},
+    "label_capture_rotate_min": {"en": "Rotate every (min, 0 = off):", "zh": "分段时长 (分钟，0 = 不按时间):"},
+    "label_capture_compress": {"en": "Compress closed segments:", "zh": "压缩已关闭分段:"},
+    "msg_capture_started": {"en": "[Capture] Writing to {path}", "zh": "[落盘] 正在写入 {path}"},
+    "msg_capture_stopped": {"en": "[Capture] Stopped", "zh": "[落盘] 已停止"},
+    "msg_capture_fail": {"en": "[Capture] Failed: {err}", "zh": "[落盘] 失败：{err}"},
+    "label_expect_lookback": {"en": "EXPECT regex lookback (KB):", "zh": "EXPECT 正则回看窗口 (KB):"},
+    "label_script_engine": {"en": "Script engine:", "zh": "脚本引擎:"},
+    "label_command_panel": {"en": "Command panel:", "zh": "命令面板:"},
+    "msg_script_analysis": {
+        "en": "[Check] {steps} steps ({sends} SEND, {expects} EXPECT, {delays} DELAY); DELAY total {delay}; EXPECT budget {budget}; worst case {worst}",
+        "zh": "[预检] 共 {steps} 步（SEND {sends}，EXPECT {expects}，DELAY {delays}）；DELAY 合计 {delay}；EXPECT 超时预算 {budget}；最坏耗时 {worst}",
+    },
+    "msg_script_undefined_vars": {
+        "en": "[Check] Variables used before any SET (expand to empty): {names}",
+        "zh": "[预检] 变量在 SET 之前被引用（将展开为空）：{names}",
+    },
+    "msg_script_problem": {"en": "[Check] {text}", "zh": "[预检] {text}"},
+    "label_log_stats": {
+        "en": "Log: {appends} appends / {flushes} repaints ({merged} merged)",
+        "zh": "日志：追加 {appends} 次 / 刷新 {flushes} 次（合并 {merged}）"
+    },
+    "msg_open_fail_title": {"en": "Open Failed", "zh": "打开失败"},
+    "msg_export_no_path": {"en": "No path selected.", "zh": "未选择路径。"},
+    "msg_script_need_open_title": {"en": "Info", "zh": "提示"},
+    "msg_script_prefix": {"en": "[Script]", "zh": "[脚本]"},
+    "msg_script_wait_timeout": {
+        "en": "EXPECT timed out: EXPECT={expect}, TIMEOUT={timeout}ms",
+        "zh": "等待期望返回超时：EXPECT={expect}，TIMEOUT={timeout}ms"
+    },
+    "msg_script_stop": {"en": "Script stopped", "zh": "脚本已停止"},
+    "msg_script_done": {"en": "Script completed", "zh": "脚本执行完成"},
+    "msg_script_exception": {"en": "Script exception: {err}", "zh": "脚本执行异常：{err}"},
+    "msg_bad_regex": {"en": "EXPECT regex invalid: {err}, fallback to substring match", "zh": "EXPECT 正则无效：{err}，按普通文本处理"},
+    "msg_script_read_fail": {"en": "Serial read failed: {err}", "zh": "读取串口失败：{err}"},
+    "msg_script_unknown_step": {"en": "Unknown step: {op}", "zh": "未知步骤：{op}"},
+    "msg_library_fallback": {
+        "en": "[WARN] Could not open the command library ({err}); using commands.json instead.",
+        "zh": "[WARN] 无法打开命令库（{err}），已改用 commands.json。"
+    },
+    "msg_metrics_summary": {
+        "en": "[Timing] {steps} steps in {wall}: send {send}, EXPECT wait {expect}, DELAY {delay}, "
+              "tool overhead {overhead}; {timeouts} timeouts, {rx} bytes received while waiting",
+        "zh": "[计时] {steps} 步，共 {wall}：发送 {send}，EXPECT 等待 {expect}，DELAY {delay}，"
+              "工具开销 {overhead}；超时 {timeouts} 次，等待期间收到 {rx} 字节"
+    },
+    "msg_metrics_expect": {
+        "en": "[Timing] EXPECT p50/p90/p99/max = {p50}/{p90}/{p99}/{max} ms; smallest timeout margin {margin} ms",
+        "zh": "[计时] EXPECT p50/p90/p99/max = {p50}/{p90}/{p99}/{max} ms；最小超时余量 {margin} ms"
+    },
+    "msg_metrics_slowest": {
+        "en": "[Timing] slow step #{index}: {text} (send {send} ms, EXPECT {expect})",
+        "zh": "[计时] 慢步骤 #{index}：{text}（发送 {send} ms，EXPECT {expect}）"
+    },
+    "msg_no_log_title": {"en": "Notice", "zh": "提示"},
+}
+
+
+def translate(key, lang, **kwargs):
+    """Return translated text; fallback to English and key itself."""
+    text = TRANSLATIONS.get(key, {}).get(lang) or TRANSLATIONS.get(key, {}).get("en") or key
+    return text.format(**kwargs)
+
+
+# ---------- 配置 ----------
+CONFIG_FILE = Path(__file__).with_name("commands.json")
+DEFAULT_CMDS = ["AT", "AT+GMR", "AT+RST", "AT+HELP"]
+
+
+def migrate_v1_to_v2(data):
+    """将 v1 格式（数组或 {commands: []}）迁移到 v2 格式"""
+    if isinstance(data, list):
+        return {
+            "version": 2,
+            "groups": [{
+                "id": "default",
+                "name": "默认分组",
+                "color": "#F5F5F5",
+                "collapsed": False,
+                "commands": data
+            }]
+        }
+    elif isinstance(data, dict) and "commands" in data and "groups" not in data:
+        return {
+            "version": 2,
+            "groups": [{
+                "id": "default",
+                "name": "默认分组",
+                "color": "#F5F5F5",
+                "collapsed": False,
+                "commands": data["commands"]
+            }]
+        }
+    return data
+
+
+def load_groups(path=None):
+    """加载分组配置，自动处理格式迁移"""
+    path = Path(path) if path else CONFIG_FILE
+    if path.exists():
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            
+            if not isinstance(data, dict) or "version" not in data or data.get("version") != 2:
+                print("[INFO] 检测到旧格式，自动迁移到 v2...")
+                data = migrate_v1_to_v2(data)
+                
+                backup = path.with_suffix(".json.v1.backup")
+                if not backup.exists():
+                    import shutil
+                    shutil.copy2(path, backup)
+                    print(f"[INFO] 旧配置已备份到: {backup}")
+                
+                save_groups(data["groups"], path)
+            
+            return data.get("groups", [])
+        except Exception as e:
+            print(f"[WARN] load_groups 失败: {e}")
+    
+    return [{
+        "id": "default",
+        "name": "默认分组",
+        "color": "#F5F5F5",
+        "collapsed": False,
+        "commands": DEFAULT_CMDS.copy()
+    }]
+
+
+def atomic_write_text(path, text: str):
+    """临时文件 + fsync + os.replace，再 fsync 目录：崩溃或断电后文件要么是旧内容，要么是完整的新内容"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(text)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _groups_document(groups) -> str:
+    return json.dumps({"version": 2, "groups": groups}, ensure_ascii=False, indent=2)
+
+
+def save_groups(groups, path=None):
+    """同步保存分组配置（v2 格式，原子替换）；GUI 中改用 GroupsSaver 在后台合并写入"""
+    try:
+        atomic_write_text(path or CONFIG_FILE, _groups_document(groups))
+    except Exception as exc:
+        print("[WARN] save_groups:", exc)
+
+
+class GroupsSaver:
+    """
+    commands.json 的后台写入线程。
+    - submit(snapshot)：snapshot 为 json.dumps(groups) 的紧凑快照（调用方线程里用 C 编码器生成，很快），
+      写线程把排队的多份快照合并为最新一份，格式化为 indent=2 后原子写入
+    - 与上次写入内容相同则跳过；写失败只打印警告，下次提交会重试
+    - flush() 等待此前提交的内容落盘（退出前调用）
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.writes = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._last = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="groups-saver", daemon=True)
+            self._thread.start()
+
+    def submit(self, snapshot: str):
+        if self._thread is None:
+            self.start()
+        self._queue.put(snapshot)
+
+    def flush(self, timeout=5.0) -> bool:
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while True:  # 合并：只写最新的快照
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            snapshots = [x for x in items if isinstance(x, str)]
+            if snapshots:
+                self._write(snapshots[-1])
+            for x in items:
+                if isinstance(x, threading.Event):
+                    x.set()
+            if any(x is None for x in items):
+                return
+
+    def _write(self, snapshot):
+        if snapshot == self._last:
+            return
+        try:
+            atomic_write_text(self.path or CONFIG_FILE, _groups_document(json.loads(snapshot)))
+        except Exception as exc:
+            print("[WARN] GroupsSaver:", exc)
+            return
+        self._last = snapshot
+        self.writes += 1
+
+
+# ---------- 命令库（分组 / 命令的统一接口） ----------
+COMMANDS_DB = CONFIG_FILE.with_suffix(".sqlite3")  # 存在时 GUI 使用 SQLite 命令库
+
+
+def _new_group_id():
+    import uuid
+    return str(uuid.uuid4())[:8]
+
+
+class JsonCommandLibrary:
+    """
+    默认命令库：commands.json（v2）读入内存的分组列表。
+    - 额外维护 分组 ID -> 分组、命令 -> 分组 ID 两个字典，查找分组 / 查重为 O(1)；
+      组内插入、删除仍是列表操作，与组大小成正比
+    - 修改只改内存，save() 生成快照交给 GroupsSaver 在后台原子写入
+    groups() 返回内部列表本身，调用方只读；groups(with_commands=False) 返回不含命令的分组副本（同 SQLite 库）。
+    """
+    backend = "json"
+    fallback_error = None  # open_command_library 因 SQLite 库损坏而回退时，记录其错误
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else CONFIG_FILE
+        self._saver = GroupsSaver(self.path)
+        self._set_groups(load_groups(self.path))
+
+    def _set_groups(self, groups):
+        self._groups = groups
+        self._by_id = {g["id"]: g for g in groups}
+        self._where = {}
+        for g in groups:
+            g.setdefault("commands", [])
+            for cmd in g["commands"]:
+                self._where.setdefault(cmd, g["id"])
+
+    # ----- 查询 -----
+    def groups(self, with_commands=True):
+        if not with_commands:
+            return [dict(g, commands=[]) for g in self._groups]
+        return self._groups
+
+    def group_count(self):
+        return len(self._groups)
+
+    def get_group(self, group_id):
+        return self._by_id.get(group_id)
+
+    def first_group_id(self):
+        return self._groups[0]["id"] if self._groups else None
+
+    def find_command(self, cmd):
+        """命令所在分组 ID，不存在为 None"""
+        return self._where.get(cmd)
+
+    def commands(self, group_id):
+        g = self._by_id.get(group_id)
+        return list(g["commands"]) if g else []
+
+    def command_count(self, group_id):
+        g = self._by_id.get(group_id)
+        return len(g["commands"]) if g else 0
+
+    # ----- 命令 -----
+    def add_command(self, group_id, cmd, before=None) -> bool:
+        """加入分组（before 为同组内的锚点命令，None 表示末尾）；命令已存在时返回 False"""
+        g = self._by_id.get(group_id)
+        if g is None or cmd in self._where:
+            return False
+        self._insert(g, cmd, before)
+        self._where[cmd] = group_id
+        return True
+
+    def remove_command(self, cmd) -> bool:
+        group_id = self._where.pop(cmd, None)
+        if group_id is None:
+            return False
+        self._by_id[group_id]["commands"].remove(cmd)
+        return True
+
+    def replace_command(self, old, new) -> bool:
+        """原位改名；new 已存在时返回 False"""
+        group_id = self._where.get(old)
+        if group_id is None or new in self._where:
+            return False
+        cmds = self._by_id[group_id]["commands"]
+        cmds[cmds.index(old)] = new
+        del self._where[old]
+        self._where[new] = group_id
+        return True
+
+    def move_command(self, cmd, to_group_id, before=None) -> bool:
+        from_id = self._where.get(cmd)
+        target = self._by_id.get(to_group_id)
+        if from_id is None or target is None or before == cmd:
+            return False
+        self._by_id[from_id]["commands"].remove(cmd)
+        self._insert(target, cmd, before)
+        self._where[cmd] = to_group_id
+        return True
+
+    @staticmethod
+    def _insert(group, cmd, before):
+        cmds = group["commands"]
+        if before is not None and before in cmds:
+            cmds.insert(cmds.index(before), cmd)
+        else:
+            cmds.append(cmd)
+
+    # ----- 分组 -----
+    def add_group(self, name, color, collapsed=False, group_id=None):
+        group_id = group_id or _new_group_id()
+        group = {"id": group_id, "name": name, "color": color, "collapsed": collapsed, "commands": []}
+        self._groups.append(group)
+        self._by_id[group_id] = group
+        return group_id
+
+    def update_group(self, group_id, **fields):
+        g = self._by_id.get(group_id)
+        if g is not None:
+            g.update((k, v) for k, v in fields.items() if k in ("name", "color", "collapsed"))
+
+    def delete_group(self, group_id, merge_into=None):
+        """删除分组；其中的命令追加到 merge_into 分组末尾（None 则一并删除）"""
+        g = self._by_id.pop(group_id, None)
+        if g is None:
+            return
+        self._groups.remove(g)
+        target = self._by_id.get(merge_into)
+        for cmd in g["commands"]:
+            if target is not None:
+                target["commands"].append(cmd)
+                self._where[cmd] = merge_into
+            else:
+                self._where.pop(cmd, None)
+
+    # ----- 导入导出 / 持久化 -----
+    def export_v2(self):
+        return {"version": 2, "groups": json.loads(json.dumps(self._groups))}
+
+    def import_v2(self, data):
+        """用 v2（或 v1，自动迁移）数据替换全部内容"""
+        data = migrate_v1_to_v2(data)
+        self._set_groups(json.loads(json.dumps(data.get("groups", []))))
+
+    def save(self):
+        # 调用方线程只做紧凑 JSON 快照（C 编码器），格式化与磁盘 I/O 在 GroupsSaver 线程
+        self._saver.submit(json.dumps(self._groups, ensure_ascii=False))
+
+    def close(self, save=True):
+        """save=False：丢弃未保存的修改"""
+        if save:
+            self.save()
+        self._saver.stop()  # 等待最后一次写入完成
+
+
+class SqliteCommandLibrary:
+    """
+    SQLite 命令库（标准库 sqlite3），接口与 JsonCommandLibrary 相同，适合数万条命令：
+    - commands(cmd 主键, group_id, pos)，(group_id, pos) 建索引；顺序用带间隔的浮点 pos 表示，
+      插入取前后两个 pos 的中点，移动 / 改名 / 查重都是索引查找，O(log n)；间隔耗尽时只重排该组
+    - 修改在隐式事务中累积，save() 提交（WAL，提交只追加日志）
+    - 连接只能在创建它的线程中使用
+    """
+    backend = "sqlite"
+    fallback_error = None
+    POS_STEP = 1024.0
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path=None, seed_groups=None):
+        import sqlite3
+        self.path = Path(path) if path else COMMANDS_DB
+        fresh = not self.path.exists()
+        self._db = sqlite3.connect(str(self.path))
+        try:
+            self._init_schema(fresh, seed_groups)
+        except Exception:
+            self._db.close()
+            raise
+
+    def _init_schema(self, fresh, seed_groups):
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS groups (
+                id TEXT PRIMARY KEY, name TEXT NOT NULL, color TEXT NOT NULL,
+                collapsed INTEGER NOT NULL DEFAULT 0, pos REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS commands (
+                cmd TEXT PRIMARY KEY, group_id TEXT NOT NULL, pos REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS commands_by_group ON commands (group_id, pos);
+        """)
+        self._db.execute("INSERT OR IGNORE INTO meta VALUES ('schema', ?)", (str(self.SCHEMA_VERSION),))
+        if fresh:
+            # 新库：默认从 commands.json（或默认分组）导入
+            self.import_v2({"version": 2, "groups": load_groups() if seed_groups is None else seed_groups})
+        self._db.commit()
+
+    # ----- 查询 -----
+    def groups(self, with_commands=True):
+        """完整快照（渲染用，O(n)）；with_commands=False 只读分组属性，commands 为空列表"""
+        out, by_id = [], {}
+        for gid, name, color, collapsed in self._db.execute(
+                "SELECT id, name, color, collapsed FROM groups ORDER BY pos"):
+            g = {"id": gid, "name": name, "color": color, "collapsed": bool(collapsed), "commands": []}
+            out.append(g)
+            by_id[gid] = g
+        if not with_commands:
+            return out
+        for cmd, gid in self._db.execute("SELECT cmd, group_id FROM commands ORDER BY group_id, pos"):
+            g = by_id.get(gid)
+            if g is not None:
+                g["commands"].append(cmd)
+        return out
+
+    def group_count(self):
+        return self._db.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
+
+    def get_group(self, group_id):
+        row = self._db.execute("SELECT id, name, color, collapsed FROM groups WHERE id = ?", (group_id,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "name": row[1], "color": row[2], "collapsed": bool(row[3]),
+                "commands": self.commands(group_id)}
+
+    def first_group_id(self):
+        row = self._db.execute("SELECT id FROM groups ORDER BY pos LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def find_command(self, cmd):
+        row = self._db.execute("SELECT group_id FROM commands WHERE cmd = ?", (cmd,)).fetchone()
+        return row[0] if row else None
+
+    def commands(self, group_id):
+        return [r[0] for r in self._db.execute(
+            "SELECT cmd FROM commands WHERE group_id = ? ORDER BY pos", (group_id,))]
+
+    def command_count(self, group_id):
+        return self._db.execute("SELECT COUNT(*) FROM commands WHERE group_id = ?", (group_id,)).fetchone()[0]
+
+    # ----- 命令 -----
+    def _has_group(self, group_id):
+        return self._db.execute("SELECT 1 FROM groups WHERE id = ?", (group_id,)).fetchone() is not None
+
+    def _pos_for(self, group_id, before):
+        """新命令的 pos：before 之前（同组）或组末尾"""
+        db = self._db
+        anchor = None
+        if before is not None:
+            anchor = db.execute("SELECT pos FROM commands WHERE cmd = ? AND group_id = ?",
+                                (before, group_id)).fetchone()
+        if anchor is None:
+            last = db.execute("SELECT MAX(pos) FROM commands WHERE group_id = ?", (group_id,)).fetchone()[0]
+            return (last or 0.0) + self.POS_STEP
+        hi = anchor[0]
+        prev = db.execute("SELECT MAX(pos) FROM commands WHERE group_id = ? AND pos < ?", (group_id, hi)).fetchone()[0]
+        lo = hi - self.POS_STEP if prev is None else prev
+        mid = (lo + hi) / 2
+        if lo < mid < hi:
+            return mid
+        self._renumber(group_id)  # 浮点间隔耗尽：重排该组后重试
+        return self._pos_for(group_id, before)
+
+    def _renumber(self, group_id):
+        rows = self._db.execute("SELECT cmd FROM commands WHERE group_id = ? ORDER BY pos", (group_id,)).fetchall()
+        self._db.executemany("UPDATE commands SET pos = ? WHERE cmd = ?",
+                             [((i + 1) * self.POS_STEP, r[0]) for i, r in enumerate(rows)])
+
+    def add_command(self, group_id, cmd, before=None) -> bool:
+        if not self._has_group(group_id) or self.find_command(cmd) is not None:
+            return False
+        self._db.execute("INSERT INTO commands VALUES (?, ?, ?)", (cmd, group_id, self._pos_for(group_id, before)))
+        return True
+
+    def remove_command(self, cmd) -> bool:
+        return self._db.execute("DELETE FROM commands WHERE cmd = ?", (cmd,)).rowcount > 0
+
+    def replace_command(self, old, new) -> bool:
+        if self.find_command(new) is not None:
+            return False
+        return self._db.execute("UPDATE commands SET cmd = ? WHERE cmd = ?", (new, old)).rowcount > 0
+
+    def move_command(self, cmd, to_group_id, before=None) -> bool:
+        if before == cmd or self.find_command(cmd) is None or not self._has_group(to_group_id):
+            return False
+        pos = self._pos_for(to_group_id, before)
+        self._db.execute("UPDATE commands SET group_id = ?, pos = ? WHERE cmd = ?", (to_group_id, pos, cmd))
+        return True
+
+    # ----- 分组 -----
+    def add_group(self, name, color, collapsed=False, group_id=None):
+        group_id = group_id or _new_group_id()
+        last = self._db.execute("SELECT MAX(pos) FROM groups").fetchone()[0]
+        self._db.execute("INSERT INTO groups VALUES (?, ?, ?, ?, ?)",
+                         (group_id, name, color, int(bool(collapsed)), (last or 0.0) + 1.0))
+        return group_id
+
+    def update_group(self, group_id, **fields):
+        cols = [k for k in ("name", "color", "collapsed") if k in fields]
+        if cols:
+            values = [int(bool(fields[k])) if k == "collapsed" else fields[k] for k in cols]
+            self._db.execute(f"UPDATE groups SET {', '.join(c + ' = ?' for c in cols)} WHERE id = ?",
+                             (*values, group_id))
+
+    def delete_group(self, group_id, merge_into=None):
+        db = self._db
+        if merge_into is not None and merge_into != group_id and self._has_group(merge_into):
+            base = db.execute("SELECT MAX(pos) FROM commands WHERE group_id = ?", (merge_into,)).fetchone()[0] or 0.0
+            low = db.execute("SELECT MIN(pos) FROM commands WHERE group_id = ?", (group_id,)).fetchone()[0] or 0.0
+            # 保持原顺序整体平移到目标组末尾之后
+            db.execute("UPDATE commands SET group_id = ?, pos = pos + ? WHERE group_id = ?",
+                       (merge_into, base + self.POS_STEP - low, group_id))
+        else:
+            db.execute("DELETE FROM commands WHERE group_id = ?", (group_id,))
+        db.execute("DELETE FROM groups WHERE id = ?", (group_id,))
+
+    # ----- 导入导出 / 持久化 -----
+    def export_v2(self):
+        return {"version": 2, "groups": self.groups()}
+
+    def import_v2(self, data):
+        """用 v2（或 v1，自动迁移）数据替换全部内容；跨分组重复的命令只保留第一次出现"""
+        data = migrate_v1_to_v2(data)
+        db = self._db
+        db.execute("DELETE FROM commands")
+        db.execute("DELETE FROM groups")
+        seen = set()
+        for gi, g in enumerate(data.get("groups", [])):
+            gid = g.get("id") or _new_group_id()
+            db.execute("INSERT INTO groups VALUES (?, ?, ?, ?, ?)",
+                       (gid, g.get("name", ""), g.get("color", "#F5F5F5"), int(bool(g.get("collapsed"))), gi + 1.0))
+            rows = []
+            for cmd in g.get("commands", []):
+                if cmd in seen:
+                    print(f"[WARN] 重复命令已跳过: {cmd}")
+                    continue
+                seen.add(cmd)
+                rows.append((cmd, gid, (len(rows) + 1) * self.POS_STEP))
+            db.executemany("INSERT INTO commands VALUES (?, ?, ?)", rows)
+
+    def save(self):
+        self._db.commit()
+
+    def check(self):
+        """PRAGMA quick_check：库文件损坏时抛出 sqlite3.DatabaseError"""
+        import sqlite3
+        result = self._db.execute("PRAGMA quick_check(1)").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(" ".join(result.split("\n")[:2]))
+
+    def close(self, save=True):
+        """save=False：回滚未提交的修改"""
+        if save:
+            self._db.commit()
+        self._db.close()
+
+
+def open_command_library(json_path=None, db_path=None):
+    """commands.sqlite3 存在时使用 SQLite 命令库，否则使用 commands.json"""
+    db_path = Path(db_path) if db_path else COMMANDS_DB
+    if not db_path.exists():
+        return JsonCommandLibrary(json_path)
+    lib = None
+    try:
+        lib = SqliteCommandLibrary(db_path)
+        lib.check()  # 只读开头几页能成功打开的损坏文件，要到查询时才报错
+        return lib
+    except Exception as exc:
+        if lib is not None:
+            lib._db.close()
+        print(f"[WARN] 无法打开 {db_path}，改用 JSON: {exc}")
+        fallback = JsonCommandLibrary(json_path)
+        fallback.fallback_error = f"{db_path}: {exc}"
+        return fallback
+
+
+# ---------- 串口链路（后台读/写线程） ----------
+def _new_future():
+    """concurrent.futures 导入较慢（连带 logging），GUI 冷启动时用不到：首次发送时才导入"""
+    from concurrent.futures import Future
+    return Future()
+
+
+class SerialLink:
+    """
+    串口链路：独占串口的读写。
+    - 读线程：POSIX 下对 fd 做 select 阻塞等待，数据到达即读，不经过 GUI 事件循环；
+      读到的数据块分发给 subscribe() 的订阅者（参数为 bytes）
+    - 写线程：write() 把数据放入有序发送队列，手动发送与脚本发送共用，按提交顺序写出；
+      写完（或失败）后通知 subscribe_tx() 的订阅者（参数为 data, error）
+    - 订阅者在读/写线程中被调用，需自行保证线程安全
+    - 读出错（如设备拔出）时调用 on_error(exc) 并结束读线程
+    """
+
+    def __init__(self, serial_obj):
+        self.ser = serial_obj
+        self.on_error = None
+        self._subscribers = ()  # 写时复制，读线程遍历时无需加锁
+        self._tx_subscribers = ()
+        self._sub_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._tx_thread = None
+        self._tx_queue = queue.SimpleQueue()
+        self._tx_lock = threading.Lock()  # write() 的检查 + 入队与 stop() 的清空互斥，停止后不会遗留请求
+        self._wake_r = self._wake_w = None
+
+    def subscribe(self, fn):
+        with self._sub_lock:
+            self._subscribers = self._subscribers + (fn,)
+
+    def unsubscribe(self, fn):
+        with self._sub_lock:
+            self._subscribers = tuple(s for s in self._subscribers if s != fn)
+
+    def subscribe_tx(self, fn):
+        with self._sub_lock:
+            self._tx_subscribers = self._tx_subscribers + (fn,)
+
+    def unsubscribe_tx(self, fn):
+        with self._sub_lock:
+            self._tx_subscribers = tuple(s for s in self._tx_subscribers if s != fn)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="serial-reader", daemon=True)
+        self._tx_thread = threading.Thread(target=self._tx_run, name="serial-writer", daemon=True)
+        self._thread.start()
+        self._tx_thread.start()
+
+    def write(self, data: bytes):
+        """
+        线程安全的发送：放入有序队列，由写线程依次写出。
+        返回 Future，结果为写出的字节数；写失败时 result() 抛出原异常。
+        """
+        fut = _new_future()
+        with self._tx_lock:
+            if self._tx_thread is None:
+                fut.set_exception(RuntimeError("SerialLink not started"))
+                return fut
+            self._tx_queue.put((data, fut))
+        return fut
+
+    def stop(self, timeout=1.0):
+        """停止读写线程（通过自管道唤醒 select，无需等待轮询周期）"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._tx_queue.put(None)
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            pass
+        for th in (self._thread, self._tx_thread):
+            if th is not None and th is not threading.current_thread():
+                th.join(timeout)
+        with self._tx_lock:
+            self._thread = self._tx_thread = None
+            # 停止后仍在队列中的发送请求（包括停止过程中提交的）以异常结束，等待方不会永远阻塞
+            while True:
+                try:
+                    item = self._tx_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    self._abort(item[1])
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._wake_r = self._wake_w = None
+
+    @staticmethod
+    def _abort(fut):
+        if fut.set_running_or_notify_cancel():
+            fut.set_exception(RuntimeError("SerialLink stopped"))
+
+    def _dispatch(self, data):
+        for fn in self._subscribers:
+            try:
+                fn(data)
+            except Exception as exc:
+                print("[WARN] SerialLink subscriber:", exc)
+
+    def _tx_run(self):
+        ser = self.ser
+        while True:
+            item = self._tx_queue.get()
+            if item is None or self._stop.is_set():
+                if item is not None:
+                    self._abort(item[1])
+                break
+            data, fut = item
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                n = ser.write(data)
+            except Exception as exc:
+                fut.set_exception(exc)
+                error = exc
+            else:
+                fut.set_result(len(data) if n is None else n)
+                error = None
+            for fn in self._tx_subscribers:
+                try:
+                    fn(data, error)
+                except Exception as exc:
+                    print("[WARN] SerialLink tx subscriber:", exc)
+
+    def _run(self):
+        ser = self.ser
+        try:
+            fd = ser.fileno()
+        except Exception:
+            fd = None  # 无 fd 的端口：退化为带超时的阻塞 read
+        wake = self._wake_r
+        while not self._stop.is_set():
+            try:
+                if fd is not None:
+                    ready, _, _ = select.select([fd, wake], [], [])
+                    if self._stop.is_set():
+                        break
+                    if fd not in ready:
+                        continue
+                data = ser.read(ser.in_waiting or 1)
+            except Exception as exc:
+                if not self._stop.is_set() and self.on_error:
+                    self.on_error(exc)
+                break
+            if data:
+                self._dispatch(data)
+
+
+# ---------- 原始数据落盘 ----------
+CAPTURE_COMPRESSIONS = ("none", "gzip", "zstd")
+CAPTURE_MAGIC = b"UARTCAP1"  # 每个分段文件的开头
+CAPTURE_RECORD = struct.Struct("<cI")  # 每个数据块之前：方向（b"R" 接收 / b"T" 发送）+ 字节数
+
+
+def _open_capture_segment(path):
+    """打开分段文件；已压缩的分段（.gz / .zst）透明解压。压缩线程可能刚删除原文件，依次尝试"""
+    path = Path(path)
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        pass
+    gz = path.with_name(path.name + ".gz")
+    if gz.exists():
+        import gzip
+        return gzip.open(gz, "rb")
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(open(path.with_name(path.name + ".zst"), "rb"))
+
+
+def _read_exact(f, size):
+    """解压流的 read() 可能少返回，读满 size 或到文件末尾为止"""
+    parts, left = [], size
+    while left:
+        chunk = f.read(left)
+        if not chunk:
+            break
+        parts.append(chunk)
+        left -= len(chunk)
+    return b"".join(parts)
+
+
+def iter_capture(path):
+    """逐块读取分段文件：产生 (is_tx, data)；末尾不完整的块（异常退出时）忽略"""
+    with _open_capture_segment(path) as f:
+        if _read_exact(f, len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path}: not a capture file")
+        header_size = CAPTURE_RECORD.size
+        while True:
+            header = _read_exact(f, header_size)
+            if len(header) < header_size:
+                return
+            tag, size = CAPTURE_RECORD.unpack(header)
+            data = _read_exact(f, size)
+            if len(data) < size:
+                return
+            yield tag == b"T", data
+
+
+def export_capture(paths, dst):
+    """把分段依次导出为文本日志：接收数据按 UTF-8 解码原样拼接，发送数据单独成行并以 >>> 标记（同界面日志）"""
+    decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+    at_line_start = True
+    with open(dst, "w", encoding="utf-8") as out:
+        for path in paths:
+            for is_tx, data in iter_capture(path):
+                if is_tx:
+                    text = decoder.decode(b"", final=True)
+                    decoder.reset()
+                    if not (text.endswith("\n") if text else at_line_start):
+                        text += "\n"
+                    text += f">>> {describe_bytes(data)}\n"
+                else:
+                    text = decoder.decode(data)
+                if text:
+                    out.write(text)
+                    at_line_start = text.endswith("\n")
+        out.write(decoder.decode(b"", final=True))
+
+
+class CaptureWriter:
+    """
+    连续抓包：收发原始字节由后台线程经缓冲 I/O 顺序写入磁盘。
+    - 分段文件以 CAPTURE_MAGIC 开头，每个数据块前有 CAPTURE_RECORD 头（方向 + 长度），iter_capture() 读回
+    - 按大小或时间轮转分段，文件名带起始时间与序号；segments 记录本次抓包的全部分段
+    - 已关闭分段可选 gzip / zstd 压缩（zstd 需要 zstandard，缺失时退回 gzip）
+    - write() 线程安全，可同时被读线程和主线程调用
+    """
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, directory, prefix=APP_NAME, max_bytes=64 * 1024 * 1024,
+                 rotate_s=0, compression="none"):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.max_bytes = max(1, int(max_bytes))
+        self.rotate_s = max(0, int(rotate_s))
+        self.compression = compression if compression in CAPTURE_COMPRESSIONS else "none"
+        self.error = None
+        self.current_path = None
+        self.segments = []
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._fh = None
+        self._seq = 0
+        self._seg_bytes = 0
+        self._seg_started = 0.0
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes, tx=False):
+        if data and self._thread is not None:
+            self._queue.put(CAPTURE_RECORD.pack(b"T" if tx else b"R", len(data)) + bytes(data))
+
+    def flush(self, timeout=2.0) -> bool:
+        """等待此前提交的数据全部写入文件（导出前调用）"""
+        if self._thread is None:
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout=2.0):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _open_segment(self):
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        while True:
+            # 同一秒内重启抓包时序号会重复：跳过已有的分段（含已压缩的），每个文件只有一个 CAPTURE_MAGIC
+            self._seq += 1
+            path = self.directory / f"{self.prefix}_{stamp}_{self._seq:03d}.log"
+            if not any(p.exists() for p in (path, path.with_name(path.name + ".gz"),
+                                             path.with_name(path.name + ".zst"))):
+                break
+        self.current_path = path
+        self._fh = open(path, "wb", buffering=self.BUFFER_SIZE)
+        self._fh.write(CAPTURE_MAGIC)
+        self.segments.append(self.current_path)
+        self._seg_bytes = 0
+        self._seg_started = time.monotonic()
+
+    def _close_segment(self):
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+        if self.compression != "none" and self._seg_bytes:
+            # 压缩放到独立线程，避免大分段压缩期间阻塞写入
+            threading.Thread(target=self._compress, args=(self.current_path, self.compression),
+                             name="capture-compress", daemon=True).start()
+
+    def _rotate_due(self, incoming):
+        if self._seg_bytes and self._seg_bytes + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_s) and time.monotonic() - self._seg_started >= self.rotate_s
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                # 空闲时刷新缓冲，异常退出最多丢失 1 秒数据
+                if self._fh is not None:
+                    try:
+                        self._fh.flush()
+                    except OSError:
+                        pass
+                continue
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                if self._fh is not None:
+                    self._fh.flush()
+                item.set()
+                continue
+            if self.error is not None:
+                continue
+            try:
+                if self._rotate_due(len(item)):
+                    self._close_segment()
+                    self._open_segment()
+                self._fh.write(item)
+                self._seg_bytes += len(item)
+            except OSError as exc:
+                self.error = exc
+                print("[WARN] CaptureWriter:", exc)
+        try:
+            self._close_segment()
+        except OSError as exc:
+            print("[WARN] CaptureWriter:", exc)
+
+    @staticmethod
+    def _compress(path, method):
+        try:
+            if method == "zstd":
+                try:
+                    import zstandard
+                except ImportError:
+                    method = "gzip"
+            if method == "zstd":
+                dst = path.with_name(path.name + ".zst")
+                with open(path, "rb") as src, open(dst, "wb") as out:
+                    zstandard.ZstdCompressor().copy_stream(src, out)
+            else:
+                import gzip
+                dst = path.with_name(path.name + ".gz")
+                with open(path, "rb") as src, gzip.open(dst, "wb", compresslevel=6) as out:
+                    shutil.copyfileobj(src, out, 1 << 20)
+            path.unlink()
+        except Exception as exc:
+            print(f"[WARN] compress {path}: {exc}")
+
+
+# ---------- 串口热插拔监视 ----------
+# 与 pyserial comports()（Linux）相同的设备名前缀与过滤规则，但只读 sysfs 的 subsystem 链接，不读 USB 描述信息
+SERIAL_DEV_PREFIXES = ("ttyS", "ttyUSB", "ttyXRUSB", "ttyACM", "ttyAMA", "rfcomm", "ttyAP")
+
+
+def probe_serial_port(path) -> bool:
+    """单个设备是否为可用串口：设备节点存在，且不是没有实际硬件的 platform 串口"""
+    name = os.path.basename(path)
+    if not name.startswith(SERIAL_DEV_PREFIXES) or not os.path.exists(path):
+        return False
+    # 没有 sysfs 设备目录时 realpath 原样返回，按 comports() 的做法视为串口
+    subsystem = os.path.realpath(f"/sys/class/tty/{name}/device/subsystem")
+    return os.path.basename(subsystem) != "platform"
+
+
+def scan_serial_ports(dev_dir="/dev"):
+    """完整扫描 dev_dir 下的串口设备，返回排好序的路径列表"""
+    try:
+        names = os.listdir(dev_dir)
+    except OSError:
+        return []
+    return sorted(path for path in (os.path.join(dev_dir, n) for n in names if n.startswith(SERIAL_DEV_PREFIXES))
+                  if probe_serial_port(path))
+
+
+class _Inotify:
+    """ctypes 调用 libc 的 inotify；只用于监视单个目录里条目的增删"""
+    IN_ATTRIB = 0x004
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, path, mask):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch({path}) failed")
+        self.fd = fd
+
+    def read(self):
+        """读出当前所有事件，返回 (mask, 名字) 列表"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            off = 0
+            while off + self._EVENT.size <= len(data):
+                _wd, mask, _cookie, length = self._EVENT.unpack_from(data, off)
+                off += self._EVENT.size
+                name = data[off:off + length].rstrip(b"\0")
+                off += length
+                events.append((mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PortMonitor:
+    """
+    串口热插拔监视（后台线程）：启动时完整扫描一次，此后用 inotify 监听 /dev，
+    只重新检查发生变化的设备名（短暂合并，udev 创建节点后还会改权限）。
+    - on_change(added, removed) 在监视线程中调用，参数为排好序的设备路径列表；首次扫描以 added 报告全部串口，
+      没有串口时也回调一次（两个列表都为空），调用方据此结束“扫描中”状态
+    - rescan()：请求一次完整扫描（线程安全）
+    - 没有 inotify（非 Linux / ctypes 不可用）时退化为每 poll_interval 秒完整扫描一次
+    """
+    DEBOUNCE = 0.1
+    WATCH_MASK = (_Inotify.IN_CREATE | _Inotify.IN_DELETE | _Inotify.IN_ATTRIB |
+                  _Inotify.IN_MOVED_FROM | _Inotify.IN_MOVED_TO)
+
+    def __init__(self, on_change, dev_dir="/dev", poll_interval=2.0):
+        self.on_change = on_change
+        self.dev_dir = dev_dir
+        self.poll_interval = poll_interval
+        self.uses_inotify = False
+        self._ports = set()
+        self._stop = threading.Event()
+        self._rescan = threading.Event()
+        self._thread = None
+        self._wake_r = self._wake_w = None
+
+    @property
+    def ports(self):
+        return sorted(self._ports)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="port-monitor", daemon=True)
+        self._thread.start()
+
+    def rescan(self):
+        self._rescan.set()
+        self._wake()
+
+    def stop(self, timeout=1.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._wake_r = self._wake_w = None
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except (OSError, TypeError):
+            pass
+
+    def _report(self, ports, names=None, force=False):
+        """ports 为 names 范围内（None 表示全部）当前存在的串口；与已知集合比对后回调差异（force：没有差异也回调）"""
+        known = self._ports if names is None else self._ports & names
+        added = sorted(ports - known)
+        removed = sorted(known - ports)
+        if not added and not removed and not force:
+            return
+        self._ports = (self._ports - set(removed)) | set(added)
+        try:
+            self.on_change(added, removed)
+        except Exception as exc:
+            print("[WARN] PortMonitor callback:", exc)
+
+    def _full_scan(self, first=False):
+        self._rescan.clear()
+        self._report(set(scan_serial_ports(self.dev_dir)), force=first)
+
+    def _run(self):
+        try:
+            ino = _Inotify(self.dev_dir, self.WATCH_MASK)
+        except (OSError, AttributeError) as exc:
+            print("[WARN] PortMonitor: inotify unavailable, polling instead:", exc)
+            ino = None
+        self.uses_inotify = ino is not None
+        try:
+            self._full_scan(first=True)
+            if ino is None:
+                while not self._stop.is_set():
+                    select.select([self._wake_r], [], [], self.poll_interval)
+                    self._drain_wake()
+                    if not self._stop.is_set():
+                        self._full_scan()
+            else:
+                self._watch(ino)
+        finally:
+            if ino is not None:
+                ino.close()
+
+    def _drain_wake(self):
+        try:
+            os.read(self._wake_r, 4096)
+        except OSError:
+            pass
+
+    def _watch(self, ino):
+        wake = self._wake_r
+        pending = set()  # 待重新检查的设备名
+        while not self._stop.is_set():
+            ready, _, _ = select.select([ino.fd, wake], [], [], self.DEBOUNCE if pending else None)
+            if self._stop.is_set():
+                break
+            if wake in ready:
+                self._drain_wake()
+            if self._rescan.is_set():
+                pending.clear()
+                self._full_scan()
+                continue
+            if ino.fd in ready:
+                for mask, name in ino.read():
+                    if mask & _Inotify.IN_Q_OVERFLOW:
+                        self._rescan.set()  # 事件丢失：下一轮完整扫描
+                    elif name.startswith(SERIAL_DEV_PREFIXES):
+                        pending.add(name)
+                if self._rescan.is_set():
+                    continue
+                if pending:
+                    continue  # 继续合并，直到静默 DEBOUNCE 秒
+            if pending:
+                paths = {os.path.join(self.dev_dir, n) for n in pending}
+                pending.clear()
+                self._report({p for p in paths if probe_serial_port(p)}, paths)
+
+
+# ---------- 虚拟串口设备 ----------
+VIRTUAL_PORT_PREFIX = "virtual:"
+VIRTUAL_MODES = ("echo", "at", "stream")
+VIRTUAL_STREAM_RATE = 1024 * 1024  # stream 模式默认输出速率（字节/秒）
+VIRTUAL_AT_RESPONSES = {
+    "AT": "OK",
+    "ATI": f"{APP_NAME} virtual device\r\nOK",
+    "AT+GMR": f"{APP_VERSION}\r\nOK",
+    "AT+PING": "PONG\r\nOK",
+    "AT+RST": "OK\r\nready",
+}
+
+
+def virtual_port_names():
+    """端口下拉框中的虚拟设备条目"""
+    return [VIRTUAL_PORT_PREFIX + mode for mode in VIRTUAL_MODES]
+
+
+def parse_virtual_port(port):
+    """'virtual:<mode>[:<字节/秒>]' -> (mode, rate)，rate 省略时为 None；不是虚拟设备返回 None"""
+    if not port.startswith(VIRTUAL_PORT_PREFIX):
+        return None
+    mode, _, rate = port[len(VIRTUAL_PORT_PREFIX):].partition(":")
+    if mode not in VIRTUAL_MODES:
+        raise ValueError(f"unknown virtual device mode: {mode!r} (expected one of {', '.join(VIRTUAL_MODES)})")
+    if not rate:
+        return mode, None
+    if not rate.isdigit() or int(rate) <= 0:
+        raise ValueError(f"bad virtual stream rate: {rate!r} (bytes per second)")
+    return mode, int(rate)
+
+
+class VirtualDevice:
+    """
+    内置虚拟串口设备：pty 主端由后台线程扮演设备，从端路径交给 pyserial 打开，
+    之后的 SerialLink / AsyncSerialLink / 脚本引擎与真实串口走完全相同的代码路径。
+    - echo：原样回显收到的数据
+    - at：按行应答 responses 中的固定回复（命令不区分大小写），未知命令回 ERROR；
+          AT+DUMP=<n> 先输出 n 字节文本行再回 OK
+    - stream：在 at 的基础上，以 rate 字节/秒持续输出 64 字节的文本行（读端跟不上时随 pty 缓冲阻塞）
+    模拟慢设备（at / stream 的命令应答）：latency_ms 为收到命令到开始应答的延迟，
+    chunk / chunk_gap_ms 把应答拆成 chunk 字节一块、块间停顿写出；on_reply() 在每个应答最后一个字节写出后调用。
+    串口端全部关闭后主端读到 EIO，设备线程退出并关闭主端。
+    """
+    TICK = 0.01        # stream 模式的输出节拍（秒）
+    MAX_BURST = 0.1    # 写阻塞后最多补发多少秒的数据
+    LINE_BYTES = 64
+
+    def __init__(self, mode="at", rate=None, responses=None, latency_ms=0.0, chunk=0, chunk_gap_ms=0.0,
+                 on_reply=None):
+        if mode not in VIRTUAL_MODES:
+            raise ValueError(f"unknown virtual device mode: {mode!r}")
+        self.mode = mode
+        self.rate = rate or VIRTUAL_STREAM_RATE
+        table = VIRTUAL_AT_RESPONSES if responses is None else responses
+        self.responses = {k.upper(): v for k, v in table.items()}
+        self.latency = latency_ms / 1000.0
+        self.chunk = chunk
+        self.chunk_gap = chunk_gap_ms / 1000.0
+        self.on_reply = on_reply
+        self.bytes_out = 0
+        self._block = self._make_block()
+        self._pos = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.master, self._slave = os.openpty()
+        import tty
+        tty.setraw(self.master)
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+
+    def _make_block(self, lines=1024):
+        """stream / AT+DUMP 循环输出的一段文本（带行号，便于在日志中看出丢行）"""
+        width = self.LINE_BYTES - len("+STREAM 00000000 \r\n")
+        filler = ("0123456789ABCDEF" * (width // 16 + 1))[:width]
+        return "".join(f"+STREAM {i:08d} {filler}\r\n" for i in range(lines)).encode("ascii")
+
+    def start(self):
+        """串口端打开之后调用：关闭本地持有的从端，此后由串口端的关闭结束设备线程"""
+        if self._thread is not None:
+            return
+        os.close(self._slave)
+        self._slave = None
+        self._thread = threading.Thread(target=self._run, name=f"virtual-{self.mode}", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止设备；未 start() 时直接释放 pty"""
+        if self._thread is None:
+            for fd in (self.master, self._slave):
+                if fd is not None:
+                    os.close(fd)
+            self.master = self._slave = None
+            return
+        self._stop.set()
+        self._thread.join(1.0)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master, view):]
+        self.bytes_out += len(data)
+
+    def _reply(self, data):
+        """命令应答：按 chunk 分块写出，写完后回调 on_reply"""
+        view = memoryview(data)
+        step = self.chunk or len(view)
+        for off in range(0, len(view), step):
+            if off and self.chunk_gap:
+                time.sleep(self.chunk_gap)
+            self._write(view[off:off + step])
+        if self.on_reply is not None:
+            self.on_reply()
+
+    def _write_block(self, n):
+        """从循环文本块的当前位置输出 n 字节"""
+        block, size = self._block, len(self._block)
+        while n > 0:
+            k = min(n, size - self._pos)
+            self._write(block[self._pos:self._pos + k])
+            self._pos = (self._pos + k) % size
+            n -= k
+
+    def _handle(self, buf):
+        """处理 buf 中的完整命令行，返回剩下的不完整部分"""
+        *lines, rest = re.split(rb"\r\n|\r|\n", buf)
+        for line in lines:
+            cmd = line.decode("utf-8", "replace").strip().upper()
+            if not cmd:
+                continue
+            if self.latency:
+                time.sleep(self.latency)
+            if cmd.startswith("AT+DUMP="):
+                size = cmd[8:]
+                if size.isdigit():
+                    self._write_block(int(size))
+                    self._reply(b"\r\nOK\r\n")
+                else:
+                    self._reply(b"\r\nERROR\r\n")
+                continue
+            reply = self.responses.get(cmd, "ERROR")
+            self._reply(f"\r\n{reply}\r\n".encode("utf-8"))
+        return rest
+
+    def _run(self):
+        m = self.master
+        streaming = self.mode == "stream"
+        buf = b""
+        budget = 0.0
+        last = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([m], [], [], self.TICK if streaming else 0.1)
+                if ready:
+                    data = os.read(m, 65536)
+                    if not data:
+                        break
+                    if self.mode == "echo":
+                        self._write(data)
+                    else:
+                        buf = self._handle(buf + data)
+                if streaming:
+                    now = time.monotonic()
+                    budget = min(budget + (now - last) * self.rate, self.rate * self.MAX_BURST)
+                    last = now
+                    n = int(budget)
+                    if n:
+                        self._write_block(n)
+                        budget -= n
+        except OSError:
+            pass  # 串口端已全部关闭（EIO）
+        finally:
+            os.close(m)
+            self.master = None
+
+
+def open_virtual_serial(mode, rate=None, baud=115200, **options):
+    """新建虚拟设备（options 传给 VirtualDevice）并用 pyserial 打开其从端，返回已打开的 serial.Serial；串口关闭时设备随之结束"""
+    import serial
+    dev = VirtualDevice(mode, rate, **options)
+    try:
+        ser = serial.Serial(port=dev.path, baudrate=baud, timeout=0.5, exclusive=False)
+    except Exception:
+        dev.close()
+        raise
+    dev.start()
+    return ser
+
+
+# ---------- 脚本解析 & 执行 ----------
+class ScriptError(Exception):
+    """脚本错误；line / col 为 1 起始的行列号（未知时为 None），消息中附带位置"""
+
+    def __init__(self, msg, line=None, col=None):
+        self.msg = msg
+        self.line = line
+        self.col = col
+        if line is not None:
+            msg = f"{msg}（第 {line} 行" + (f"，第 {col} 列）" if col is not None else "）")
+        super().__init__(msg)
+
+
+def _strip_quotes(s: str) -> str:
+    s = s.strip()
+    if (s.startswith('"') and s.endswith('"')) or (s.startswith("'") and s.endswith("'")):
+        return s[1:-1]
+    return s
+
+
+# SEND 行中的关键字（大小写不敏感，前后各一个空格）；每行只从当前位置向后搜索，整行线性
+_SEND_KEYWORD = re.compile(r" (EXPECT|TIMEOUT) ", re.IGNORECASE | re.ASCII)
+_TIMEOUT_KEYWORD = re.compile(r" TIMEOUT ", re.IGNORECASE | re.ASCII)
+_DIGITS = re.compile(r"[0-9]*")
+
+
+def _parse_send(rem: str, line: int, col: int):
+    """
+    解析 SEND 之后（已去首尾空白）的文本，抽取 EXPECT/TIMEOUT（顺序任意）。
+    EXPECT 的模式可用引号或 /regex/，否则取到下一个 TIMEOUT 之前；col 为 rem 首字符所在列。
+    返回 (cmd_text, expect, timeout, expect_col)
+    """
+    m = _SEND_KEYWORD.search(rem)
+    if m is None:
+        return rem, None, None, None
+    cmd_text = rem[:m.start()].strip()
+    expect = timeout = expect_col = None
+    n = len(rem)
+    while m is not None:
+        i = m.end()
+        if m.group(1).upper() == "EXPECT":
+            expect_col = col + i
+            ch = rem[i]
+            if ch in ("'", '"', "/"):
+                j = rem.find(ch, i + 1)
+                token = rem[i:] if j == -1 else rem[i:j+1]
+                i = n if j == -1 else j + 1
+                expect = token.strip() if ch == "/" else _strip_quotes(token)  # 正则保留 /.../
+            else:
+                k = _TIMEOUT_KEYWORD.search(rem, i)
+                end = n if k is None else k.start()
+                expect = rem[i:end].strip()
+                i = end
+        else:
+            j = _DIGITS.match(rem, i).end()
+            if j == i:
+                raise ScriptError("TIMEOUT 需要毫秒整数", line, col + i)
+            timeout = int(rem[i:j])
+            i = j
+        m = _SEND_KEYWORD.search(rem, i)
+    return cmd_text, expect, timeout, expect_col
+
+
+def _check_hex(text: str, line: int, col: int):
+    """HEX 字面量在解析时校验，错误带上位置"""
+    if text[:4].upper() == "HEX ":
+        try:
+            parse_hex_bytes(text[4:])
+        except ScriptError as e:
+            raise ScriptError(e.msg, line, col) from None
+
+
+def _lex_line(raw: str, line: int):
+    """
+    把一行切成一个语句记号（逐行一次扫描）：
+      ('}',) / ('{',) / ('SET', name, value) / ('SEND', text, expect, timeout) /
+      ('DELAY', ms) / ('LOOP', n, opens_block)
+    空行与注释返回 None。
+    """
+    s = raw.strip()
+    if not s or s[0] == "#":
+        return None
+    lead = len(raw) - len(raw.lstrip())
+    col = lead + 1
+    if s == "}" or s == "{":
+        return (s,)
+
+    head = s[:6].upper()
+    l = raw[lead:]  # 只去掉行首空白：变量值保留行尾空白（与旧版一致）
+    if head.startswith("SET "):
+        body = l[4:]
+        if "=" not in body:
+            raise ScriptError("SET 需要 NAME = VALUE", line, col)
+        name, value = body.split("=", 1)
+        return ("SET", name.strip(), _strip_comment(value.lstrip()))
+
+    if head.startswith("SEND "):
+        off = 5 + len(s[5:]) - len(s[5:].lstrip())
+        rem = s[off:]
+        text, expect, timeout, expect_col = _parse_send(rem, line, col + off)
+        _check_hex(text, line, col + off)
+        if expect:
+            _check_hex(expect, line, expect_col)
+        return ("SEND", text, expect, timeout)
+
+    for kw in ("DELAY ", "WAIT "):
+        if head.startswith(kw):
+            val = s[len(kw):].strip()
+            if not (val.isascii() and val.isdigit()):
+                raise ScriptError(f"{kw.strip()} 需要毫秒整数", line, col + len(kw))
+            return ("DELAY", int(val))
+
+    if head.startswith("LOOP "):
+        rest = s[5:]
+        parts = rest.split(None, 1)
+        count_col = col + 5 + len(rest) - len(rest.lstrip())
+        if not parts or not (parts[0].isascii() and parts[0].isdigit()):
+            raise ScriptError("LOOP 后需要次数整数", line, count_col)
+        after = parts[1].strip() if len(parts) > 1 else ""
+        if after not in ("", "{"):
+            raise ScriptError(f"LOOP 次数后只能跟 '{{'：{after}", line, col + len(s) - len(parts[1].lstrip()))
+        return ("LOOP", int(parts[0]), after == "{")
+
+    # NAME=VALUE 简写：名字中不能有空白
+    if "=" in l:
+        name, value = l.split("=", 1)
+        if name and name.strip() == name and " " not in name:
+            return ("SET", name, _strip_comment(value.lstrip()))
+
+    raise ScriptError(f"无法识别的指令：{s}", line, col)
+
+
+def _strip_comment(value: str) -> str:
+    return value.split(" #", 1)[0] if " #" in value else value
+
+
+def parse_script(text: str):
+    """
+    极简 DSL（大小写不敏感）：
+      - SEND <text> [EXPECT <substr|"/regex/"|HEX ..> [TIMEOUT <ms>]]
+      - SEND HEX 55 AA 01  # 原样发送二进制字节（不追加 CRLF）
+      - DELAY <ms>
+      - WAIT <ms>        # 等价 DELAY
+      - LOOP <N> { ... }
+      - SET NAME = VALUE   或   NAME=VALUE
+      - 变量引用：$NAME / ${NAME}（仅在 SEND 中展开）
+      - # 注释；空行忽略
+    返回树：list[
+      ('SET', name, value) |
+      ('SEND', text, expect:str|None, timeout_ms:int|None) |
+      ('DELAY', ms) |
+      ('LOOP', n, block)
+    ]
+    逐行单遍词法 + 显式栈组装 LOOP 块，耗时与输入大小成正比；错误带行列号（ScriptError.line / col）。
+    """
+    root = []
+    stack = [(root, None, None)]  # (当前块, 打开它的 LOOP 所在行, 列)
+    pending = None  # 次数行之后等待单独一行 '{' 的 LOOP：(次数, 行, 列)
+    line = 0
+    for line, raw in enumerate(text.splitlines(), 1):
+        tok = _lex_line(raw, line)
+        if tok is None:
+            continue
+        kind = tok[0]
+        if pending is not None:
+            if kind != "{":
+                raise ScriptError("LOOP 缺少 '{'", pending[1], pending[2])
+            body = []
+            stack[-1][0].append(("LOOP", pending[0], body))
+            stack.append((body, pending[1], pending[2]))
+            pending = None
+            continue
+        if kind == "}":
+            if len(stack) == 1:
+                raise ScriptError("多余的 '}'", line, len(raw) - len(raw.lstrip()) + 1)
+            stack.pop()
+        elif kind == "{":
+            raise ScriptError("多余的 '{'", line, len(raw) - len(raw.lstrip()) + 1)
+        elif kind == "LOOP":
+            col = len(raw) - len(raw.lstrip()) + 1
+            if tok[2]:
+                body = []
+                stack[-1][0].append(("LOOP", tok[1], body))
+                stack.append((body, line, col))
+            else:
+                pending = (tok[1], line, col)
+        else:
+            stack[-1][0].append(tok)
+    if pending is not None:
+        raise ScriptError("LOOP 缺少 '{'", pending[1], pending[2])
+    if len(stack) > 1:
+        raise ScriptError("LOOP 缺少 '}'", stack[-1][1], stack[-1][2])
+    return root
+
+
+def iter_steps(cmds):
+    """
+    按执行顺序惰性产出线性步骤（元组格式同 flatten_cmds；编译后的树产出编译步骤）。
+    LOOP 用显式栈逐次展开，内存只与脚本大小有关，与循环次数无关。
+    """
+    stack = [[cmds, 0, 1]]  # [block, 下一条下标, 剩余遍数]
+    while stack:
+        frame = stack[-1]
+        block, idx = frame[0], frame[1]
+        if idx >= len(block):
+            frame[2] -= 1
+            if frame[2] > 0:
+                frame[1] = 0
+            else:
+                stack.pop()
+            continue
+        frame[1] = idx + 1
+        c = block[idx]
+        op = c[0]
+        if op in ("SEND", "DELAY", "SET"):
+            yield c
+        elif op == "LOOP":
+            times, body = c[1], c[2]
+            if times < 0:
+                raise ScriptError("LOOP 次数不能为负数")
+            if times and body:
+                stack.append([body, 0, times])
+        else:
+            raise ScriptError(f"未知指令类型：{op}")
+
+
+def count_steps(cmds) -> int:
+    """不展开 LOOP，按乘法计算线性步骤总数（与 iter_steps 产出数量一致）"""
+    total = 0
+    for c in cmds:
+        op = c[0]
+        if op == "LOOP":
+            if c[1] < 0:
+                raise ScriptError("LOOP 次数不能为负数")
+            total += c[1] * count_steps(c[2])
+        elif op in ("SEND", "DELAY", "SET"):
+            total += 1
+        else:
+            raise ScriptError(f"未知指令类型：{op}")
+    return total
+
+
+def flatten_cmds(cmds, limit=200000):
+    """
+    展开树为线性序列：
+      - ('SET', name, value)
+      - ('SEND', text, expect, timeout_ms)
+      - ('DELAY', ms)
+    执行脚本请用 iter_steps，无需整体展开；只需统计步骤数 / 耗时请用 analyze_script。
+    """
+    out = []
+    for step in iter_steps(cmds):
+        out.append(step)
+        if len(out) > limit:
+            raise ScriptError(f"展开后的指令超过限制（>{limit}），请减少循环次数。")
+    return out
+
+
+EXPECT_MAX_LOOKBACK = 64 * 1024  # 正则 EXPECT 默认最多回看的字节数
+
+
+LINE_ENDING = b"\r\n"  # 文本 SEND 追加的行尾
+
+
+def parse_hex_bytes(text: str) -> bytes:
+    """解析 HEX 字面量：'55 AA 01' / '55AA01' / '0x55,0xAA' 均可"""
+    cleaned = re.sub(r"0[xX]", "", text).replace(",", " ")
+    try:
+        data = bytes.fromhex(cleaned)
+    except ValueError:
+        raise ScriptError(f"HEX 数据无效：{text.strip()}")
+    if not data:
+        raise ScriptError("HEX 后需要至少一个字节")
+    return data
+
+
+def describe_bytes(data: bytes) -> str:
+    """仅用于显示：可打印文本原样返回（去掉行尾），否则以 HEX 形式展示"""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = None
+    if text is not None:
+        if text.endswith("\r\n"):
+            text = text[:-2]
+        if text.isprintable():
+            return text
+    return "HEX " + data.hex(" ").upper()
+
+
+class ExpectSpec:
+    """
+    编译后的 EXPECT：/regex/ 只编译一次（bytes 模式），字面量预先编码为 bytes，
+    HEX xx xx 直接解析为字节序列。
+    正则无效时退回按字面量匹配，错误保存在 error 中供运行时提示。
+    """
+    __slots__ = ("text", "pattern", "needle", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pattern = None
+        self.needle = None
+        self.error = None
+        if text[:4].upper() == "HEX ":
+            self.needle = parse_hex_bytes(text[4:])
+            return
+        if len(text) >= 2 and text[0] == "/" and text[-1] == "/":
+            try:
+                self.pattern = re.compile(text[1:-1].encode("utf-8"))
+            except re.error as e:
+                self.error = e
+        if self.pattern is None:
+            self.needle = text.encode("utf-8")
+
+
+class ExpectMatcher:
+    """
+    增量 EXPECT 匹配（按 UTF-8 字节）：
+    - 子串：只在上次保留的 len(expect)-1 字节 + 新数据中查找
+    - 正则（/.../）：在最多 max_lookback 字节的滑动窗口中查找
+    窗口是 bytearray，每块数据的开销与此前收到的数据量无关，内存有界。
+    """
+
+    def __init__(self, expect, max_lookback=EXPECT_MAX_LOOKBACK):
+        spec = expect if isinstance(expect, ExpectSpec) else ExpectSpec(expect)
+        self.spec = spec
+        self.pattern = spec.pattern
+        self.needle = spec.needle
+        if self.pattern is not None:
+            self._keep = max(1, int(max_lookback))
+        else:
+            self._keep = max(0, len(self.needle) - 1)
+        self._window = bytearray()
+        self.nbytes = 0  # 累计收到的字节数（计时统计用）
+
+    def feed(self, data: bytes) -> bool:
+        self.nbytes += len(data)
+        window = self._window
+        window += data
+        if self.pattern is not None:
+            if self.pattern.search(window):
+                return True
+        elif window.find(self.needle) != -1:
+            return True
+        excess = len(window) - self._keep
+        if excess > 0:
+            del window[:excess]
+        return False
+
+    def reset(self):
+        self._window.clear()
+
+
+# ---------- 脚本编译（预构建步骤） ----------
+def expand_vars(text: str, variables) -> str:
+    """展开 $NAME / ${NAME}，支持 \\$ 转义（逐字符解释，供对照；运行时用 Template）"""
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n and text[i+1] == "$":
+            out.append("$"); i += 2; continue
+        if ch == "$":
+            # ${NAME}
+            if i + 1 < n and text[i+1] == "{":
+                j = i + 2
+                while j < n and text[j] != "}":
+                    j += 1
+                if j < n:
+                    name = text[i+2:j]
+                    out.append(variables.get(name, ""))
+                    i = j + 1
+                    continue
+            # $NAME
+            j = i + 1
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            name = text[i+1:j]
+            if name:
+                out.append(variables.get(name, ""))
+                i = j
+                continue
+        out.append(ch); i += 1
+    return "".join(out)
+
+
+_VAR_NAME = re.compile(r"\w+")  # 与 str.isalnum() 或 '_' 一致
+
+
+class Template:
+    """
+    SEND 文本模板：编译期把 $NAME / ${NAME} 拆成字面量与变量槽交替的序列，
+    运行时只做槽位查找和拼接（语义与 expand_vars 一致）。
+    """
+    __slots__ = ("raw", "parts", "names", "bparts")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        if "$" not in raw:
+            # 不含变量（长数据行的常见情况）：无需逐字符扫描
+            self.parts = (raw,)
+            self.names = ()
+            self.bparts = (raw.encode("utf-8"),)
+            return
+        literals, names = [], []
+        buf = []
+        i = 0
+        n = len(raw)
+        while True:
+            # 逐个 '$' 跳跃查找，字面量整段切片
+            j = raw.find("$", i)
+            if j == -1:
+                buf.append(raw[i:])
+                break
+            if j > i and raw[j-1] == "\\":
+                buf.append(raw[i:j-1]); buf.append("$"); i = j + 1
+                continue
+            buf.append(raw[i:j])
+            name = None
+            if j + 1 < n and raw[j+1] == "{":
+                k = raw.find("}", j + 2)
+                if k != -1:
+                    name, end = raw[j+2:k], k + 1
+            if name is None:
+                m = _VAR_NAME.match(raw, j + 1)
+                if m is not None:
+                    name, end = m.group(), m.end()
+            if name is None:
+                buf.append("$"); i = j + 1
+                continue
+            literals.append("".join(buf)); buf = []
+            names.append(name)
+            i = end
+        literals.append("".join(buf))
+        # parts: [lit0, name0, lit1, name1, ..., litN]
+        parts = [literals[0]]
+        for name, lit in zip(names, literals[1:]):
+            parts.append(name)
+            parts.append(lit)
+        self.parts = tuple(parts)
+        self.names = tuple(names)
+        # 字面量预先编码；变量槽保持为名字（运行时变量值已是 bytes）
+        self.bparts = tuple(p.encode("utf-8") if k % 2 == 0 else p for k, p in enumerate(parts))
+
+    @property
+    def is_static(self):
+        return not self.names
+
+    def render(self, variables) -> str:
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+        out = list(parts)
+        for k in range(1, len(out), 2):
+            out[k] = variables.get(out[k], "")
+        return "".join(out)
+
+    def render_bytes(self, variables) -> bytes:
+        """variables 的值为 bytes（SET 时已编码）"""
+        parts = self.bparts
+        if len(parts) == 1:
+            return parts[0]
+        out = list(parts)
+        for k in range(1, len(out), 2):
+            out[k] = variables.get(out[k], b"")
+        return b"".join(out)
+
+
+# 编译后的步骤：前几个字段与 parse_script 的元组一致，iter_steps / count_steps 通用
+SetStep = namedtuple("SetStep", "op name value data")
+SendStep = namedtuple("SendStep", "op text expect timeout_ms template expect_spec payload")
+DelayStep = namedtuple("DelayStep", "op ms")
+LoopStep = namedtuple("LoopStep", "op count body")
+
+
+def compile_script(cmds):
+    """
+    把 parse_script 的树编译为预构建步骤：
+      - SEND 文本 -> Template；不含变量时直接预编码为 payload（含 CRLF）
+      - SEND HEX .. -> payload 为原始字节，不追加行尾
+      - EXPECT -> ExpectSpec（正则只编译一次）；SET 的值预编码为 bytes
+      - LOOP 体递归编译，仍保持树结构（执行时由 iter_steps 惰性展开）
+    """
+    out = []
+    for c in cmds:
+        op = c[0]
+        if op == "SEND":
+            text, expect = c[1], c[2]
+            spec = ExpectSpec(expect) if expect else None
+            if text[:4].upper() == "HEX ":
+                out.append(SendStep("SEND", text, expect, c[3], None, spec, parse_hex_bytes(text[4:])))
+                continue
+            template = Template(text)
+            payload = template.bparts[0] + LINE_ENDING if template.is_static else None
+            out.append(SendStep("SEND", text, expect, c[3], template, spec, payload))
+        elif op == "DELAY":
+            out.append(DelayStep("DELAY", max(0, int(c[1]))))
+        elif op == "SET":
+            out.append(SetStep("SET", c[1], c[2], c[2].encode("utf-8")))
+        elif op == "LOOP":
+            if c[1] < 0:
+                raise ScriptError("LOOP 次数不能为负数")
+            out.append(LoopStep("LOOP", c[1], compile_script(c[2])))
+        else:
+            raise ScriptError(f"未知指令类型：{op}")
+    return out
+
+
+DEFAULT_EXPECT_TIMEOUT_MS = 3000
+
+
+def prepare_send(step, variables, prefix):
+    """SEND 步骤的公共部分：取预编码 payload（含变量时按槽位渲染），生成日志行；同步/异步引擎共用"""
+    timeout_ms = step.timeout_ms if step.timeout_ms is not None else DEFAULT_EXPECT_TIMEOUT_MS
+    payload = step.payload
+    log_line = f"{prefix} SEND {step.text}"
+    if payload is None:
+        payload = step.template.render_bytes(variables) + LINE_ENDING
+        log_line += f"  ->  {describe_bytes(payload)}"
+    if step.expect:
+        log_line += f"  ; EXPECT={step.expect}  ; TIMEOUT={timeout_ms}ms"
+    return payload, timeout_ms, log_line
+
+
+# ---------- 脚本预检（dry-run，不执行） ----------
+ScriptAnalysis = namedtuple(
+    "ScriptAnalysis",
+    "steps sends expects delays delay_ms expect_budget_ms max_depth undefined_vars problems",
+)
+
+
+def analyze_script(cmds) -> ScriptAnalysis:
+    """
+    不展开 LOOP 的脚本预检：按乘法累计步骤数、DELAY 总时长与 EXPECT 最坏超时预算。
+    - 每个 LOOP 体只遍历一次，耗时只与脚本大小有关（展开后数十亿步也在毫秒级）
+    - undefined_vars：按执行顺序在任何 SET 之前就被 SEND 引用的变量（运行时展开为空）；
+      LOOP 的后续轮次不会引入新的“先用后设”，只需看首轮；次数为 0 的 LOOP 不执行，不参与判定
+    - problems：无效的正则 / HEX 字面量等静态问题
+    最坏总时长 = delay_ms + expect_budget_ms（不含串口传输时间）
+    """
+    defined = set()
+    undefined = {}  # name -> 首次引用它的 SEND 文本（保持出现顺序）
+    problems = []
+
+    def walk(block, depth, live):
+        # 单遍合计：[steps, sends, expects, delays, delay_ms, expect_ms]，以及最大嵌套深度
+        acc = [0, 0, 0, 0, 0, 0]
+        deepest = depth
+        for c in block:
+            op = c[0]
+            if op == "SET":
+                acc[0] += 1
+                if live:
+                    defined.add(c[1])
+            elif op == "SEND":
+                acc[0] += 1
+                acc[1] += 1
+                text, expect, timeout = c[1], c[2], c[3]
+                if text[:4].upper() == "HEX ":
+                    try:
+                        parse_hex_bytes(text[4:])
+                    except ScriptError as e:
+                        problems.append(f"SEND {text}: {e}")
+                elif live:
+                    for name in Template(text).names:
+                        if name not in defined and name not in undefined:
+                            undefined[name] = text
+                if expect:
+                    acc[2] += 1
+                    acc[5] += timeout if timeout is not None else DEFAULT_EXPECT_TIMEOUT_MS
+                    try:
+                        err = ExpectSpec(expect).error
+                    except ScriptError as e:
+                        err = e
+                    if err is not None:
+                        problems.append(f"EXPECT {expect}: {err}")
+            elif op == "DELAY":
+                acc[0] += 1
+                acc[3] += 1
+                acc[4] += max(0, int(c[1]))
+            elif op == "LOOP":
+                times = c[1]
+                if times < 0:
+                    raise ScriptError("LOOP 次数不能为负数")
+                sub, sub_depth = walk(c[2], depth + 1, live and times > 0)
+                for k in range(6):
+                    acc[k] += times * sub[k]
+                deepest = max(deepest, sub_depth)
+            else:
+                raise ScriptError(f"未知指令类型：{op}")
+        return acc, deepest
+
+    acc, depth = walk(cmds, 0, True)
+    return ScriptAnalysis(*acc, depth, tuple(undefined), tuple(problems))
+
+
+def format_ms(ms) -> str:
+    """毫秒 -> [Nd ]H:MM:SS.mmm"""
+    sec, ms = divmod(int(ms), 1000)
+    minutes, sec = divmod(sec, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    text = f"{hours}:{minutes:02d}:{sec:02d}.{ms:03d}"
+    return f"{days}d {text}" if days else text
+
+
+def describe_analysis(a: ScriptAnalysis, tr_fn=None):
+    """预检结果的日志行（GUI 加载脚本与命令行 check 共用）"""
+    tr = tr_fn or (lambda key, **kw: translate(key, "en", **kw))
+    lines = [tr(
+        "msg_script_analysis", steps=a.steps, sends=a.sends, expects=a.expects, delays=a.delays,
+        delay=format_ms(a.delay_ms), budget=format_ms(a.expect_budget_ms),
+        worst=format_ms(a.delay_ms + a.expect_budget_ms),
+    )]
+    if a.undefined_vars:
+        lines.append(tr("msg_script_undefined_vars", names=", ".join(a.undefined_vars)))
+    lines.extend(tr("msg_script_problem", text=p) for p in a.problems)
+    return lines
+
+
+# ---------- 脚本缓存（内容哈希 + 解析器版本） ----------
+PARSER_VERSION = 2  # parse_script / compile_script 的输出变化时递增，旧缓存自动失效
+SCRIPT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / APP_NAME / "scripts"
+
+CachedScript = namedtuple("CachedScript", "key tree program analysis source")  # source: memory / disk / parsed
+
+
+def _tree_from_json(block):
+    """JSON 列表还原为 parse_script 的元组树"""
+    out = []
+    for c in block:
+        if c[0] == "LOOP":
+            out.append(("LOOP", c[1], _tree_from_json(c[2])))
+        else:
+            out.append(tuple(c))
+    return out
+
+
+class ScriptCache:
+    """
+    解析 / 编译结果缓存，键为 sha256(解析器版本 + 脚本内容)：
+    - 内存：最近使用的 max_entries 个编译结果（LRU），同一进程内重跑无需任何解析
+    - 磁盘：解析树存为 JSON（不用 pickle，缓存文件不能执行代码），跨进程复用；
+      总大小超过 max_disk_bytes 时按访问时间淘汰最旧的文件
+    磁盘读写失败只打印警告，退回正常解析。
+    """
+
+    def __init__(self, directory=SCRIPT_CACHE_DIR, max_entries=16, max_disk_bytes=64 * 1024 * 1024):
+        self.directory = Path(directory) if directory else None
+        self.max_entries = max(1, int(max_entries))
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        import hashlib
+        h = hashlib.sha256(f"{APP_NAME}-parser-{PARSER_VERSION}\0".encode())
+        h.update(text.encode("utf-8", "surrogatepass"))
+        return h.hexdigest()
+
+    def load(self, path) -> CachedScript:
+        """读取脚本文件并返回编译结果（命中缓存时不解析）"""
+        return self.get(Path(path).read_text(encoding="utf-8"))
+
+    def get(self, text: str) -> CachedScript:
+        key = self.key_for(text)
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                return entry._replace(source="memory")
+
+        tree, analysis = self._read_disk(key)
+        source = "disk"
+        if tree is None:
+            tree = parse_script(text)  # ScriptError 原样抛给调用方
+            analysis = analyze_script(tree)
+            source = "parsed"
+            self._write_disk(key, tree, analysis)
+        entry = CachedScript(key, tree, compile_script(tree), analysis, source)
+        with self._lock:
+            self._mem[key] = entry
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+        if self.directory is not None and self.directory.is_dir():
+            for f in self.directory.glob("*.json"):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+
+    def _read_disk(self, key):
+        """返回 (tree, analysis)；未命中为 (None, None)"""
+        if self.directory is None or not self.max_disk_bytes:
+            return None, None
+        f = self.directory / f"{key}.json"
+        try:
+            data = json.loads(f.read_text(encoding="utf-8"))
+            if data.get("parser") != PARSER_VERSION:
+                return None, None
+            tree = _tree_from_json(data["tree"])
+            a = data["analysis"]
+            analysis = ScriptAnalysis(**dict(a, undefined_vars=tuple(a["undefined_vars"]), problems=tuple(a["problems"])))
+            os.utime(f)  # 记录访问时间，供 LRU 淘汰
+            return tree, analysis
+        except FileNotFoundError:
+            return None, None
+        except Exception as exc:
+            print("[WARN] ScriptCache read:", exc)
+            return None, None
+
+    def _write_disk(self, key, tree, analysis):
+        if self.directory is None or not self.max_disk_bytes:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            f = self.directory / f"{key}.json"
+            tmp = f.with_name(f".{f.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"parser": PARSER_VERSION, "tree": tree, "analysis": analysis._asdict()},
+                                      ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, f)
+            self._evict_disk()
+        except Exception as exc:
+            print("[WARN] ScriptCache write:", exc)
+
+    def _evict_disk(self):
+        files = []
+        for f in self.directory.glob("*.json"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files, key=lambda x: x[0]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                f.unlink()
+                total -= size
+            except OSError:
+                pass
+
+
+# ---------- 脚本计时（逐步耗时，单调时钟） ----------
+StepTiming = namedtuple(
+    "StepTiming", "index op text start_ms send_ms expect_ms delay_ms rx_bytes timeout_ms margin_ms ok")
+# index：步序号（与进度一致，从 1 起）；start_ms：相对运行开始；send_ms：写出耗时；
+# expect_ms：写出完成到匹配（或超时）；rx_bytes：EXPECT 等待期间收到的字节；
+# margin_ms：超时余量 timeout_ms - expect_ms（仅匹配成功时）；delay_ms：DELAY 实际耗时；不适用的字段为 None
+
+
+def percentile(sorted_values, q):
+    """最近秩百分位（sorted_values 已排序）；空序列返回 None"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 3)
+
+
+def _distribution(values):
+    ordered = sorted(values)
+    dist = {f"p{q}": percentile(ordered, q) for q in (50, 90, 99)}
+    dist["max"] = ordered[-1] if ordered else None
+    return dist
+
+
+class RunMetrics:
+    """
+    一次脚本运行的逐步计时：引擎在每个 SEND / DELAY 结束时调用 add_send / add_delay（time.monotonic 时间戳）。
+    - 分位数基于全部步骤（耗时存在 array('d') 里，每步 8 字节）；逐步明细最多保留 max_rows 行供导出
+    - summary()：发送 / EXPECT 等待 / DELAY 的合计与分位数、最慢的 SEND 步骤；
+      overhead = 总耗时 - 发送 - EXPECT 等待 - DELAY，即工具自身（日志、调度、变量展开）的开销
+    - 只在执行引擎的线程中写入，运行结束后再读取
+    """
+    SLOWEST = 10
+
+    def __init__(self, max_rows=200_000):
+        self.max_rows = max_rows
+        self.rows = []
+        self.rows_dropped = 0
+        self.steps = 0
+        self.t0 = self.t1 = None
+        self._send = array("d")
+        self._expect = array("d")
+        self._margin = array("d")
+        self._delay_ms = 0.0
+        self._rx_bytes = 0
+        self._timeouts = 0
+        self._slowest = []  # 小顶堆：(send_ms + expect_ms, index, StepTiming)
+
+    def start(self, now=None):
+        self.t0 = time.monotonic() if now is None else now
+        self.t1 = None
+
+    def finish(self, now=None):
+        if self.t0 is not None and self.t1 is None:
+            self.t1 = time.monotonic() if now is None else now
+
+    def _add(self, row):
+        self.steps += 1
+        if len(self.rows) < self.max_rows:
+            self.rows.append(row)
+        else:
+            self.rows_dropped += 1
+
+    def add_send(self, index, text, t_start, t_sent, t_end=None, rx_bytes=0, timeout_ms=None, ok=True):
+        """t_end 为 None 表示没有 EXPECT；ok=False 表示 EXPECT 超时"""
+        send_ms = _ms(t_sent - t_start)
+        expect_ms = margin_ms = None
+        self._send.append(send_ms)
+        if t_end is not None:
+            expect_ms = _ms(t_end - t_sent)
+            self._expect.append(expect_ms)
+            self._rx_bytes += rx_bytes
+            if ok:
+                margin_ms = round(timeout_ms - expect_ms, 3)
+                self._margin.append(margin_ms)
+            else:
+                self._timeouts += 1
+        row = StepTiming(index, "SEND", text, _ms(t_start - self.t0), send_ms, expect_ms, None,
+                         rx_bytes if t_end is not None else None, timeout_ms if t_end is not None else None,
+                         margin_ms, ok)
+        self._add(row)
+        item = (send_ms + (expect_ms or 0.0), index, row)
+        if len(self._slowest) < self.SLOWEST:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def add_delay(self, index, ms, t_start, t_end):
+        delay_ms = _ms(t_end - t_start)
+        self._delay_ms += delay_ms
+        self._add(StepTiming(index, "DELAY", f"DELAY {ms}", _ms(t_start - self.t0), None, None, delay_ms,
+                             None, None, None, True))
+
+    def summary(self):
+        """汇总（可直接序列化为 JSON）；时间单位均为毫秒"""
+        end = self.t1 if self.t1 is not None else time.monotonic()
+        wall_ms = _ms(end - self.t0) if self.t0 is not None else 0.0
+        send_ms, expect_ms = sum(self._send), sum(self._expect)
+        return {
+            "steps": self.steps,
+            "sends": len(self._send),
+            "expects": len(self._expect),
+            "timeouts": self._timeouts,
+            "wall_ms": wall_ms,
+            "send_ms": round(send_ms, 3),
+            "expect_ms": round(expect_ms, 3),
+            "delay_ms": round(self._delay_ms, 3),
+            "wait_ms": round(expect_ms + self._delay_ms, 3),
+            "overhead_ms": round(max(0.0, wall_ms - send_ms - expect_ms - self._delay_ms), 3),
+            "rx_bytes": self._rx_bytes,
+            "send": _distribution(self._send),
+            "expect": _distribution(self._expect),
+            "margin_min_ms": min(self._margin) if self._margin else None,
+            "slowest": [row._asdict() for _, _, row in sorted(self._slowest, reverse=True)],
+            "rows_dropped": self.rows_dropped,
+        }
+
+    def write_csv(self, path):
+        """逐步明细，每步一行（列同 StepTiming，不适用为空）"""
+        import csv
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(StepTiming._fields)
+            w.writerows(["" if v is None else v for v in row] for row in self.rows)
+
+    def write_json(self, path):
+        """{"summary": ..., "steps": [...]}"""
+        doc = {"summary": self.summary(), "steps": [row._asdict() for row in self.rows]}
+        atomic_write_text(path, json.dumps(doc, ensure_ascii=False))
+
+    def write(self, path):
+        """按扩展名导出：.json 为汇总 + 明细，其余为 CSV 明细"""
+        if str(path).lower().endswith(".json"):
+            self.write_json(path)
+        else:
+            self.write_csv(path)
+
+
+def describe_metrics(summary, tr_fn=None):
+    """运行计时汇总的日志行（GUI 脚本结束与命令行 run 共用）"""
+    tr = tr_fn or (lambda key, **kw: translate(key, "en", **kw))
+    s = summary
+    lines = [tr(
+        "msg_metrics_summary", steps=s["steps"], wall=format_ms(s["wall_ms"]), send=format_ms(s["send_ms"]),
+        expect=format_ms(s["expect_ms"]), delay=format_ms(s["delay_ms"]), overhead=format_ms(s["overhead_ms"]),
+        timeouts=s["timeouts"], rx=s["rx_bytes"],
+    )]
+    if s["expects"]:
+        e = s["expect"]
+        lines.append(tr(
+            "msg_metrics_expect", p50=f"{e['p50']:.2f}", p90=f"{e['p90']:.2f}", p99=f"{e['p99']:.2f}",
+            max=f"{e['max']:.2f}", margin="-" if s["margin_min_ms"] is None else f"{s['margin_min_ms']:.0f}",
+        ))
+    for row in s["slowest"][:3]:
+        lines.append(tr(
+            "msg_metrics_slowest", index=row["index"], text=row["text"][:60], send=f"{row['send_ms']:.2f}",
+            expect="-" if row["expect_ms"] is None else f"{row['expect_ms']:.2f} ms",
+        ))
+    return lines
+
+
+class ScriptEngine:
+    """
+    不依赖 Qt 的脚本执行引擎：按 iter_steps 惰性执行 compile_script 的结果。
+    - 订阅 SerialLink 的接收数据做 EXPECT 等待，经 link.write 有序发送
+    - on_log(text) / on_progress(done, total) 在执行 run() 的线程中回调
+    - metrics（RunMetrics，可选）记录每个 SEND / DELAY 的耗时
+    - run() 返回 (ok, msg)；GUI 由 ScriptRunner(QThread) 包装，CLI 直接在主线程调用
+    """
+
+    PROGRESS_INTERVAL = 0.1  # 进度上报间隔（秒）
+    WRITE_POLL = 0.1         # 等待写出时检查 stop() 的间隔（秒）
+
+    def __init__(self, program, link: SerialLink, tr_fn=None, max_lookback=EXPECT_MAX_LOOKBACK,
+                 on_log=None, on_progress=None, metrics=None):
+        self._program = program  # compile_script 的结果，运行时由 iter_steps 惰性展开
+        self.total_steps = count_steps(program)
+        self.steps_done = 0
+        self._stop = False
+        self._vars = {}
+        self._link = link  # 订阅读线程的数据，用于 EXPECT 等待
+        self._rx = deque()
+        self._rx_cond = threading.Condition()  # 读线程投递数据后唤醒 EXPECT 等待
+        self._stop_event = threading.Event()   # 唤醒 DELAY 等待
+        self._armed = False  # 仅在 SEND 之后、EXPECT 结束前收集数据
+        self._max_lookback = max_lookback
+        self._tr = tr_fn or (lambda key, **kw: translate(key, "en", **kw))
+        self._on_log = on_log or (lambda text: None)
+        self._on_progress = on_progress or (lambda done, total: None)
+        self.metrics = metrics
+        self._matcher = None  # 最近一次 EXPECT 的匹配器（计时统计取其收到的字节数）
+
+    def stop(self):
+        self._stop = True
+        self._stop_event.set()
+        with self._rx_cond:
+            self._rx_cond.notify_all()
+
+    def feed(self, data: bytes):
+        """读线程回调：EXPECT 等待期间收集串口数据并唤醒等待方"""
+        if self._armed:
+            with self._rx_cond:
+                self._rx.append(data)
+                self._rx_cond.notify()
+
+    def _arm(self):
+        with self._rx_cond:
+            self._rx.clear()
+            self._armed = True
+
+    def _wait_written(self, fut) -> bool:
+        """等待写出完成；写被流控阻塞时也能响应 stop()（返回 False）。写失败时抛出原异常"""
+        from concurrent.futures import TimeoutError as FutureTimeout  # write() 已导入，这里只是取名字
+        while True:
+            try:
+                fut.result(self.WRITE_POLL)
+                return True
+            except FutureTimeout:
+                if self._stop:
+                    fut.cancel()  # 尚未开始写出时不再写
+                    return False
+
+    def _wait_for_expect(self, spec: ExpectSpec, timeout_ms: int) -> bool:
+        """
+        消费读线程推送的数据，直到匹配 expect 或超时。
+        - 如果 expect 形如 /.../ 则按正则匹配；否则做子串查找
+        - 不直接读串口；收到的数据由 GUI 订阅读线程后自行显示
+        - 在条件变量上阻塞等待（单调时钟截止），数据到达即被唤醒，空闲不占 CPU
+        """
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        if spec.error is not None:
+            self._on_log(f"{self._tr('msg_script_prefix')} {self._tr('msg_bad_regex', err=spec.error)}")
+        matcher = self._matcher = ExpectMatcher(spec, self._max_lookback)
+
+        cond = self._rx_cond
+        while not self._stop:
+            # 超时？（持续有数据但一直不匹配时也要按时退出）
+            if time.monotonic() >= deadline:
+                return False
+            with cond:
+                while not self._rx and not self._stop:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    cond.wait(remaining)
+                chunks = list(self._rx)
+                self._rx.clear()
+            for chunk in chunks:
+                if matcher.feed(chunk):
+                    return True
+        return False
+
+    def run(self):
+        self._link.subscribe(self.feed)
+        log = self._on_log
+        prefix = self._tr("msg_script_prefix")
+        metrics = self.metrics
+        clock = time.monotonic
+        done = 0
+        next_report = 0.0
+        if metrics is not None:
+            _new_future()  # 链路首次 write() 才导入 concurrent.futures：先导入，免得计入第一步的发送耗时
+            metrics.start()
+        try:
+            for step in iter_steps(self._program):
+                now = time.monotonic()
+                if now >= next_report:
+                    self._on_progress(done, self.total_steps)
+                    next_report = now + self.PROGRESS_INTERVAL
+                done += 1
+                self.steps_done = done
+                if self._stop:
+                    return False, self._tr("msg_script_stop")
+
+                op = step[0]
+                if op == "SET":
+                    name, value = step.name, step.data
+                    self._vars[name] = value  # 变量值以 bytes 保存，SEND 时直接拼接
+                    log(f"{prefix} SET {name} = ({len(value)} bytes)")
+                    continue
+
+                if op == "SEND":
+                    expect = step.expect  # 可能为 None
+                    payload, timeout_ms, log_line = prepare_send(step, self._vars, prefix)
+                    log(log_line)
+
+                    # 需要等待返回？先开始收集，再发送，避免漏掉快速应答
+                    if expect:
+                        self._arm()
+
+                    # 经链路的有序发送队列直接写串口（不经过 GUI 事件循环），等待写出完成
+                    t_start = clock()
+                    if not self._wait_written(self._link.write(payload)):
+                        return False, self._tr("msg_script_stop")
+
+                    if expect:
+                        t_sent = clock()
+                        ok = self._wait_for_expect(step.expect_spec, timeout_ms)
+                        self._armed = False
+                        if metrics is not None and not self._stop:
+                            metrics.add_send(done, step.text, t_start, t_sent, clock(),
+                                             self._matcher.nbytes, timeout_ms, ok)
+                        if not ok:
+                            if self._stop:
+                                return False, self._tr("msg_script_stop")
+                            return False, self._tr("msg_script_wait_timeout", expect=expect, timeout=timeout_ms)
+                    elif metrics is not None:
+                        metrics.add_send(done, step.text, t_start, clock())
+                    continue
+
+                if op == "DELAY":
+                    ms = step.ms
+                    log(f"{prefix} DELAY {ms} ms")
+                    # 阻塞到期或被 stop() 唤醒，不做轮询
+                    t_start = clock()
+                    self._stop_event.wait(ms / 1000.0)
+                    if metrics is not None and not self._stop:
+                        metrics.add_delay(done, ms, t_start, clock())
+                    continue
+
+                log(f"{prefix} {self._tr('msg_script_unknown_step', op=op)}")
+
+            self._on_progress(done, self.total_steps)
+            return True, self._tr("msg_script_done")
+        except Exception as e:
+            return False, self._tr("msg_script_exception", err=e)
+        finally:
+            self._armed = False
+            self._link.unsubscribe(self.feed)
+            if metrics is not None:
+                metrics.finish()
+
+
+# ---------- 命令行（无界面批量运行） ----------
+CLI_COMMANDS = ("run", "check", "library")
+
+# 退出码
+EXIT_OK = 0
+EXIT_FAILED = 1       # 脚本执行失败（EXPECT 超时、发送异常等）；多串口时任一失败
+EXIT_USAGE = 2        # 参数错误 / 脚本无法解析
+EXIT_PORT = 3         # 串口无法打开
+EXIT_INTERRUPTED = 130
+
+
+# ---------- 多串口批量运行 ----------
+def open_serial(port, baud):
+    """打开串口（非独占）；pyserial 延迟导入，脚本解析错误时无需加载。virtual:<mode> 打开内置虚拟设备"""
+    virtual = parse_virtual_port(port)
+    if virtual is not None:
+        return open_virtual_serial(*virtual, baud=baud)
+    import serial
+    return serial.Serial(port=port, baudrate=baud, timeout=0.5, exclusive=False)
+
+
+def port_label(port: str) -> str:
+    """串口的短名称（用于日志前缀和文件名）：/dev/serial/by-id/x -> serial_by-id_x"""
+    name = port[5:] if port.startswith("/dev/") else port
+    return name.strip("/").replace("/", "_") or "port"
+
+
+class PortLog:
+    """
+    单个串口的日志输出：写入独立文件，或写到 stderr 并加 [port] 前缀。
+    步骤日志（执行线程）与接收数据（读线程）共用一把锁，接收数据按行缓冲后再加前缀。
+    """
+
+    def __init__(self, label, path=None, stream=None, prefix=True):
+        self._lock = threading.Lock()
+        self._prefix = f"[{label}] " if prefix else ""
+        self._fh = open(path, "a", encoding="utf-8", buffering=1) if path else None
+        self._stream = stream or sys.stderr
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._partial = ""
+
+    def _emit(self, text):
+        (self._fh or self._stream).write(text)
+
+    def line(self, text):
+        with self._lock:
+            self._emit(f"{self._prefix}{text}\n")
+
+    def rx(self, data: bytes):
+        text = self._decoder.decode(data)
+        if not text:
+            return
+        with self._lock:
+            if not self._prefix:
+                self._emit(text)
+                return
+            text = self._partial + text
+            lines = text.split("\n")
+            self._partial = lines.pop()
+            for ln in lines:
+                self._emit(f"{self._prefix}{ln}\n")
+
+    def close(self):
+        with self._lock:
+            if self._partial:
+                self._emit(f"{self._prefix}{self._partial}\n")
+                self._partial = ""
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+class PortJob:
+    """
+    一个串口上的一次完整运行：打开串口 → SerialLink + ScriptEngine 执行 → 关闭。
+    多个 PortJob 各自在线程中运行；读写线程都阻塞在 select / 队列上，空闲不占 CPU。
+    run_async() 为 asyncio 版本，由 uart_async.run_many_async 在单个线程中并发运行。
+    结果保存在 self.result（可直接序列化为 JSON）；给出 metrics 时另含计时汇总 result["timing"]。
+    """
+
+    def __init__(self, program, port, baud, tr_fn=None, max_lookback=EXPECT_MAX_LOOKBACK,
+                 on_log=None, on_rx=None, metrics=None):
+        self.program = program
+        self.port = port
+        self.baud = baud
+        self._tr = tr_fn or (lambda key, **kw: translate(key, "en", **kw))
+        self._max_lookback = max_lookback
+        self._on_log = on_log
+        self._on_rx = on_rx
+        self.metrics = metrics
+        self._engine = None
+        self._stopped = False
+        self.result = {
+            "port": port,
+            "baud": baud,
+            "ok": False,
+            "code": EXIT_FAILED,
+            "message": "",
+            "steps_total": count_steps(program),
+            "steps_done": 0,
+            "elapsed_s": 0.0,
+        }
+
+    def stop(self):
+        self._stopped = True
+        if self._engine is not None:
+            self._engine.stop()
+
+    def _open(self):
+        """打开串口；失败时记录结果并返回 None"""
+        try:
+            return open_serial(self.port, self.baud)
+        except Exception as e:
+            self.result["code"], self.result["message"] = EXIT_PORT, str(e)
+            if self._on_log is not None:
+                self._on_log(f"[ERROR] {e}")
+            return None
+
+    def _attach(self, link, engine_cls):
+        if self._on_rx is not None:
+            link.subscribe(self._on_rx)
+        engine = engine_cls(self.program, link, self._tr, max_lookback=self._max_lookback, on_log=self._on_log,
+                            metrics=self.metrics)
+        self._engine = engine
+        if self._stopped:
+            engine.stop()
+        return engine
+
+    def _set_outcome(self, ok, msg):
+        self.result["ok"], self.result["message"] = ok, msg
+        self.result["code"] = EXIT_OK if ok else (EXIT_INTERRUPTED if self._stopped else EXIT_FAILED)
+
+    def _finish(self, ser, link, engine, t0):
+        self.result["steps_done"] = engine.steps_done
+        self.result["elapsed_s"] = round(time.monotonic() - t0, 6)
+        if self.metrics is not None:
+            summary = self.result["timing"] = self.metrics.summary()
+            if self._on_log is not None:
+                for line in describe_metrics(summary, self._tr):
+                    self._on_log(line)
+        link.stop()
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+    def run(self):
+        ser = self._open()
+        if ser is None:
+            return self.result
+        link = SerialLink(ser)
+        engine = self._attach(link, ScriptEngine)
+        t0 = time.monotonic()
+        link.start()
+        try:
+            self._set_outcome(*engine.run())
+        except KeyboardInterrupt:
+            engine.stop()
+            self.result["code"], self.result["message"] = EXIT_INTERRUPTED, self._tr("msg_script_stop")
+        finally:
+            self._finish(ser, link, engine, t0)
+        return self.result
+
+    async def run_async(self):
+        """同 run()，但作为协程在事件循环中执行（AsyncSerialLink + AsyncScriptEngine，不创建线程）"""
+        from uart_async import AsyncSerialLink, AsyncScriptEngine
+        ser = self._open()
+        if ser is None:
+            return self.result
+        link = AsyncSerialLink(ser)
+        engine = self._attach(link, AsyncScriptEngine)
+        t0 = time.monotonic()
+        link.start()
+        try:
+            self._set_outcome(*await engine.run())
+        finally:
+            self._finish(ser, link, engine, t0)
+        return self.result
+
+
+def run_many(jobs):
+    """每个串口一个执行线程并发运行；Ctrl-C 时停止全部并等待收尾，返回各自结果"""
+    threads = [threading.Thread(target=job.run, name=f"job-{port_label(job.port)}", daemon=True) for job in jobs]
+    for th in threads:
+        th.start()
+    try:
+        for th in threads:
+            while th.is_alive():
+                th.join(0.5)  # 带超时 join，主线程才能及时响应 Ctrl-C
+    except KeyboardInterrupt:
+        for job in jobs:
+            job.stop()
+        for th in threads:
+            th.join(5)
+    return [job.result for job in jobs]
+
+
+def metrics_path(path, port, multi):
+    """--metrics 的输出文件；多串口时在扩展名前加串口名：steps.csv -> steps_ttyUSB0.csv"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}_{port_label(port)}{path.suffix}") if multi else path
+
+
+def summarize(results, elapsed_s):
+    passed = sum(1 for r in results if r["ok"])
+    return {
+        "ports": len(results),
+        "passed": passed,
+        "failed": len(results) - passed,
+        "steps_done": sum(r["steps_done"] for r in results),
+        "elapsed_s": round(elapsed_s, 6),
+    }
+
+
+def _cli_run(args):
+    ports = list(dict.fromkeys(args.port))  # 去重并保持顺序
+    multi = len(ports) > 1
+    tr = lambda key, **kw: translate(key, args.lang, **kw)
+
+    def fail(message, code):
+        result = {"ok": False, "code": code, "message": message, "script": args.script, "ports": ports}
+        print(json.dumps(result, ensure_ascii=False) if args.json else f"FAIL: {message}")
+        return code
+
+    try:
+        cache = ScriptCache(None if args.no_cache else SCRIPT_CACHE_DIR, max_entries=1)
+        program = cache.load(args.script).program
+    except (OSError, ScriptError) as e:
+        return fail(str(e), EXIT_USAGE)
+
+    log_dir = Path(args.log_dir) if args.log_dir else None
+    if log_dir is not None:
+        try:
+            log_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            return fail(str(e), EXIT_USAGE)
+
+    jobs, logs = [], []
+    for port in ports:
+        label = port_label(port)
+        plog = PortLog(label, path=log_dir / f"{label}.log" if log_dir else None, prefix=multi and not log_dir)
+        logs.append(plog)
+        on_log = None if args.quiet and not log_dir else plog.line
+        on_rx = plog.rx if args.rx and (log_dir or not args.quiet) else None
+        metrics = RunMetrics() if args.metrics else None
+        jobs.append(PortJob(program, port, args.baud, tr, args.lookback, on_log=on_log, on_rx=on_rx, metrics=metrics))
+
+    t0 = time.monotonic()
+    try:
+        if args.engine == "async":
+            from uart_async import run_many_async
+            results = run_many_async(jobs)
+        elif multi:
+            results = run_many(jobs)
+        else:
+            results = [jobs[0].run()]
+    finally:
+        for plog in logs:
+            plog.close()
+    elapsed = time.monotonic() - t0
+    for job in jobs if args.metrics else ():
+        if job.metrics.t0 is None:
+            continue  # 串口没有打开
+        try:
+            job.metrics.write(metrics_path(args.metrics, job.port, multi))
+        except OSError as e:
+            print(f"[WARN] metrics export failed: {e}", file=sys.stderr)
+
+    if not multi:
+        result = dict(results[0], script=args.script)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            print(f"{'PASS' if result['ok'] else 'FAIL'}: {result['message']}")
+        return result["code"]
+
+    summary = summarize(results, elapsed)
+    ok = summary["failed"] == 0
+    if args.json:
+        print(json.dumps({"ok": ok, "script": args.script, "summary": summary, "results": results}, ensure_ascii=False))
+    else:
+        for r in results:
+            print(f"{'PASS' if r['ok'] else 'FAIL'} {r['port']}: {r['message']}")
+        print(f"SUMMARY: {summary['passed']}/{summary['ports']} passed in {summary['elapsed_s']:.3f} s")
+    if ok:
+        return EXIT_OK
+    if any(r["code"] == EXIT_INTERRUPTED for r in results):
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED
+
+
+def _cli_check(args):
+    """只做预检不连接串口：步骤数、DELAY 合计、EXPECT 预算、先用后设的变量"""
+    tr = lambda key, **kw: translate(key, args.lang, **kw)
+    code = EXIT_OK
+    reports = []
+    for path in args.script:
+        try:
+            a = analyze_script(parse_script(Path(path).read_text(encoding="utf-8")))
+        except (OSError, ScriptError) as e:
+            reports.append({"script": path, "ok": False, "message": str(e)})
+            code = EXIT_USAGE
+            if not args.json:
+                print(f"{path}: FAIL: {e}")
+            continue
+        clean = not (a.undefined_vars or a.problems)
+        if args.strict and not clean and code == EXIT_OK:
+            code = EXIT_FAILED
+        report = dict(a._asdict(), script=path, ok=clean or not args.strict,
+                      worst_case_ms=a.delay_ms + a.expect_budget_ms)
+        report["undefined_vars"], report["problems"] = list(a.undefined_vars), list(a.problems)
+        reports.append(report)
+        if not args.json:
+            print(f"{path}:")
+            for line in describe_analysis(a, tr):
+                print(f"  {line}")
+    if args.json:
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, ensure_ascii=False))
+    return code
+
+
+def _cli_library(args):
+    """命令库的 v2 JSON 导入 / 导出（SQLite 库不存在时导入会新建）"""
+    import sqlite3
+    db = Path(args.db) if args.db else COMMANDS_DB
+    lib = None
+    try:
+        if args.action == "import":
+            data = json.loads(Path(args.file).read_text(encoding="utf-8"))
+            lib = SqliteCommandLibrary(db, seed_groups=[])
+            lib.import_v2(data)
+            groups = lib.groups()
+            lib.close()
+            lib = None
+        else:
+            if db.exists():
+                lib = SqliteCommandLibrary(db)
+                lib.check()
+                groups = lib.groups()
+            else:
+                groups = load_groups()  # 只读：不经 JsonCommandLibrary，其 close() 会回写 commands.json
+            atomic_write_text(args.file, json.dumps({"version": 2, "groups": groups}, ensure_ascii=False, indent=2))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"FAIL: {db}: {e}" if isinstance(e, sqlite3.Error) else f"FAIL: {e}")
+        return EXIT_USAGE
+    finally:
+        if lib is not None:
+            lib.close(save=False)  # 导出不修改库；导入出错时回滚，不留下一半的数据
+    total = sum(len(g["commands"]) for g in groups)
+    target = db if args.action == "import" else args.file
+    print(f"{args.action}: {len(groups)} groups, {total} commands -> {target}")
+    return EXIT_OK
+
+
+def build_cli_parser():
+    import argparse
+    ap = argparse.ArgumentParser(prog=APP_NAME, description=f"{APP_NAME} {APP_VERSION} (headless mode)")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run a .uartscript against one or more serial ports without the GUI")
+    run.add_argument("script", help="script file (.uartscript / .txt)")
+    run.add_argument("--port", required=True, action="append",
+                     help="serial device, e.g. /dev/ttyUSB0, or a built-in virtual device "
+                          "virtual:echo|at|stream[:BYTES_PER_S]; repeat to run on several ports concurrently")
+    run.add_argument("--baud", type=int, default=115200)
+    run.add_argument("--lang", choices=sorted(LANGUAGES), default="en", help="language of log/result messages")
+    run.add_argument("--lookback", type=int, default=EXPECT_MAX_LOOKBACK, help="regex EXPECT window in bytes")
+    run.add_argument("--engine", choices=("thread", "async"), default="thread",
+                     help="thread: reader/writer threads per port; async: all ports on one asyncio loop")
+    run.add_argument("--log-dir", help="write one <port>.log per port here instead of logging to stderr")
+    run.add_argument("--json", action="store_true", help="print the result as one JSON object on stdout")
+    run.add_argument("--rx", action="store_true", help="include received data in the log")
+    run.add_argument("-q", "--quiet", action="store_true", help="no step log on stderr")
+    run.add_argument("--no-cache", action="store_true", help="do not read or write the parsed-script cache")
+    run.add_argument("--metrics", metavar="FILE",
+                     help="record per-step timing and write it to FILE (.json: summary + steps, otherwise CSV); "
+                          "with several ports the port name is added before the extension")
+    run.set_defaults(func=_cli_run)
+
+    check = sub.add_parser("check", help="dry-run: step count, DELAY total, EXPECT budget, unset variables")
+    check.add_argument("script", nargs="+", help="script file(s)")
+    check.add_argument("--lang", choices=sorted(LANGUAGES), default="en")
+    check.add_argument("--json", action="store_true", help="print the analysis as JSON on stdout")
+    check.add_argument("--strict", action="store_true", help="exit 1 on unset variables or invalid EXPECT/HEX")
+    check.set_defaults(func=_cli_check)
+
+    lib = sub.add_parser("library", help="import/export the command library as v2 commands.json")
+    lib.add_argument("action", choices=("import", "export"),
+                     help="import: JSON (v1 or v2) -> SQLite library; export: library -> v2 JSON")
+    lib.add_argument("file", help="JSON file to read (import) or write (export)")
+    lib.add_argument("--db", help=f"SQLite library path (default: {COMMANDS_DB.name} next to the program)")
+    lib.set_defaults(func=_cli_library)
+    return ap
+
+
+def cli_main(argv=None):
+    """
+    命令行入口：
+      python linux_free_uart.py run script.uartscript --port /dev/ttyUSB0 [--port ...] --baud 921600
+      python linux_free_uart.py check script.uartscript
+      python linux_free_uart.py library import commands.json [--db commands.sqlite3]
+    """
+    args = build_cli_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(cli_main())